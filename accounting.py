@@ -0,0 +1,207 @@
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+
+try:
+  import fcntl
+except ImportError:
+  # Windows, where each worker writes a file named after its process id instead
+  fcntl = None
+
+# Rolling log of the usage of every agent run, one JSON line each. Empty disables it.
+# Each worker writes its own file, .usage.<slot>.jsonl, since rotation is not safe across processes.
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", ".usage.jsonl")
+USAGE_LOG_MAX_BYTES = int(os.getenv("USAGE_LOG_MAX_BYTES", str(16 * 1024 * 1024)))
+USAGE_LOG_BACKUPS = int(os.getenv("USAGE_LOG_BACKUPS", "5"))
+# System prompts tracked before the least recently used is dropped, /chat takes any prompt
+USAGE_MAX_PROMPTS = int(os.getenv("USAGE_MAX_PROMPTS", "1000"))
+
+# USD per million input and output tokens. List prices when this was written, override with
+# MODEL_PRICES, e.g. "gpt-4o=2.5:10,gemma2-9b-it=0.2:0.2"
+MODEL_PRICES = {
+  "llama-3.3-70b-versatile": (0.59, 0.79),
+  "deepseek-r1-distill-qwen-32b": (0.69, 0.69),
+  "gemma2-9b-it": (0.20, 0.20),
+  "gpt-4o": (2.50, 10.00),
+  **{
+    model.strip(): tuple(float(price) for price in prices.split(":"))
+    for model, prices in (item.split("=") for item in os.getenv("MODEL_PRICES", "").split(",") if item.strip())
+  }
+}
+
+COUNTERS = ("requests", "prompt_tokens", "completion_tokens", "model_calls", "iterations", "tool_calls", "cost")
+
+
+def cost_of(model, prompt_tokens, completion_tokens):
+  input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+  return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def prompt_id(system_prompt):
+  return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+# The log file of this worker and the lock that holds it. Each worker takes the lowest slot no running
+# worker holds, so a restarted worker carries on with the files of the one it replaces and the number of
+# files stays that of the workers running at once. The lock is released when the process exits.
+def claim_log_path(path):
+  root, ext = os.path.splitext(path)
+  if fcntl is None:
+    return f"{root}.{os.getpid()}{ext}", None
+  for slot in itertools.count():
+    lock = open(f"{root}.{slot}.lock", "a")
+    try:
+      fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+      lock.close()
+      continue
+    return f"{root}.{slot}{ext}", lock
+
+
+# Every worker's log file and their rotated backups
+def log_files(path):
+  root, ext = os.path.splitext(path)
+  pattern = f"{glob.escape(root)}.*{glob.escape(ext)}"
+  return sorted(set(glob.glob(pattern) + glob.glob(f"{pattern}.*") + glob.glob(f"{glob.escape(path)}*")))
+
+
+def new_totals():
+  return dict.fromkeys(COUNTERS, 0)
+
+
+def add(totals, entry):
+  totals["requests"] += 1
+  for key in COUNTERS[1:]:
+    totals[key] += entry[key]
+
+
+# Totals sorted by cost, the costliest first
+def ranked(groups, top=None):
+  rows = [{"key": key, **totals} for key, totals in groups.items()]
+  rows.sort(key=lambda row: (row["cost"], row["prompt_tokens"] + row["completion_tokens"]), reverse=True)
+  return rows[:top] if top else rows
+
+
+# Token, tool call and cost totals of agent runs per model, route, system prompt and outcome,
+# and the rolling log they are written to. Runs that were cancelled or failed are counted too, they were paid for.
+class UsageLedger:
+  def __init__(self, path=USAGE_LOG_PATH, max_bytes=USAGE_LOG_MAX_BYTES, backups=USAGE_LOG_BACKUPS, max_prompts=USAGE_MAX_PROMPTS):
+    self.log_path = path
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.max_prompts = max_prompts
+    self.totals = new_totals()
+    self.by_model = {}
+    self.by_route = {}
+    self.by_outcome = {}
+    # prompt id -> totals with the start of the prompt, least recently used first
+    self.by_prompt = OrderedDict()
+    self.lock = threading.Lock()
+    # The log file is opened on the first run, so importing this module writes nothing
+    self.path = None
+    self.slot_lock = None
+    self.log = None
+
+  def open_log(self):
+    self.path, self.slot_lock = claim_log_path(self.log_path)
+    # A logger of its own so the lines do not reach the app's log handlers
+    log = logging.getLogger(f"usage.{id(self)}")
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    self.log = log
+
+  def record(self, model, route, system_prompt, usage, request_id=None):
+    entry = {
+      "time": round(time.time(), 3),
+      "request_id": request_id,
+      "route": route or "",
+      "model": model,
+      "prompt_id": prompt_id(system_prompt),
+      "prompt_tokens": usage["prompt_tokens"],
+      "completion_tokens": usage["completion_tokens"],
+      "model_calls": usage["model_calls"],
+      "iterations": usage["iterations"],
+      "tool_calls": usage["tool_calls"],
+      "cost": cost_of(model, usage["prompt_tokens"], usage["completion_tokens"]),
+      "outcome": usage.get("outcome", "ok")
+    }
+
+    with self.lock:
+      add(self.totals, entry)
+      add(self.by_model.setdefault(model, new_totals()), entry)
+      add(self.by_route.setdefault(entry["route"], new_totals()), entry)
+      add(self.by_outcome.setdefault(entry["outcome"], new_totals()), entry)
+
+      totals = self.by_prompt.get(entry["prompt_id"])
+      if totals is None:
+        totals = self.by_prompt[entry["prompt_id"]] = {"prompt": system_prompt[:80], **new_totals()}
+        while len(self.by_prompt) > self.max_prompts:
+          self.by_prompt.popitem(last=False)
+      self.by_prompt.move_to_end(entry["prompt_id"])
+      add(totals, entry)
+
+      if self.log is None and self.log_path:
+        self.open_log()
+
+    if self.log is not None:
+      self.log.info(json.dumps({**entry, "prompt": system_prompt[:80], "estimated_tokens": usage.get("estimated_tokens", False)}))
+    return entry
+
+  def report(self, top=20):
+    with self.lock:
+      return {
+        "totals": dict(self.totals),
+        "by_model": ranked(self.by_model),
+        "by_route": ranked(self.by_route),
+        "by_outcome": ranked(self.by_outcome),
+        "by_system_prompt": ranked(self.by_prompt, top)
+      }
+
+  def stats(self):
+    with self.lock:
+      return {
+        **self.totals,
+        "by_model": {model: dict(totals) for model, totals in self.by_model.items()},
+        "by_route": {route: dict(totals) for route, totals in self.by_route.items()},
+        "by_outcome": {outcome: dict(totals) for outcome, totals in self.by_outcome.items()}
+      }
+
+
+usage_ledger = UsageLedger()
+
+
+# Costliest routes and system prompts in the rolling log, over every worker and restart:
+#   python accounting.py .usage.jsonl [top]
+def summarize(path, top=10):
+  groups = {"model": {}, "route": {}, "outcome": {}, "prompt": {}}
+  prompts = {}
+  for name in log_files(path):
+    with open(name, encoding="utf-8") as f:
+      for line in f:
+        entry = json.loads(line)
+        prompts[entry["prompt_id"]] = entry.get("prompt", "")
+        keys = (("model", entry["model"]), ("route", entry["route"]), ("outcome", entry.get("outcome", "ok")), ("prompt", entry["prompt_id"]))
+        for group, key in keys:
+          add(groups[group].setdefault(key, new_totals()), entry)
+
+  for group, totals in groups.items():
+    print(f"\nby {group}")
+    print(f"{'requests':>9}{'prompt tok':>12}{'output tok':>12}{'tools':>7}{'cost $':>10}  {group}")
+    for row in ranked(totals, top):
+      label = f"{row['key']} {prompts[row['key']]!r}" if group == "prompt" else row["key"]
+      print(f"{row['requests']:>9}{row['prompt_tokens']:>12}{row['completion_tokens']:>12}{row['tool_calls']:>7}{row['cost']:>10.4f}  {label}")
+
+
+if __name__ == "__main__":
+  summarize(sys.argv[1] if len(sys.argv) > 1 else USAGE_LOG_PATH, int(sys.argv[2]) if len(sys.argv) > 2 else 10)
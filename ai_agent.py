@@ -1,11 +1,21 @@
-import os 
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
-from langchain_groq import ChatGroq
-from langchain_openai import ChatOpenAI
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langgraph.prebuilt import create_react_agent
-from langchain_core.messages.ai import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.callbacks import BaseCallbackHandler
+from search_cache import CachedSearchTool, start_request_search_stats
+from limits import upstream_limiters
+from conversation import ConversationStore, count_tokens
+from metrics import Histogram, register, span, record_span, current_trace
+from deadline import time_left, exceeded, mark_partial
+from accounting import usage_ledger
 
 # Load API keys
 load_dotenv()
@@ -14,34 +24,553 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Setup required LLMs and Tools
-# gpt_model = ChatOpenAI(model='gpt-4o')
-# groq_model = ChatGroq(model='llama-3.3-70b-versatile')
-search_tool = TavilySearchResults(max_results=2)
+logger = logging.getLogger(__name__)
+
+# Max number of compiled agents kept in memory
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "32"))
+
+# Search rounds an agent may run before it has to answer with what it found,
+# and seconds one model call may take
+AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "5"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))
+
+# What create_react_agent answers when it runs out of steps while the model still wants to search
+OUT_OF_STEPS_ANSWER = "Sorry, need more steps to process this request."
+FINAL_ANSWER_PROMPT = "Stop searching now. Answer the question with the search results you already have."
+
+# Setup required LLMs and Tools.
+# The provider, tool and LangGraph modules take seconds to import, so each is imported on first use
+# and a worker only loads the providers it calls. Set to stubs by the benchmarks.
+ChatGroq = None
+ChatOpenAI = None
+
+# Shared search tool used by every agent that is allowed to search,
+# with cached results and pooled connections, see get_search_tool
+search_tool = None
+
+# Per-chat conversation history, used when a run is given a thread id
+conversations = ConversationStore()
+
+prompt_tokens = register(Histogram(
+  "aichatbot_prompt_tokens",
+  "Prompt tokens per request, summed over every model call of the ReAct loop",
+  ["model"],
+  buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+))
+completion_tokens = register(Histogram(
+  "aichatbot_completion_tokens",
+  "Completion tokens per request, summed over every model call of the ReAct loop",
+  ["model"],
+  buckets=(25, 50, 100, 250, 500, 1000, 2000, 4000)
+))
+
+
+def chat_model_class(provider):
+  global ChatGroq, ChatOpenAI
+  if provider == "Groq":
+    if ChatGroq is None:
+      from langchain_groq import ChatGroq
+    return ChatGroq
+  if provider == "OpenAI":
+    if ChatOpenAI is None:
+      from langchain_openai import ChatOpenAI
+    return ChatOpenAI
+  raise ValueError(f"Unknown model provider: {provider}")
+
+
+def get_search_tool():
+  global search_tool
+  if search_tool is None:
+    from langchain_community.tools.tavily_search import TavilySearchResults
+    search_tool = CachedSearchTool(TavilySearchResults(max_results=2))
+  return search_tool
+
+
+# LRU registry of compiled agents and LLM clients
+class AgentRegistry:
+  def __init__(self, max_size=AGENT_CACHE_SIZE):
+    self.max_size = max_size
+    self.agents = OrderedDict()
+    # LLM clients hold the pooled HTTP connections, so they are kept per model
+    self.llms = {}
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.lock = threading.Lock()
+
+  def get_llm(self, provider, llm_id):
+    key = (provider, llm_id)
+    llm = self.llms.get(key)
+
+    if llm is None:
+      # Select LLM provider based on choice, every model call waits for the provider's rate limit
+      # OpenAI only reports token usage of streamed answers when asked to
+      options = {"stream_usage": True} if provider == "OpenAI" else {}
+      llm = chat_model_class(provider)(model=llm_id, rate_limiter=upstream_limiters[provider.lower()], timeout=LLM_CALL_TIMEOUT, **options)
+
+      self.llms[key] = llm
+
+    return llm
+
+  def get_agent(self, llm_id, provider, allow_search, system_prompt, memory=False):
+    prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    key = (provider, llm_id, bool(allow_search), prompt_hash, bool(memory))
+
+    with self.lock:
+      agent = self.agents.get(key)
+
+      if agent is not None:
+        self.hits += 1
+        self.agents.move_to_end(key)
+        return agent
+
+      self.misses += 1
+
+      with span("agent_build", name=llm_id):
+        from langgraph.prebuilt import create_react_agent
+        llm = self.get_llm(provider, llm_id)
+
+        # Define tools available for AI Agent to use
+        tools = [get_search_tool()] if allow_search else []
+
+        # Create the agent
+        agent = create_react_agent(
+          model=llm,
+          tools=tools,
+          state_modifier=system_prompt,
+          checkpointer=conversations.checkpointer if memory else None
+        )
+
+      self.agents[key] = agent
+
+      # Evict least recently used agents over the cap
+      while len(self.agents) > self.max_size:
+        self.agents.popitem(last=False)
+        self.evictions += 1
+
+      return agent
+
+  def stats(self):
+    with self.lock:
+      return {
+        "size": len(self.agents),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "llm_clients": len(self.llms)
+      }
+
+
+agent_registry = AgentRegistry()
+
+
+def get_agent_cache_stats():
+  return agent_registry.stats()
+
+
+# Build an agent ahead of its first request, loading the modules it needs
+def build_agent(llm_id, provider, allow_search, system_prompt, memory=False):
+  return agent_registry.get_agent(llm_id=llm_id, provider=provider, allow_search=allow_search, system_prompt=system_prompt, memory=memory)
+
+
+def log_search_stats(llm_id, stats):
+  if stats["searches"]:
+    logger.info(f"Search stats for {llm_id}: {stats['searches']} searches, {stats['cache_hits']} cache hits, {stats['seconds']:.2f}s")
+
+
+# Records each LLM turn and tool call of a ReAct run as a span, and the tokens and tool calls of the run
+class TraceCallbackHandler(BaseCallbackHandler):
+  run_inline = True
+
+  def __init__(self, llm_id, usage=None):
+    self.llm_id = llm_id
+    self.usage = usage
+    self.trace = current_trace.get()
+    self.started = {}
+
+  def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+    self.started[run_id] = ("llm", self.llm_id, time.perf_counter())
+    if self.usage is not None:
+      self.usage["model_calls"] += 1
+      self.usage["estimated"] += sum(count_tokens(batch) for batch in messages)
+
+  def on_llm_end(self, response, *, run_id, **kwargs):
+    self.finish(run_id)
+    if self.usage is not None:
+      for generations in response.generations:
+        for generation in generations:
+          message = getattr(generation, "message", None)
+          metadata = getattr(message, "usage_metadata", None) or {}
+          tool_calls = getattr(message, "tool_calls", None) or []
+          self.usage["prompt_tokens"] += metadata.get("input_tokens", 0)
+          self.usage["completion_tokens"] += metadata.get("output_tokens", 0)
+          self.usage["estimated_completion"] += len(generation.text) // 4 + sum(len(str(call.get("args", ""))) // 4 for call in tool_calls)
+          # A turn that asks for tools is one search round of the ReAct loop
+          self.usage["iterations"] += int(bool(tool_calls))
+
+  def on_llm_error(self, error, *, run_id, **kwargs):
+    self.finish(run_id, error)
+
+  def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+    name = kwargs.get("name") or (serialized or {}).get("name", "tool")
+    self.started[run_id] = ("tool", name, time.perf_counter())
+    if self.usage is not None:
+      self.usage["tool_calls"] += 1
+
+  def on_tool_end(self, output, *, run_id, **kwargs):
+    self.finish(run_id)
+
+  def on_tool_error(self, error, *, run_id, **kwargs):
+    self.finish(run_id, error)
+
+  def finish(self, run_id, error=None):
+    started = self.started.pop(run_id, None)
+    if started is None:
+      return
+    stage, name, start = started
+    record_span(stage, time.perf_counter() - start, name, type(error).__name__ if error else None, self.trace)
+
+
+# Each search round is a model step and a tool step. With two more steps the agent ends with
+# OUT_OF_STEPS_ANSWER when the model still wants to search, instead of raising GraphRecursionError.
+def trace_config(llm_id, thread_id=None, usage=None):
+  config = {"callbacks": [TraceCallbackHandler(llm_id, usage)], "recursion_limit": 2 * AGENT_MAX_ITERATIONS + 2}
+  if thread_id is not None:
+    config["configurable"] = {"thread_id": str(thread_id)}
+  return config
+
+
+# Compact the chat's history if needed before the new turn is added
+async def prepare_conversation(agent, config, provider, llm_id, thread_id):
+  conversations.touch(thread_id)
+  with span("compaction", name=llm_id):
+    before, after = await conversations.compact(agent, config, agent_registry.get_llm(provider, llm_id))
+  return {"history_tokens_before": before, "history_tokens": after}, await conversations.message_ids(agent, config)
+
+
+# Tokens reported by the provider, or estimated when it reports none, added to the
+# totals per model, route and system prompt. outcome says whether the run answered, was cancelled or failed.
+def record_usage(llm_id, system_prompt, usage, outcome="ok"):
+  if "outcome" in usage:
+    return usage
+  usage["outcome"] = outcome
+  estimated = {"prompt_tokens": usage.pop("estimated"), "completion_tokens": usage.pop("estimated_completion")}
+  for key, value in estimated.items():
+    if not usage[key] and value:
+      usage[key] = value
+      usage["estimated_tokens"] = True
+  prompt_tokens.observe(usage["prompt_tokens"], model=llm_id)
+  completion_tokens.observe(usage["completion_tokens"], model=llm_id)
+
+  trace = current_trace.get()
+  entry = usage_ledger.record(llm_id, trace["route"] if trace else None, system_prompt, usage, trace["request_id"] if trace else None)
+  usage["cost"] = entry["cost"]
+
+  message = (f"Tokens for {llm_id}: {usage['prompt_tokens']} prompt, {usage['completion_tokens']} completion over "
+             f"{usage['model_calls']} model calls and {usage['tool_calls']} tool calls, ${usage['cost']:.5f}")
+  if usage["history_tokens_before"]:
+    message += f", history {usage['history_tokens']} tokens ({usage['history_tokens_before'] - usage['history_tokens']} removed by compaction)"
+  logger.info(message)
+  return usage
+
+
+def new_usage():
+  return {
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "model_calls": 0,
+    "iterations": 0,
+    "tool_calls": 0,
+    "estimated": 0,
+    "estimated_completion": 0,
+    "history_tokens_before": 0,
+    "history_tokens": 0
+  }
+
+
+# Record a cached answer in the chat's history so follow-up questions can refer to it
+async def remember_turn(llm_id, provider, allow_search, system_prompt, thread_id, question, answer):
+  agent = agent_registry.get_agent(
+    llm_id=llm_id,
+    provider=provider,
+    allow_search=allow_search,
+    system_prompt=system_prompt,
+    memory=True
+  )
+  conversations.touch(thread_id)
+  await conversations.append(agent, trace_config(llm_id, thread_id), question, answer)
+
+
+async def has_conversation(llm_id, provider, allow_search, system_prompt, thread_id):
+  agent = agent_registry.get_agent(
+    llm_id=llm_id,
+    provider=provider,
+    allow_search=allow_search,
+    system_prompt=system_prompt,
+    memory=True
+  )
+  state = await agent.aget_state(trace_config(llm_id, thread_id))
+  return bool((state.values or {}).get("messages"))
+
+
+async def clear_conversation(thread_id):
+  await conversations.clear(thread_id)
+
+
+def get_conversation_stats():
+  return conversations.stats()
+
+
+# Events of an agent run until the agent's share of the request deadline runs out,
+# then the run is cancelled along with its model and search calls and TimeoutError is raised
+async def until_deadline(events):
+  try:
+    while True:
+      try:
+        yield await asyncio.wait_for(events.__anext__(), time_left("agent"))
+      except StopAsyncIteration:
+        return
+  finally:
+    await events.aclose()
+
+
+# Messages added after the latest question
+def current_turn(messages):
+  for i in range(len(messages) - 1, -1, -1):
+    if isinstance(messages[i], HumanMessage):
+      return messages[i + 1:]
+  return messages
+
+
+def source_urls(tool_outputs):
+  urls = []
+  for output in tool_outputs:
+    for url in re.findall(r"https?://[^\s'\"\]\)},]+", str(output)):
+      if url not in urls:
+        urls.append(url)
+  return urls
+
+
+# Answer for a run cut short by the deadline: whatever the model already said, or the sources it found
+def best_effort_answer(text, tool_outputs):
+  if text.strip():
+    return text
+  urls = source_urls(tool_outputs)[:3]
+  if urls:
+    return "I ran out of time before finishing this check. Sources found so far: " + " ".join(urls)
+  return "I ran out of time before finishing this check, please try again."
+
+
+# Ask the model, without tools, to answer from the searches it already made
+def final_answer_prompt(system_prompt, messages):
+  # Leave out tool calls that never got a result, providers reject them
+  answered = {message.tool_call_id for message in messages if isinstance(message, ToolMessage)}
+  messages = [
+    message for message in messages
+    if message.content != OUT_OF_STEPS_ANSWER
+    and not any(call["id"] not in answered for call in getattr(message, "tool_calls", None) or [])
+  ]
+  return [SystemMessage(content=system_prompt), *messages, HumanMessage(content=FINAL_ANSWER_PROMPT)]
+
+
+# Keep a cut short turn in the chat's history as just the question and the answer given
+async def save_partial_turn(agent, config, known_ids, query, answer):
+  await conversations.rollback(agent, config, known_ids)
+  await conversations.append(agent, config, " ".join(query), answer)
+
 
 # Define a function to generate response from the AI Agent
 def get_response_from_ai_agent(llm_id, provider, allow_search, query, system_prompt):
-  
-  # Select LLM provider based on choice
-  if provider == "Groq":
-    llm = ChatGroq(model=llm_id)
-  elif provider == "OpenAI":
-    llm = ChatOpenAI(model=llm_id)
-      
-  # Define tools available for AI Agent to use
-  tools = [TavilySearchResults(max_results=2)] if allow_search else []
-  
-  # Create the agent
-  agent = create_react_agent(
-    model=llm,
-    tools=tools,
-    state_modifier=system_prompt
+
+  # Reuse a compiled agent for this configuration
+  agent = agent_registry.get_agent(
+    llm_id=llm_id,
+    provider=provider,
+    allow_search=allow_search,
+    system_prompt=system_prompt
   )
-  
+
   # Generate and return response
+  search_stats = start_request_search_stats()
+  usage = new_usage()
   state={"messages": query}
-  response = agent.invoke(state)
+  response = agent.invoke(state, config=trace_config(llm_id, usage=usage))
+  log_search_stats(llm_id, search_stats)
+  record_usage(llm_id, system_prompt, usage)
   messages = response.get("messages")
   ai_messages = [message.content for message in messages if isinstance(message, AIMessage)]
-  
+
   return ai_messages[-1]
+
+
+# Async version used by the backend routes so the event loop is never blocked.
+# With a thread_id the agent continues that chat's conversation.
+async def aget_response_from_ai_agent(llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+  from langgraph.errors import GraphRecursionError
+
+  # Reuse a compiled agent for this configuration
+  agent = agent_registry.get_agent(
+    llm_id=llm_id,
+    provider=provider,
+    allow_search=allow_search,
+    system_prompt=system_prompt,
+    memory=thread_id is not None
+  )
+  usage = new_usage()
+  try:
+    config = trace_config(llm_id, thread_id, usage)
+    if thread_id is not None:
+      history, known_ids = await prepare_conversation(agent, config, provider, llm_id, thread_id)
+      usage.update(history)
+
+    # Generate and return response, keeping the latest state in case the deadline cuts the run short
+    search_stats = start_request_search_stats()
+    state={"messages": query}
+    messages = []
+    partial = None
+    try:
+      async for values in until_deadline(agent.astream(state, config=config, stream_mode="values")):
+        messages = values["messages"]
+    except TimeoutError:
+      partial = "deadline"
+    except GraphRecursionError:
+      messages = [*messages, AIMessage(content=OUT_OF_STEPS_ANSWER)]
+    except Exception:
+      if thread_id is not None:
+        await conversations.rollback(agent, config, known_ids)
+      raise
+    log_search_stats(llm_id, search_stats)
+
+    turn = current_turn(messages)
+    tool_outputs = [message.content for message in turn if isinstance(message, ToolMessage)]
+    answer = turn[-1].content if turn and isinstance(turn[-1], AIMessage) else ""
+
+    if partial is None and answer == OUT_OF_STEPS_ANSWER:
+      partial = "max_iterations"
+      try:
+        llm = agent_registry.get_llm(provider, llm_id)
+        response = await asyncio.wait_for(
+          llm.ainvoke(final_answer_prompt(system_prompt, messages), config={"callbacks": config["callbacks"]}),
+          time_left("agent")
+        )
+        answer = response.content
+      except TimeoutError:
+        exceeded("agent")
+        answer = best_effort_answer("", tool_outputs)
+
+    elif partial == "deadline":
+      exceeded("agent")
+      answer = best_effort_answer("", tool_outputs)
+
+    if partial is not None:
+      mark_partial(partial)
+      logger.warning(f"Answer from {llm_id} cut short ({partial}) after {usage['model_calls']} model calls")
+      if thread_id is not None:
+        await save_partial_turn(agent, config, known_ids, query, answer)
+
+    record_usage(llm_id, system_prompt, usage)
+    return answer
+  except (asyncio.CancelledError, GeneratorExit):
+    # E.g. the slower run of a hedged request, its tokens were still spent
+    record_usage(llm_id, system_prompt, usage, outcome="cancelled")
+    raise
+  except Exception:
+    record_usage(llm_id, system_prompt, usage, outcome="error")
+    raise
+
+
+# Stream tokens and tool events from the AI Agent as they are produced, then the prompt token usage.
+# An answer cut short is followed by a partial event saying why.
+async def astream_response_from_ai_agent(llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+  from langgraph.errors import GraphRecursionError
+
+  # Reuse a compiled agent for this configuration
+  agent = agent_registry.get_agent(
+    llm_id=llm_id,
+    provider=provider,
+    allow_search=allow_search,
+    system_prompt=system_prompt,
+    memory=thread_id is not None
+  )
+  usage = new_usage()
+  try:
+    config = trace_config(llm_id, thread_id, usage)
+    if thread_id is not None:
+      history, known_ids = await prepare_conversation(agent, config, provider, llm_id, thread_id)
+      usage.update(history)
+
+    search_stats = start_request_search_stats()
+    state={"messages": query}
+    # Answer text since the last tool call, and what the searches returned
+    text = ""
+    tool_outputs = []
+    messages = []
+    partial = None
+    try:
+      async for event in until_deadline(agent.astream_events(state, config=config, version="v2")):
+        kind = event["event"]
+
+        if kind == "on_chat_model_stream":
+          content = event["data"]["chunk"].content
+          if content:
+            text += content
+            yield {"type": "token", "content": content}
+
+        elif kind == "on_tool_start":
+          text = ""
+          yield {"type": "tool_call", "name": event["name"], "input": event["data"].get("input")}
+
+        elif kind == "on_tool_end":
+          tool_outputs.append(event["data"].get("output"))
+          yield {"type": "tool_result", "name": event["name"], "output": str(event["data"].get("output"))}
+
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+          # Final state of the whole graph
+          messages = (event["data"].get("output") or {}).get("messages", [])
+    except TimeoutError:
+      partial = "deadline"
+    except GraphRecursionError:
+      # Without the final state there is nothing to ask the model about, answer with the sources
+      partial = "max_iterations"
+    except Exception:
+      if thread_id is not None:
+        await conversations.rollback(agent, config, known_ids)
+      raise
+    log_search_stats(llm_id, search_stats)
+
+    answer = text
+    if partial is None and messages and messages[-1].content == OUT_OF_STEPS_ANSWER:
+      # Out of search rounds, stream an answer from what was found instead
+      partial = "max_iterations"
+      answer = ""
+      llm = agent_registry.get_llm(provider, llm_id)
+      try:
+        async for chunk in until_deadline(llm.astream(final_answer_prompt(system_prompt, messages), config={"callbacks": config["callbacks"]})):
+          if chunk.content:
+            answer += chunk.content
+            yield {"type": "token", "content": chunk.content}
+      except TimeoutError:
+        exceeded("agent")
+
+    elif partial == "deadline":
+      exceeded("agent")
+
+    if partial is not None:
+      if not answer.strip():
+        answer = best_effort_answer("", tool_outputs)
+        yield {"type": "token", "content": answer}
+      mark_partial(partial)
+      logger.warning(f"Answer from {llm_id} cut short ({partial}) after {usage['model_calls']} model calls")
+      if thread_id is not None:
+        await save_partial_turn(agent, config, known_ids, query, answer)
+      yield {"type": "partial", "reason": partial}
+
+    yield {"type": "usage", **record_usage(llm_id, system_prompt, usage)}
+  except (asyncio.CancelledError, GeneratorExit):
+    # E.g. the slower run of a hedged request, its tokens were still spent
+    record_usage(llm_id, system_prompt, usage, outcome="cancelled")
+    raise
+  except Exception:
+    record_usage(llm_id, system_prompt, usage, outcome="error")
+    raise
@@ -1,20 +1,248 @@
 import uvicorn
 import os
+import copy
+import argparse
 import base64
-import requests
+import httpx
 import json
+import re
+import time
+import asyncio
+import hashlib
+import itertools
+import logging
 
+from collections import deque
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import List, Optional
-from fastapi import FastAPI, Response, status
-from ai_agent import get_response_from_ai_agent
-from jigsawstack import JigsawStack
+from typing import List, Literal, Optional
+from fastapi import FastAPI, Request, Response, status
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+from ai_agent import aget_response_from_ai_agent, astream_response_from_ai_agent, get_agent_cache_stats
+from ai_agent import remember_turn, has_conversation, clear_conversation, get_conversation_stats, build_agent
+from tts_cache import TTSCache, cache_key, key_with_extension, normalize_text
+from singleflight import SingleFlight
+from audio import stitch_mp3, audio_format, OpusEncoder, transcode_to_opus, FFMPEG_PATH, OPUS_BITRATE
+from search_cache import get_search_stats
+from verdict_cache import VerdictCache, SharedVerdictCache, normalize_claim
+from response_cache import ResponseCache, response_key, RESPONSE_CACHE_PATH
+from model_router import ModelRouter, MODEL_PROVIDERS, answered_by
+from job_queue import JobQueue, JobWorkers
+from limits import AdmissionMiddleware, ClientRateLimiter, ConcurrencyLimiter, upstream_limiters, get_upstream_stats
+from metrics import span, current_trace, new_request_id, start_trace, finish_trace, render_metrics
+from accounting import usage_ledger
+from deadline import start_deadline, time_left, exceeded, mark_partial, partial_reason
 from dotenv import load_dotenv
 
 # Load key
 load_dotenv()
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+JIGSAWSTACK_TTS_URL = "https://api.jigsawstack.com/v1/ai/tts"
+WHATSAPP_SERVER_URL = "http://localhost:3001/reply"
+
+# Fact-check prompts of /whatsapp, and of /tele and /verify/batch which share their verdicts
+WHATSAPP_PROMPT = "Acting as fact checker, you will verify if the query is real or fake. Use and provide reputable sources and answer in singlish"
+FACT_CHECK_PROMPT = "Acting as fact checker, you will verify if the query is real or fake using reputable sources. Provide your sources and answer in singlish"
+# Model of the agent that reads /tele conversations, whichever model answers
+TELE_CONVERSATION_MODEL = "llama-3.3-70b-versatile"
+# Hedge new /tele claims: a second model is started when the first is slower than usual and the first answer wins,
+# see ROUTER_HEDGE_DELAY. Follow-ups in a conversation are never hedged, both runs would write to its history.
+TELE_HEDGE = os.getenv("TELE_HEDGE", "0") == "1"
+
+# Build the default fact-check agent when a worker starts, before it accepts requests, so the first
+# /tele request does not wait for its provider, search and LangGraph modules to load. Off by default.
+WARMUP = os.getenv("WARMUP", "0") == "1"
+
+# Sentence chunks synthesized at once per request, and the shortest chunk sent to TTS
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", "4"))
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "80"))
+
+# Claims verified at once by /verify/batch, and the most claims accepted per batch
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+BATCH_MAX_CLAIMS = int(os.getenv("BATCH_MAX_CLAIMS", "1000"))
+
+# Requests handled at once per route, and requests allowed to wait for a slot, before new ones get a 503.
+# Limits are per server worker.
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "64"))
+TELE_MAX_CONCURRENCY = int(os.getenv("TELE_MAX_CONCURRENCY", "32"))
+TELE_MAX_QUEUE = int(os.getenv("TELE_MAX_QUEUE", "64"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "2"))
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "0"))
+# Seconds a request may wait for a slot before it gets a 503
+ADMISSION_WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", "10"))
+
+# Requests per minute and burst allowed per Telegram chat, and per client IP, before a 429. 0 turns it off.
+# The IP limit is off by default since the Streamlit frontend sends every user's requests from one address.
+CHAT_RATE_LIMIT_PER_MINUTE = float(os.getenv("CHAT_RATE_LIMIT_PER_MINUTE", "20"))
+CHAT_RATE_LIMIT_BURST = float(os.getenv("CHAT_RATE_LIMIT_BURST", "5"))
+IP_RATE_LIMIT_PER_MINUTE = float(os.getenv("IP_RATE_LIMIT_PER_MINUTE", "0"))
+IP_RATE_LIMIT_BURST = float(os.getenv("IP_RATE_LIMIT_BURST", "20"))
+
+# Audio sent to the WhatsApp relay: "opus" voice notes, or the "mp3" from the TTS API
+WHATSAPP_AUDIO_FORMAT = os.getenv("WHATSAPP_AUDIO_FORMAT", "opus")
+
+# WhatsApp replies waiting in the job queue before new claims get a 503
+WHATSAPP_MAX_QUEUE_DEPTH = int(os.getenv("WHATSAPP_MAX_QUEUE_DEPTH", "1000"))
+
+# Public base URL of this server. When set, the Telegram bot runs here in webhook mode (see tele_bot.py)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+
+# Shared async HTTP client for TTS and the WhatsApp relay
+http_client = None
+
+# Cache of generated speech keyed on (normalized text, voice)
+tts_cache = TTSCache()
+
+# SQLite file holding caches shared by every server worker, set automatically when serving with --workers
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+
+# Cache of fact-check verdicts that also matches near-duplicate claims
+verdict_cache = SharedVerdictCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else VerdictCache()
+
+# Opt-in cache of /chat answers, on when RESPONSE_CACHE_PATH is set
+response_cache = ResponseCache(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+
+# Picks the model for each agent run and fails over between models
+model_router = ModelRouter()
+
+# Identical concurrent agent runs and TTS calls share one in-flight computation
+agent_flights = SingleFlight()
+tts_flights = SingleFlight()
+
+# Recent time-to-first-token samples for /chat/stream, in seconds
+ttft_samples = deque(maxlen=1000)
+
+# Persistent queue of WhatsApp replies still to be generated and delivered
+job_queue = JobQueue()
+job_workers = None
+
+# Telegram bot served through /telegram/webhook, None unless TELEGRAM_WEBHOOK_URL is set
+telegram_bot = None
+
+# Outcome of the warm-up, reported by /ready
+warmup = {"ready": False, "seconds": None, "agents": 0, "errors": []}
+
+
+# The default fact-check agent: the first routed model with the /tele prompt. The other models
+# and prompts are built on first use, so a worker only loads the providers it calls.
+def warm_up():
+  start = time.perf_counter()
+  warmup.update(ready=False, agents=0, errors=[])
+  model = model_router.models[0]
+  
+  try:
+    build_agent(model, MODEL_PROVIDERS[model], True, FACT_CHECK_PROMPT, False)
+    warmup["agents"] += 1
+  except Exception as e:
+    # e.g. a provider without an API key, the router falls back to the other models
+    logger.warning(f"Warm-up could not build the {model} agent: {e!r}")
+    warmup["errors"].append(f"{model}: {type(e).__name__}")
+  
+  warmup["seconds"] = round(time.perf_counter() - start, 3)
+  warmup["ready"] = warmup["agents"] > 0
+  logger.info(f"Warm-up built {warmup['agents']} agents in {warmup['seconds']}s")
+
+
+@asynccontextmanager
+async def lifespan(app):
+  global http_client, job_workers, telegram_bot
+  http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+  )
+  # Uvicorn only accepts connections once this returns, so no request meets a cold worker
+  if WARMUP:
+    warm_up()
+  else:
+    warmup["ready"] = True
+  job_queue.prune()
+  job_workers = JobWorkers(job_queue, {"whatsapp": deliver_whatsapp_reply})
+  job_workers.start()
+  if TELEGRAM_WEBHOOK_URL:
+    # Only needed in webhook mode, so the backend runs without python-telegram-bot otherwise
+    import tele_bot
+    telegram_bot = tele_bot.WebhookBot(
+      tele_bot.TOKEN, app, TELEGRAM_WEBHOOK_URL, tele_bot.TELEGRAM_API_URL, tele_bot.TELEGRAM_WEBHOOK_SECRET
+    )
+    await telegram_bot.start()
+  yield
+  if telegram_bot is not None:
+    await telegram_bot.stop()
+  await job_workers.stop()
+  await http_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Admission control, added before the tracing middleware so rejected requests are still traced
+chat_limiter = ConcurrencyLimiter("/chat", CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE, ADMISSION_WAIT_TIMEOUT)
+admission_limiters = {
+  "/chat": chat_limiter,
+  "/chat/stream": chat_limiter,
+  "/tele": ConcurrencyLimiter("/tele", TELE_MAX_CONCURRENCY, TELE_MAX_QUEUE, ADMISSION_WAIT_TIMEOUT),
+  "/verify/batch": ConcurrencyLimiter("/verify/batch", BATCH_MAX_CONCURRENCY, BATCH_MAX_QUEUE, ADMISSION_WAIT_TIMEOUT)
+}
+client_rate_limiters = {
+  "chat": ClientRateLimiter(CHAT_RATE_LIMIT_PER_MINUTE, CHAT_RATE_LIMIT_BURST),
+  "ip": ClientRateLimiter(IP_RATE_LIMIT_PER_MINUTE, IP_RATE_LIMIT_BURST)
+}
+# /whatsapp is left out, every claim comes from the one relay
+app.add_middleware(
+  AdmissionMiddleware,
+  limiters=admission_limiters,
+  rate_limiters=client_rate_limiters,
+  rate_limited=("/chat", "/chat/stream", "/tele", "/verify/batch")
+)
+
+
+# Trace every request under an id, taken from X-Request-ID when the caller sends one.
+# The trace is finished when the last chunk of the body is sent, so streamed responses are timed in full.
+class TraceMiddleware:
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      return await self.app(scope, receive, send)
+
+    request_id = Headers(scope=scope).get("x-request-id") or new_request_id()
+    trace = start_trace(request_id, scope["path"])
+    # Time budget shared by the agent, its searches and TTS
+    start_deadline()
+    status_code = 500
+    finished = False
+
+    def finish():
+      nonlocal finished
+      if finished:
+        return
+      finished = True
+      # Label by route template so /audio/{audio_id} is a single series, and 404s share one
+      # instead of a series per path a scanner tries
+      route = scope.get("route")
+      trace["route"] = route.path if route is not None else "unmatched"
+      finish_trace(trace, status_code)
+
+    async def traced_send(message):
+      nonlocal status_code
+      if message["type"] == "http.response.start":
+        status_code = message["status"]
+        MutableHeaders(scope=message).append("X-Request-ID", request_id)
+      await send(message)
+      if message["type"] == "http.response.body" and not message.get("more_body", False):
+        finish()
+
+    try:
+      await self.app(scope, receive, traced_send)
+    finally:
+      finish()
+
+
+app.add_middleware(TraceMiddleware)
 
 # List of approved models
 ALLOWED_MODELS = [
@@ -33,22 +261,58 @@ class RequestState(BaseModel):
   allow_search: bool
   tts_enabled: Optional[bool] = False
   voice: Optional[str] = "en-SG-female-1"
+  # "base64" inlines the audio in the JSON, "url" returns an id to fetch from /audio/{audio_id}
+  audio_mode: Optional[Literal["base64", "url"]] = "base64"
+  # How the answer may use the response cache: "default", "bypass", "refresh" or "only-if-cached"
+  cache_control: Optional[Literal["default", "bypass", "refresh", "only-if-cached"]] = "default"
+
+
+# Batch Request Schema
+class BatchRequest(BaseModel):
+  claims: List[str]
+  tts_enabled: Optional[bool] = True
+  audio_mode: Optional[Literal["base64", "url"]] = "url"
   
   
-def get_TTS_file(text, voice):
+async def synthesize_speech(text, voice):
+  # Skip the API entirely if this text was already spoken. The cache reads the disk tier shared with
+  # the other workers, so off the event loop, like every TTS cache call that may touch the disk.
+  audio_binary = await asyncio.to_thread(tts_cache.get, text, voice)
+  if audio_binary is not None:
+    return audio_binary
+  
+  return await tts_flights.do(cache_key(text, voice), fetch_speech, text, voice)
+
+
+async def fetch_speech(text, voice):
   try:
-    # Get TTS from api
-    jigsawstack = JigsawStack(api_key=os.getenv("JIGSAWSTACK_API_KEY"))
-    response = jigsawstack.audio.text_to_speech({
-      "text": text,
-      "accent": voice
-    })
+    # Get TTS from api, within the JigsawStack quota
+    async with upstream_limiters["jigsawstack"]:
+      with span("tts", name=voice):
+        response = await http_client.post(
+          JIGSAWSTACK_TTS_URL,
+          json={
+            "text": text,
+            "accent": voice
+          },
+          headers={"x-api-key": os.getenv("JIGSAWSTACK_API_KEY", "")}
+        )
+        response.raise_for_status()
     
   except Exception as e:
-    print(f"Error generating Speech from API: {str(e)}")
+    logger.error(f"Error generating Speech from API: {str(e)}")
     return None
   
   audio_binary = response.content
+  await asyncio.to_thread(tts_cache.put, text, voice, audio_binary)
+  
+  return audio_binary
+
+
+async def get_TTS_file(text, voice):
+  audio_binary = await synthesize_speech(text, voice)
+  if audio_binary is None:
+    return None
   
   # Encode binary audio as base64
   audio_base64 = base64.b64encode(audio_binary).decode('utf-8')
@@ -56,31 +320,395 @@ def get_TTS_file(text, voice):
   return audio_base64
   
   
+# Run the AI Agent, joining an identical run that is already in flight.
+# The router picks the model, starting with llm_id when one is given.
+# remember(model, text, seconds) is called once per run, see with_partial_reason.
+async def run_agent(allow_search, query, system_prompt, llm_id=None, remember=None):
+  key = (llm_id, bool(allow_search), system_prompt, tuple(normalize_text(message) for message in query))
+  
+  text, partial = await agent_flights.do(
+    key,
+    with_partial_reason,
+    model_router.run,
+    " ".join(query),
+    aget_response_from_ai_agent,
+    preferred=llm_id,
+    allow_search=allow_search,
+    query=query,
+    system_prompt=system_prompt,
+    remember=remember
+  )
+  mark_partial(partial, count=False)
+  return text
+
+
+# Run fn and return its result with the reason it was cut short, if it was,
+# so requests that joined the run learn it too. A whole answer is passed to remember(model, result, seconds)
+# with the model that gave it, off the event loop, by the run only and not by every request that joined it.
+async def with_partial_reason(fn, *args, remember=None, **kwargs):
+  start = time.perf_counter()
+  result = await fn(*args, **kwargs)
+  reason = partial_reason()
+  if remember is not None and reason is None:
+    await asyncio.to_thread(remember, answered_by.get(), result, time.perf_counter() - start)
+  return result, reason
+
+
+# Partial answer flag for a response
+def partial_fields():
+  reason = partial_reason()
+  return {"partial": True, "partial_reason": reason} if reason is not None else {}
+
+
+# Synthesize sentence chunks as they arrive, a few at a time, and stitch them in order.
+# With an encoder, the chunks are also transcoded into a voice note as each one is ready.
+class SpeechPipeline:
+  def __init__(self, voice, max_parallel=TTS_MAX_PARALLEL, min_chars=TTS_CHUNK_MIN_CHARS, encoder=None):
+    self.voice = voice
+    self.min_chars = min_chars
+    self.semaphore = asyncio.Semaphore(max_parallel)
+    self.pending = ""
+    self.tasks = []
+    self.encoder = encoder
+    self.encoding = None
+    self.voice_note = None
+  
+  def add(self, sentence):
+    self.pending = f"{self.pending} {sentence}".strip()
+    # Merge short sentences so each TTS call gets a reasonable chunk
+    if len(self.pending) >= self.min_chars:
+      self.flush()
+  
+  def flush(self):
+    if self.pending:
+      task = asyncio.create_task(self.synthesize(self.pending))
+      self.tasks.append(task)
+      if self.encoder is not None:
+        self.encoding = asyncio.create_task(self.encode(task, self.encoding))
+    self.pending = ""
+  
+  async def synthesize(self, text):
+    async with self.semaphore:
+      return await synthesize_speech(text, self.voice)
+  
+  # Feed a chunk to the encoder once it and the ones before it are ready, so the early
+  # sentences are encoded while the later ones are still being synthesized
+  async def encode(self, task, previous):
+    if previous is not None and not await previous:
+      return False
+    segment = await task
+    if segment is None:
+      return False
+    await self.encoder.feed(segment)
+    return True
+  
+  def cancel(self):
+    if self.encoding is not None:
+      self.encoding.cancel()
+      self.encoder.abort()
+      # The chunks after this start a new voice note, not one chained onto the cancelled encoding
+      self.encoding = None
+      self.encoder = OpusEncoder(self.encoder.bitrate, self.encoder.complexity, self.encoder.ffmpeg)
+    for task in self.tasks:
+      task.cancel()
+    self.tasks = []
+    self.pending = ""
+  
+  # Stitch the chunks in order. Chunks not ready within timeout seconds are dropped
+  # along with the ones after them, keeping the audio of the sentences before.
+  async def finish(self, timeout=None):
+    self.flush()
+    if not self.tasks:
+      return None
+    
+    if self.encoder is not None:
+      return await self.finish_encoding(timeout)
+    
+    done, pending = await asyncio.wait(self.tasks, timeout=timeout)
+    ready = list(itertools.takewhile(lambda task: task in done, self.tasks))
+    segments = [task.result() for task in ready]
+    if pending:
+      for task in pending:
+        task.cancel()
+      exceeded("tts")
+      mark_partial("deadline")
+    
+    if not segments or any(segment is None for segment in segments):
+      return None
+    
+    with span("stitch"):
+      return stitch_mp3(segments)
+  
+  # Same as finish. The chunks were fed to the encoder as they came in, only what is left is encoded here.
+  async def finish_encoding(self, timeout=None):
+    try:
+      encoded = await asyncio.wait_for(asyncio.shield(self.encoding), timeout)
+    except asyncio.TimeoutError:
+      exceeded("tts")
+      mark_partial("deadline")
+      encoded = True
+    except Exception as e:
+      # The MP3 is still sent, voice_note() tries the transcoding again on the whole file
+      logger.error(f"Error transcoding voice note: {e!r}")
+      encoded = False
+    finally:
+      self.encoding.cancel()
+      for task in self.tasks:
+        task.cancel()
+    
+    ready = list(itertools.takewhile(lambda task: task.done() and not task.cancelled(), self.tasks))
+    segments = [task.result() for task in ready]
+    if not segments or any(segment is None for segment in segments):
+      self.encoder.abort()
+      return None
+    
+    if encoded and self.encoder.segments:
+      # Past the deadline a chunk may have come in after the last one fed, keep both files the same
+      segments = segments[:self.encoder.segments]
+      try:
+        with span("transcode"):
+          self.voice_note = await self.encoder.finish()
+      except Exception as e:
+        logger.error(f"Error transcoding voice note: {e!r}")
+    else:
+      self.encoder.abort()
+    
+    with span("stitch"):
+      return stitch_mp3(segments)
+
+
+# Stream the AI Agent and start TTS on each sentence while the rest is still generating
+# With a thread_id the agent continues that conversation, and the prompt token usage is written to usage
+# With with_voice_note the audio is also transcoded while it is synthesized, see voice_note()
+async def generate_with_speech(llm_id, provider, allow_search, query, system_prompt, voice, thread_id=None, usage=None, with_voice_note=False):
+  pipeline = SpeechPipeline(voice, encoder=OpusEncoder() if with_voice_note and FFMPEG_PATH else None)
+  text = ""
+  buffer = ""
+  
+  try:
+    async for event in astream_response_from_ai_agent(
+      llm_id=llm_id,
+      provider=provider,
+      allow_search=allow_search,
+      query=query,
+      system_prompt=system_prompt,
+      thread_id=thread_id
+    ):
+      if event["type"] == "token":
+        text += event["content"]
+        buffer += event["content"]
+        sentences, buffer = split_sentences(buffer)
+        for sentence in sentences:
+          pipeline.add(sentence)
+      
+      elif event["type"] == "tool_call":
+        # Tokens before a tool call are the model thinking, not the answer
+        text = ""
+        buffer = ""
+        pipeline.cancel()
+      
+      elif event["type"] == "usage" and usage is not None:
+        usage.update({key: value for key, value in event.items() if key != "type"})
+    
+    pipeline.add(buffer)
+    audio = await pipeline.finish(time_left())
+  
+  except BaseException:
+    pipeline.cancel()
+    raise
+  
+  # Past the deadline the audio may stop before the text does, so it is not cached under the text
+  if pipeline.voice_note is not None and partial_reason() is None:
+    await asyncio.to_thread(tts_cache.put, text, voice_note_voice(voice), pipeline.voice_note, "ogg")
+  return text, audio
+
+
+# Run the AI Agent with pipelined TTS, joining an identical run that is already in flight.
+# With hedge a slow model gets a second one started alongside it.
+# remember(model, text, seconds) is called once per run, as in run_agent.
+async def run_agent_with_speech(allow_search, query, system_prompt, voice, llm_id=None, with_voice_note=False, hedge=False, remember=None):
+  key = (llm_id, bool(allow_search), system_prompt, tuple(normalize_text(message) for message in query), voice)
+  
+  (text, audio), partial = await agent_flights.do(
+    key,
+    with_partial_reason,
+    model_router.run_hedged if hedge else model_router.run,
+    " ".join(query),
+    generate_with_speech,
+    preferred=llm_id,
+    allow_search=allow_search,
+    query=query,
+    system_prompt=system_prompt,
+    voice=voice,
+    with_voice_note=with_voice_note,
+    # The run's result is the text and its audio, remember only takes the text
+    remember=(lambda model, result, seconds: remember(model, result[0], seconds)) if remember is not None else None
+  )
+  mark_partial(partial, count=False)
+  return text, audio
+
+
+# Voice notes are cached next to the MP3 of the same text, under their own voice
+def voice_note_voice(voice):
+  return f"{voice}:opus:{OPUS_BITRATE}"
+
+
+# Post-processing for Telegram and WhatsApp: the answer's MP3 as an OGG/Opus voice note,
+# several times smaller. Falls back to the MP3 when there is no encoder or it fails.
+async def voice_note(text, audio, voice):
+  cached = await asyncio.to_thread(tts_cache.get, text, voice_note_voice(voice), "ogg")
+  if cached is not None:
+    return cached
+  if FFMPEG_PATH is None:
+    return audio
+  
+  try:
+    with span("transcode"):
+      note = await transcode_to_opus(audio)
+  except Exception as e:
+    logger.error(f"Error transcoding voice note: {e!r}")
+    return audio
+  
+  if partial_reason() is None:
+    await asyncio.to_thread(tts_cache.put, text, voice_note_voice(voice), note, "ogg")
+  return note
+
+
+# Cache a verdict with the key of its audio, the audio itself goes in the TTS cache.
+# The caches write to SQLite and disk, and may wait on other workers' locks, so off the event loop.
+async def remember_verdict(namespace, claim, text, audio, voice):
+  audio_key = await asyncio.to_thread(tts_cache.put, text, voice, audio)
+  await asyncio.to_thread(verdict_cache.put, namespace, claim, text, audio_key)
+
+
+def read_file(path):
+  with open(path, "rb") as f:
+    return f.read()
+
+
+# The audio of a cached verdict, synthesized again when the TTS cache has evicted it since
+async def verdict_audio(cached, voice):
+  audio, path = await asyncio.to_thread(tts_cache.locate, cached["audio_key"]) if cached["audio_key"] else (None, None)
+  if audio is None and path is not None:
+    try:
+      audio = await asyncio.to_thread(read_file, path)
+    except OSError:
+      audio = None
+  if audio is None:
+    audio = await synthesize_speech(cached["text"], voice)
+  return audio
+
+
+# Build the audio part of a response in the requested transport mode
+async def audio_payload(text, audio_binary, voice, audio_mode):
+  kind = audio_format(audio_binary)
+  if audio_mode == "url":
+    audio_id = cache_key(text, voice_note_voice(voice) if kind == "ogg" else voice, kind)
+    # Audio cut short by the deadline is kept under its own hash, so it is only served to this request
+    # and never taken for the whole text's
+    if partial_reason() is not None:
+      audio_id = key_with_extension(hashlib.sha256(audio_binary).hexdigest(), kind)
+    if not tts_cache.contains(audio_id):
+      await asyncio.to_thread(tts_cache.store, audio_id, audio_binary)
+    
+    return {
+      "audio_id": audio_id,
+      "audio_url": f"/audio/{audio_id}",
+      "audio_format": kind
+    }
+  
+  with span("encode"):
+    return {"audio": base64.b64encode(audio_binary).decode('utf-8'), "audio_format": kind}
+
+
+# Split text into complete sentences and the unfinished remainder
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_sentences(text):
+  parts = SENTENCE_END.split(text)
+  return [part for part in parts[:-1] if part.strip()], parts[-1]
+
+
+# Percentile of an already sorted list of samples
+def percentile(samples, q):
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def get_ttft_stats():
+  samples = sorted(ttft_samples)
+  if not samples:
+    return {"count": 0}
+  
+  return {
+    "count": len(samples),
+    "avg": sum(samples) / len(samples),
+    "p50": percentile(samples, 0.5),
+    "p95": percentile(samples, 0.95)
+  }
+  
   
 # Routes
 @app.post("/chat")
-def get_LLM_response(request: RequestState):
+async def get_LLM_response(request: RequestState):
   # Check if selected model is allowed
   if request.model_name not in ALLOWED_MODELS:
     return {"error": "invalid model chosen. Choose a valid LLM"}
   
-  # Get response from AI Agent
-  text_response = get_response_from_ai_agent(
-    llm_id=request.model_name,
-    provider=request.model_provider,
-    allow_search=request.allow_search,
-    system_prompt=request.system_prompt,
-    query=request.messages
-  )
+  # Reuse the answer to an identical request when the cache is on and cache_control allows it
+  key = response_key(request.model_name, request.system_prompt, request.messages, request.allow_search)
+  cached = await asyncio.to_thread(response_cache.get, key, request.cache_control) if response_cache is not None else None
+  if cached is None and request.cache_control == "only-if-cached":
+    return Response(
+      content=json.dumps({"error": "Response not cached"}),
+      media_type= "application/json",
+      status_code= status.HTTP_504_GATEWAY_TIMEOUT
+    )
   
-  if request.tts_enabled == False:
-    return {"text": text_response}
+  # Stored by the run only, not by every request that joined it, and under the model that answered,
+  # which is not the one asked for after a fallback. A partial answer is not worth reusing.
+  def remember(model, text, seconds):
+    if response_cache is not None:
+      response_cache.put(
+        response_key(model, request.system_prompt, request.messages, request.allow_search),
+        model,
+        request.allow_search,
+        [request.system_prompt, *request.messages],
+        text,
+        seconds,
+        request.cache_control
+      )
+  
+  if cached is not None:
+    text_response = cached["text"]
+    if request.tts_enabled:
+      audio = await synthesize_speech(text=text_response, voice=request.voice)
   
-  # Get TTS audio file
-  audio = get_TTS_file(text=text_response, voice=request.voice)
+  elif request.tts_enabled == False:
+    # Get response from AI Agent
+    text_response = await run_agent(
+      llm_id=request.model_name,
+      allow_search=request.allow_search,
+      system_prompt=request.system_prompt,
+      query=request.messages,
+      remember=remember
+    )
+  
+  else:
+    # Get response from AI Agent with the TTS audio synthesized sentence by sentence
+    text_response, audio = await run_agent_with_speech(
+      llm_id=request.model_name,
+      allow_search=request.allow_search,
+      system_prompt=request.system_prompt,
+      query=request.messages,
+      voice=request.voice,
+      remember=remember
+    )
+  
+  if request.tts_enabled == False:
+    return {"text": text_response, "cached": cached is not None, **partial_fields()}
   
   if audio is None:
-    print("Error generating TTS file")
+    logger.error("Error generating TTS file")
     return Response(
       content=json.dumps({
         "text": text_response,
@@ -93,86 +721,289 @@ def get_LLM_response(request: RequestState):
     
   return {
     "text": text_response,
-    "audio": audio
+    **(await audio_payload(text_response, audio, request.voice, request.audio_mode)),
+    "cached": cached is not None,
+    **partial_fields()
   }
     
-@app.post("/whatsapp")
-def verify_message_from_whatsapp(request: List[str]):
-  # Set up AI Agent
-  name = "llama-3.3-70b-versatile"
-  provider = "Groq"
-  system_prompt = "Acting as fact checker, you will verify if the query is real or fake. Use and provide reputable sources and answer in singlish"
-  allow_search = True
-  voice = "en-SG-female-1"
+@app.post("/chat/stream")
+async def stream_LLM_response(request: RequestState):
+  # Check if selected model is allowed
+  if request.model_name not in ALLOWED_MODELS:
+    return {"error": "invalid model chosen. Choose a valid LLM"}
   
-  # Get response from AI Agent
-  response = get_response_from_ai_agent(
-    llm_id=name,
-    provider=provider,
-    system_prompt=system_prompt,
-    query=request,
-    allow_search=allow_search
+  async def event_stream():
+    start = time.perf_counter()
+    ttft = None
+    text = ""
+    buffer = ""
+    tts_tasks = deque()
+    
+    # Send audio for finished sentences in order, as soon as they are ready
+    def ready_tts_tasks(wait=False):
+      events = []
+      while tts_tasks and (wait or tts_tasks[0][1].done()):
+        events.append(tts_tasks.popleft())
+      return events
+    
+    async def audio_event(item):
+      sentence, task = item
+      audio = await task
+      if audio is None:
+        return json.dumps({"type": "audio", "audio": None, "error": "Failed to generate audio"}) + "\n"
+      return json.dumps({"type": "audio", **(await audio_payload(sentence, audio, request.voice, request.audio_mode))}) + "\n"
+    
+    try:
+      # Falls back to another model if the chosen one fails before its first token
+      async for event in model_router.astream(
+        " ".join(request.messages),
+        astream_response_from_ai_agent,
+        preferred=request.model_name,
+        allow_search=request.allow_search,
+        system_prompt=request.system_prompt,
+        query=request.messages
+      ):
+        if event["type"] == "token":
+          if ttft is None:
+            ttft = time.perf_counter() - start
+            ttft_samples.append(ttft)
+            yield json.dumps({"type": "ttft", "seconds": ttft}) + "\n"
+          
+          text += event["content"]
+          buffer += event["content"]
+          
+          # Start TTS for each sentence as soon as it is complete
+          if request.tts_enabled:
+            sentences, buffer = split_sentences(buffer)
+            for sentence in sentences:
+              tts_tasks.append((sentence, asyncio.create_task(synthesize_speech(text=sentence, voice=request.voice))))
+        
+        elif event["type"] in ("tool_call", "fallback"):
+          # Tokens before a tool call are the model thinking, not the answer, so their audio is dropped too
+          text = ""
+          buffer = ""
+          for _, task in tts_tasks:
+            task.cancel()
+          tts_tasks.clear()
+        
+        yield json.dumps(event, default=str) + "\n"
+        
+        for item in ready_tts_tasks():
+          yield await audio_event(item)
+      
+      # Synthesize whatever is left after the last sentence break
+      if request.tts_enabled and buffer.strip():
+        tts_tasks.append((buffer, asyncio.create_task(synthesize_speech(text=buffer, voice=request.voice))))
+      
+      # Wait for the last sentences' audio while the deadline allows, and drop the audio
+      # from the first unfinished sentence on so the clips that are sent still play in order
+      if tts_tasks:
+        _, pending = await asyncio.wait([task for _, task in tts_tasks], timeout=time_left())
+        if pending:
+          exceeded("tts")
+          mark_partial("deadline")
+          while any(task in pending for _, task in tts_tasks):
+            tts_tasks.pop()[1].cancel()
+      
+      for item in ready_tts_tasks(wait=True):
+        yield await audio_event(item)
+      
+      yield json.dumps({
+        "type": "done",
+        "text": text,
+        "ttft": ttft,
+        "seconds": time.perf_counter() - start,
+        **partial_fields()
+      }) + "\n"
+    
+    except Exception as e:
+      logger.exception(f"Error streaming response: {str(e)}")
+      yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+    
+    finally:
+      for _, task in tts_tasks:
+        task.cancel()
+  
+  return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+  
+    
+@app.post("/whatsapp", status_code=status.HTTP_202_ACCEPTED)
+async def verify_message_from_whatsapp(request: List[str]):
+  # Turn claims away while the queue is this far behind, the relay retries them later
+  depth = await asyncio.to_thread(job_queue.depth, "whatsapp")
+  if depth >= WHATSAPP_MAX_QUEUE_DEPTH:
+    return Response(
+      content=json.dumps({"error": "server overloaded", "reason": "queue_full"}),
+      media_type= "application/json",
+      status_code= status.HTTP_503_SERVICE_UNAVAILABLE,
+      headers={"Retry-After": "30"}
+    )
+  
+  # Queue the claim and reply once the job is stored, the verdict is delivered to the relay later
+  trace = current_trace.get()
+  job_id = await job_workers.enqueue(
+    "whatsapp",
+    {"claim": request, "request_id": trace["request_id"] if trace else new_request_id()}
   )
   
-  # Get TTS audio file
-  audio = get_TTS_file(text=response, voice=voice)
+  return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/whatsapp/jobs/{job_id}")
+def get_whatsapp_job(job_id: int):
+  job = job_queue.get(job_id)
   
-  if audio is None:
-    print("Error generating TTS file")
+  if job is None:
     return Response(
-      content=json.dumps({
-        "text": response,
-        "audio": None,
-        "error": "Failed to generate audio"
-      }),
+      content=json.dumps({"error": "Job not found"}),
       media_type= "application/json",
-      status_code= status.HTTP_500_INTERNAL_SERVER_ERROR
+      status_code= status.HTTP_404_NOT_FOUND
     )
+  
+  return job
+
+
+# Requeue dead-lettered replies, e.g. after the relay was down for longer than the retries cover
+@app.post("/whatsapp/jobs/retry")
+def retry_dead_whatsapp_jobs():
+  return {"requeued": job_queue.retry_dead("whatsapp")}
+
+
+# Job handler: raising makes the queue retry the job with backoff
+async def deliver_whatsapp_reply(payload):
+  request = payload["claim"]
+  trace = start_trace(payload["request_id"], "job:whatsapp")
+  start_deadline()
+  status_code = 500
+  try:
+    status_code = await verify_and_relay(request)
+  finally:
+    finish_trace(trace, status_code)
+
+
+async def verify_and_relay(request):
+  # Set up AI Agent, the model router picks the model
+  system_prompt = WHATSAPP_PROMPT
+  allow_search = True
+  voice = "en-SG-female-1"
+  claim = " ".join(request)
+  
+  # Reuse the verdict for this claim or a near-duplicate of it
+  with span("verdict_lookup"):
+    cached = await asyncio.to_thread(verdict_cache.get, "whatsapp", claim)
+  
+  if cached is not None:
+    response = cached["text"]
+    audio = await verdict_audio(cached, voice)
+  
+  else:
+    # Get response from AI Agent with the TTS audio synthesized sentence by sentence
+    response, audio = await run_agent_with_speech(
+      system_prompt=system_prompt,
+      query=request,
+      allow_search=allow_search,
+      voice=voice,
+      with_voice_note=WHATSAPP_AUDIO_FORMAT == "opus"
+    )
+    if audio is not None and partial_reason() is None:
+      await remember_verdict("whatsapp", claim, response, audio, voice)
+  
+  if audio is None:
+    raise RuntimeError("Failed to generate audio")
+  
+  if WHATSAPP_AUDIO_FORMAT == "opus":
+    audio = await voice_note(response, audio, voice)
     
   # Send file to whatsapp server
   request_to_server = {
     "text": response,
-    "audio": audio
+    **(await audio_payload(response, audio, voice, "base64")),
+    **partial_fields()
   }
   
   headers = {
     'Content-Type': 'application/json'
   }
   
-  server_url = "http://localhost:3001/reply"
-  
-  server_response = requests.post(
-    server_url, 
-    json=request_to_server,
-    headers=headers
-  )
+  with span("relay"):
+    server_response = await http_client.post(
+      WHATSAPP_SERVER_URL,
+      json=request_to_server,
+      headers=headers
+    )
+    server_response.raise_for_status()
   
   return server_response.status_code
 
 
+# With chat_id the claim and its verdict are added to that chat's conversation. With follow_up as well,
+# e.g. a reply to one of the bot's answers, the claim is answered with the conversation's context.
 @app.post("/tele")
-def verify_message_from_telegram(request: List[str]):
-  # Set up AI Agent
-  name = "llama-3.3-70b-versatile"
-  provider = "Groq"
-  system_prompt = "Acting as fact checker, you will verify if the query is real or fake using reputable sources. Provide your sources and answer in singlish"
+async def verify_message_from_telegram(
+  request: List[str],
+  audio_mode: Literal["base64", "url"] = "base64",
+  chat_id: Optional[str] = None,
+  follow_up: bool = False,
+  audio_format: Literal["mp3", "opus"] = "mp3"
+):
+  # Set up AI Agent, the model router picks the model.
+  # Conversations are kept per chat whichever model answers, name and provider only pick the agent that reads them.
+  name = TELE_CONVERSATION_MODEL
+  provider = MODEL_PROVIDERS[name]
+  system_prompt = FACT_CHECK_PROMPT
   allow_search = True
   voice = "en-SG-female-1"
+  claim = " ".join(request)
+  thread_id = f"tele:{chat_id}" if chat_id is not None else None
+  opus = audio_format == "opus"
   
-  # Get response from AI Agent
-  response = get_response_from_ai_agent(
-    llm_id=name,
-    provider=provider,
-    system_prompt=system_prompt,
-    query=request,
-    allow_search=allow_search
-  )
+  # A follow-up only makes sense with the chat's history, so only new claims can share verdicts
+  standalone = thread_id is None or not follow_up or not await has_conversation(name, provider, allow_search, system_prompt, thread_id)
   
-  # Get TTS audio file
-  audio = get_TTS_file(text=response, voice=voice)
+  # Reuse the verdict for this claim or a near-duplicate of it
+  cached = None
+  if standalone:
+    with span("verdict_lookup"):
+      cached = await asyncio.to_thread(verdict_cache.get, "tele", claim)
+  
+  # Otherwise get the response from the AI Agent with the TTS audio synthesized sentence by sentence
+  usage = None
+  if cached is not None:
+    response = cached["text"]
+    audio = await verdict_audio(cached, voice)
+    if thread_id is not None:
+      await remember_turn(name, provider, allow_search, system_prompt, thread_id, claim, response)
+  elif standalone:
+    response, audio = await run_agent_with_speech(
+      system_prompt=system_prompt,
+      query=request,
+      allow_search=allow_search,
+      voice=voice,
+      with_voice_note=opus,
+      hedge=TELE_HEDGE
+    )
+    # Kept in the chat's history so a later follow-up can ask about it
+    if thread_id is not None:
+      await remember_turn(name, provider, allow_search, system_prompt, thread_id, claim, response)
+  else:
+    usage = {}
+    response, audio = await model_router.run(
+      claim,
+      generate_with_speech,
+      system_prompt=system_prompt,
+      query=request,
+      allow_search=allow_search,
+      voice=voice,
+      thread_id=thread_id,
+      usage=usage,
+      with_voice_note=opus
+    )
+  # A partial answer is not a verdict worth sharing
+  if audio is not None and standalone and cached is None and partial_reason() is None:
+    await remember_verdict("tele", claim, response, audio, voice)
   
   if audio is None:
-    print("Error generating TTS file")
+    logger.error("Error generating TTS file")
     return Response(
       content=json.dumps({
         "text": response,
@@ -183,15 +1014,259 @@ def verify_message_from_telegram(request: List[str]):
       status_code= status.HTTP_500_INTERNAL_SERVER_ERROR
     )
   
+  if opus:
+    audio = await voice_note(response, audio, voice)
+  
   return {
     "text": response,
-    "audio": audio
+    **(await audio_payload(response, audio, voice, audio_mode)),
+    **({"usage": usage} if usage else {}),
+    **partial_fields()
   }
+
+
+# Forget a chat's conversation, used by the Telegram bot's /clear
+@app.delete("/tele/conversations/{chat_id}")
+async def clear_telegram_conversation(chat_id: str):
+  await clear_conversation(f"tele:{chat_id}")
+  return {"cleared": chat_id}
+
+
+# Updates pushed by Telegram in webhook mode. The bot replies through the Bot API, and calls /tele
+# in process, so this returns as soon as the update is queued.
+@app.post("/telegram/webhook")
+async def telegram_webhook(request: Request):
+  if telegram_bot is None:
+    return Response(
+      content=json.dumps({"error": "Telegram webhook is not enabled"}),
+      media_type= "application/json",
+      status_code= status.HTTP_404_NOT_FOUND
+    )
+  
+  if not telegram_bot.authorized(request.headers.get("x-telegram-bot-api-secret-token")):
+    return Response(
+      content=json.dumps({"error": "Invalid secret token"}),
+      media_type= "application/json",
+      status_code= status.HTTP_403_FORBIDDEN
+    )
+  
+  await telegram_bot.process(await request.json())
+  return {"ok": True}
+  
+
+@app.post("/verify/batch")
+async def verify_batch(request: BatchRequest):
+  if len(request.claims) > BATCH_MAX_CLAIMS:
+    return {"error": f"too many claims. Send at most {BATCH_MAX_CLAIMS} per batch"}
+  
+  # Set up AI Agent, same as /tele so verdicts are shared with it
+  system_prompt = FACT_CHECK_PROMPT
+  allow_search = True
+  voice = "en-SG-female-1"
+  
+  # Duplicate claims in the batch are verified once
+  groups = {}
+  for index, claim in enumerate(request.claims):
+    groups.setdefault(normalize_claim(claim), []).append(index)
+  
+  workers = asyncio.Semaphore(BATCH_MAX_WORKERS)
+  
+  async def verify(indices):
+    claim = request.claims[indices[0]]
+    text, audio, error, cached = None, None, None, None
+    
+    async with workers:
+      start = time.perf_counter()
+      # Each claim gets its own deadline, counted from when a worker picks it up
+      start_deadline()
+      try:
+        cached = await asyncio.to_thread(verdict_cache.get, "tele", claim)
+        
+        if cached is not None:
+          text = cached["text"]
+          audio = await verdict_audio(cached, voice) if request.tts_enabled else None
+        
+        elif request.tts_enabled:
+          text, audio = await run_agent_with_speech(
+            system_prompt=system_prompt,
+            query=[claim],
+            allow_search=allow_search,
+            voice=voice
+          )
+          if audio is not None and partial_reason() is None:
+            await remember_verdict("tele", claim, text, audio, voice)
+        
+        else:
+          text = await run_agent(
+            system_prompt=system_prompt,
+            query=[claim],
+            allow_search=allow_search
+          )
+      
+      except Exception as e:
+        logger.exception(f"Error verifying claim in batch: {str(e)}")
+        error = str(e)
+      
+      return indices, text, audio, error, cached is not None, time.perf_counter() - start, partial_fields()
+  
+  async def result_stream():
+    start = time.perf_counter()
+    latencies = []
+    tasks = [asyncio.create_task(verify(indices)) for indices in groups.values()]
+    
+    try:
+      # Send each result as soon as it is ready
+      for next_done in asyncio.as_completed(tasks):
+        indices, text, audio, error, cached, seconds, partial = await next_done
+        latencies.append(seconds)
+        
+        for index in indices:
+          item = {
+            "type": "result",
+            "index": index,
+            "claim": request.claims[index],
+            "text": text,
+            "cached": cached,
+            "seconds": seconds,
+            **partial
+          }
+          
+          if error is not None:
+            item["error"] = error
+          elif request.tts_enabled and audio is None:
+            item["audio"] = None
+            item["error"] = "Failed to generate audio"
+          elif request.tts_enabled:
+            item.update(await audio_payload(text, audio, voice, request.audio_mode))
+          
+          yield json.dumps(item) + "\n"
+      
+      elapsed = time.perf_counter() - start
+      latencies.sort()
+      yield json.dumps({
+        "type": "summary",
+        "items": len(request.claims),
+        "unique": len(groups),
+        "seconds": elapsed,
+        "throughput": len(request.claims) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5) if latencies else None,
+        "p95": percentile(latencies, 0.95) if latencies else None
+      }) + "\n"
+    
+    finally:
+      for task in tasks:
+        task.cancel()
+  
+  return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+AUDIO_MEDIA_TYPES = {"mp3": "audio/mpeg", "ogg": "audio/ogg"}
+
+
+@app.get("/audio/{audio_id}")
+def get_audio(audio_id: str):
+  audio, path = tts_cache.locate(audio_id)
+  
+  if audio is not None:
+    return Response(content=audio, media_type=AUDIO_MEDIA_TYPES[audio_format(audio)])
+  
+  # Stream straight from the disk cache without loading the whole file
+  if path is not None:
+    with open(path, "rb") as f:
+      media_type = AUDIO_MEDIA_TYPES[audio_format(f.read(4))]
+    return FileResponse(path, media_type=media_type)
+  
+  return Response(
+    content=json.dumps({"error": "Audio not found"}),
+    media_type= "application/json",
+    status_code= status.HTTP_404_NOT_FOUND
+  )
+
+
+# Readiness probe: 200 once the worker has warmed up, 503 when the default fact-check agent could not be built
+@app.get("/ready")
+def get_ready():
+  if not warmup["ready"]:
+    return Response(
+      content=json.dumps(warmup),
+      media_type= "application/json",
+      status_code= status.HTTP_503_SERVICE_UNAVAILABLE
+    )
   
+  return warmup
+
+
+@app.get("/metrics")
+def get_metrics():
+  return PlainTextResponse(render_metrics(get_stats()), media_type="text/plain; version=0.0.4")
+
+
+# Tokens, tool calls and cost of the agent runs of this worker, per model, route and system prompt, costliest first
+@app.get("/usage")
+def get_usage(top: int = 20):
+  return usage_ledger.report(top)
+
+
+@app.get("/stats")
+def get_stats():
+  return {
+    "agents": get_agent_cache_stats(),
+    "ttft": get_ttft_stats(),
+    "tts_cache": tts_cache.stats(),
+    "verdict_cache": verdict_cache.stats(),
+    "usage": usage_ledger.stats(),
+    "response_cache": response_cache.stats() if response_cache is not None else None,
+    "search": get_search_stats(),
+    "jobs": job_queue.stats(),
+    "conversations": get_conversation_stats(),
+    "models": model_router.stats(),
+    "hedging": model_router.hedge_stats(),
+    "admission": {
+      **{route: limiter.stats() for route, limiter in admission_limiters.items() if route != "/chat/stream"},
+      "rate_limit": {kind: limiter.stats() for kind, limiter in client_rate_limiters.items()}
+    },
+    "upstreams": get_upstream_stats(),
+    "singleflight": {
+      "agent": agent_flights.stats(),
+      "tts": tts_flights.stats()
+    }
+  }
+
+
+# Uvicorn's logging plus our own loggers, applied in every worker process
+def log_config():
+  config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+  config["formatters"]["app"] = {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"}
+  config["handlers"]["app"] = {"class": "logging.StreamHandler", "formatter": "app", "stream": "ext://sys.stderr"}
+  config["root"] = {"level": "INFO", "handlers": ["app"]}
+  return config
+
 
 # Run App
 if __name__ == "__main__":
-  uvicorn.run(app, host="localhost", port=3000)
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default=os.getenv("HOST", "localhost"))
+  parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "3000")))
+  parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+  parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                      help="seconds a stopping worker gets to finish in-flight requests")
+  parser.add_argument("--reload", action="store_true", help="restart on code changes, for development")
+  args = parser.parse_args()
+  
+  if args.workers > 1:
+    # Workers share verdicts through SQLite and TTS audio through the disk cache directory
+    os.environ.setdefault("SHARED_CACHE_PATH", ".shared_cache.sqlite3")
+  
+  # Worker processes import the app themselves, so pass it by name
+  uvicorn.run(
+    "backend:app" if args.workers > 1 or args.reload else app,
+    host=args.host,
+    port=args.port,
+    workers=args.workers,
+    reload=args.reload,
+    timeout_graceful_shutdown=args.graceful_timeout,
+    log_config=log_config()
+  )
 
   
   
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""
+Compare the old sync route path against the async pipeline in backend.py.
+
+Both paths run against stubbed LLM/TTS backends so no API keys are needed:
+
+  python benchmarks/bench_async.py --levels 10 100 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import FAKE_MP3, AgentStub, disable_admission, make_upstream_transport
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+
+# The /tele route as it was before the async rewrite
+def build_sync_app(llm_latency, tts_latency):
+  agent = AgentStub(latency=llm_latency)
+  app = FastAPI()
+
+  @app.post("/tele")
+  def verify_message_from_telegram(request: List[str]):
+    response = agent.get_response_from_ai_agent("llama-3.3-70b-versatile", "Groq", True, request, "")
+    time.sleep(tts_latency)
+    return {"text": response, "audio": FAKE_MP3.hex()}
+
+  return app
+
+
+def build_async_app(llm_latency, tts_latency):
+  AgentStub(latency=llm_latency).install(backend)
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(tts_latency=tts_latency))
+  # Measure the pipeline itself, not the caches
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+  disable_admission(backend)
+  return backend.app
+
+
+async def drive(app, concurrency):
+  transport = httpx.ASGITransport(app=app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+      client.post("/tele", json=[f"claim {i}"]) for i in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+  ok = sum(1 for r in responses if r.status_code == 200)
+  return ok, elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--levels", type=int, nargs="+", default=[10, 100, 1000])
+  parser.add_argument("--llm-latency", type=float, default=0.5)
+  parser.add_argument("--tts-latency", type=float, default=0.3)
+  args = parser.parse_args()
+
+  apps = {
+    "sync (before)": build_sync_app(args.llm_latency, args.tts_latency),
+    "async (after)": build_async_app(args.llm_latency, args.tts_latency),
+  }
+
+  print(f"{'mode':<16}{'concurrency':>12}{'ok':>8}{'seconds':>10}{'req/s':>10}")
+  for name, app in apps.items():
+    for level in args.levels:
+      ok, elapsed = asyncio.run(drive(app, level))
+      print(f"{name:<16}{level:>12}{ok:>8}{elapsed:>10.2f}{ok / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,79 @@
+"""
+Compare base64-in-JSON audio against fetching binary audio from /audio/{audio_id}.
+
+Drives /tele the way tele_bot.py consumes it, with stubbed LLM/TTS backends,
+and reports payload size, latency and peak consumer memory per mode:
+
+  python benchmarks/bench_audio_transport.py --audio-kb 500 --requests 50
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import AgentStub, make_upstream_transport
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+
+async def consume(client, mode, claim):
+  response = await client.post("/tele", params={"audio_mode": mode}, json=[claim])
+  results = response.json()
+  wire_bytes = len(response.content)
+
+  if mode == "base64":
+    audio = base64.b64decode(results["audio"])
+  else:
+    audio = bytearray()
+    async with client.stream("GET", results["audio_url"]) as audio_response:
+      async for chunk in audio_response.aiter_bytes():
+        audio += chunk
+    wire_bytes += len(audio)
+
+  return wire_bytes, len(audio)
+
+
+async def run(mode, requests):
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = [await consume(client, mode, f"{mode} claim {i}") for i in range(requests)]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+  wire_bytes = sum(r[0] for r in results) / requests
+  return wire_bytes, elapsed / requests, peak
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--audio-kb", type=int, default=500)
+  parser.add_argument("--requests", type=int, default=50)
+  args = parser.parse_args()
+
+  audio = os.urandom(args.audio_kb * 1024)
+  AgentStub(latency=0.0).install(backend)
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(tts_latency=0.0, audio=audio))
+  backend.verdict_cache = VerdictCache(max_size=0)
+
+  print(f"{'mode':<10}{'KB on wire':>12}{'ms/request':>12}{'peak MB':>10}")
+  with tempfile.TemporaryDirectory() as directory:
+    for mode in ("base64", "url"):
+      backend.tts_cache = TTSCache(directory=directory)
+      wire_bytes, latency, peak = asyncio.run(run(mode, args.requests))
+      print(f"{mode:<10}{wire_bytes / 1024:>12.1f}{latency * 1000:>12.2f}{peak / 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,106 @@
+"""
+Cold start of a backend worker: how long importing backend.py takes, and how
+long a fresh server takes to become ready and to answer its first /tele
+request, with and without the warm-up:
+
+  python benchmarks/bench_cold_start.py --repeats 3
+
+Imports are timed in fresh interpreters. "eager" also imports the provider,
+search and LangGraph modules up front, like backend.py did before they were
+loaded on first use.
+
+The servers are benchmarks/stub_backend.py against benchmarks/stub_upstreams.py.
+The stub chat models skip the provider modules, so a real first request pays
+their import time on top (see the import numbers).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+
+EAGER_MODULES = ["langchain_groq", "langchain_openai", "langchain_community.tools.tavily_search", "langgraph.prebuilt"]
+
+
+def import_seconds(modules):
+  code = f"import time; start = time.perf_counter(); import {', '.join(modules)}; print(time.perf_counter() - start)"
+  env = {**os.environ, "TAVILY_API_KEY": os.environ.get("TAVILY_API_KEY", "stub")}
+  output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+  return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url, start, timeout=120):
+  while time.perf_counter() - start < timeout:
+    try:
+      if httpx.get(url, timeout=1.0).status_code == 200:
+        return time.perf_counter() - start
+    except httpx.HTTPError:
+      pass
+    time.sleep(0.02)
+  raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def cold_start(args, warmup):
+  upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+  backend_url = f"http://127.0.0.1:{args.backend_port}"
+  upstream = subprocess.Popen([
+    sys.executable, os.path.join(BENCHMARKS_DIR, "stub_upstreams.py"),
+    "--port", str(args.upstream_port), "--search-latency", "fixed:0.05", "--tts-latency", "fixed:0.05"
+  ])
+  backend = None
+  try:
+    wait_for(f"{upstream_url}/counts", time.perf_counter())
+    start = time.perf_counter()
+    backend = subprocess.Popen([
+      sys.executable, os.path.join(BENCHMARKS_DIR, "stub_backend.py"),
+      "--port", str(args.backend_port), "--upstream", upstream_url, "--llm-latency", "fixed:0.1", "--no-caches"
+    ], env={**os.environ, "WARMUP": "1" if warmup else "0"})
+    ready = wait_for(f"{backend_url}/ready", start)
+
+    latencies = []
+    with httpx.Client(base_url=backend_url, timeout=None) as client:
+      for i in range(2):
+        request_start = time.perf_counter()
+        response = client.post("/tele", json=[f"Claim {i}: free durian for every household"])
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - request_start)
+      warm = client.get("/ready").json()
+    return ready, time.perf_counter() - start - latencies[1], latencies, warm
+  finally:
+    for process in (backend, upstream):
+      if process is not None:
+        process.terminate()
+        process.wait()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--repeats", type=int, default=3)
+  parser.add_argument("--backend-port", type=int, default=3100)
+  parser.add_argument("--upstream-port", type=int, default=3101)
+  args = parser.parse_args()
+
+  lazy = statistics.median(import_seconds(["backend"]) for _ in range(args.repeats))
+  eager = statistics.median(import_seconds(["backend", *EAGER_MODULES]) for _ in range(args.repeats))
+  print(f"import backend (median of {args.repeats}):  lazy {lazy:.2f}s  eager {eager:.2f}s\n")
+
+  print(f"{'warm-up':<9}{'ready':>8}{'first answer':>14}{'1st /tele':>11}{'2nd /tele':>11}  /ready")
+  results = {}
+  for warmup in (False, True):
+    ready, first_answer, latencies, warm = cold_start(args, warmup)
+    results[warmup] = latencies
+    print(f"{'on' if warmup else 'off':<9}{ready:>8.2f}{first_answer:>14.2f}{latencies[0]:>11.2f}{latencies[1]:>11.2f}  {warm}")
+
+  assert lazy < eager, "importing backend still loads the provider modules"
+  # Warmed up, the first request is about as fast as the next one
+  assert results[True][0] < results[False][0], "the warm-up did not speed up the first request"
+
+
+if __name__ == "__main__":
+  main()
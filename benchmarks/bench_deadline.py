@@ -0,0 +1,104 @@
+"""
+Runs /tele through the real ReAct agent, with stub chat models and stub
+upstreams, in the ways a request can run long, and checks each one comes back
+on time with a partial answer:
+
+  python benchmarks/bench_deadline.py --deadline 4
+
+- a model that never stops searching is stopped after AGENT_MAX_ITERATIONS
+  rounds and asked to answer from what it found
+- a slow model is cancelled when the agent's share of the deadline runs out,
+  and the answer falls back to the sources found so far
+- slow TTS keeps the audio of the sentences that were ready in time, and
+  that audio is not cached as the audio of the whole answer
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+# Keep the usage log out of the working tree
+os.environ.setdefault("USAGE_LOG_PATH", "")
+
+import ai_agent
+import backend
+import deadline
+import search_cache
+from benchmarks.stub_upstreams import build_app
+from benchmarks.stubs import Latency, StubChatModel, disable_admission
+from tts_cache import TTSCache, cache_key
+from verdict_cache import VerdictCache
+
+LONG_ANSWER = " ".join(["Wah this one confirm fake news lah, the government never say anything like that one."] * 6)
+
+
+def configure(llm_latency, searches, tts_latency, answer=None):
+  def stub_model(model, **kwargs):
+    return StubChatModel(model_id=model, latency=Latency(llm_latency), searches=searches, **({"answer": answer} if answer else {}))
+
+  ai_agent.ChatGroq = stub_model
+  ai_agent.ChatOpenAI = stub_model
+  ai_agent.agent_registry = ai_agent.AgentRegistry()
+
+  upstream = build_app(Latency("fixed:0.1"), Latency(tts_latency), Latency("fixed:0.05"))
+  transport = httpx.ASGITransport(app=upstream)
+  search_cache.async_client = httpx.AsyncClient(transport=transport, base_url="http://upstream")
+  search_cache.search_cache.ttl = 0
+  search_cache.TAVILY_SEARCH_URL = "http://upstream/search"
+  backend.http_client = httpx.AsyncClient(transport=transport, base_url="http://upstream")
+  backend.JIGSAWSTACK_TTS_URL = "http://upstream/v1/ai/tts"
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+  return upstream
+
+
+async def tele(claim, params=None):
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    start = time.perf_counter()
+    response = await client.post("/tele", json=[claim], params=params)
+    return response, time.perf_counter() - start
+
+
+def run_case(name, args, llm_latency, searches, tts_latency, expect, answer=None, params=None):
+  upstream = configure(llm_latency, searches, tts_latency, answer)
+  response, elapsed = asyncio.run(tele(f"{name}: free durian for every household", params))
+  body = response.json()
+  audio = "yes" if body.get("audio") or body.get("audio_id") else "no"
+  print(f"{name:<18}{response.status_code:>7}{elapsed:>9.2f}{str(body.get('partial_reason')):>16}"
+        f"{upstream.state.counts['search']:>10}{audio:>7}  {body['text'][:60]!r}")
+
+  assert elapsed <= args.deadline + 0.5, f"{name} took {elapsed:.2f}s, past the {args.deadline}s deadline"
+  assert body.get("partial_reason") == expect, f"{name}: expected partial_reason {expect}, got {body.get('partial_reason')}"
+  return body
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--deadline", type=float, default=4.0)
+  parser.add_argument("--max-iterations", type=int, default=3)
+  args = parser.parse_args()
+
+  deadline.REQUEST_DEADLINE = args.deadline
+  ai_agent.AGENT_MAX_ITERATIONS = args.max_iterations
+  disable_admission(backend)
+
+  print(f"deadline {args.deadline}s, agent share {deadline.AGENT_DEADLINE_SHARE}, max iterations {args.max_iterations}\n")
+  print(f"{'case':<18}{'status':>7}{'seconds':>9}{'partial':>16}{'searches':>10}{'audio':>7}  text")
+
+  run_case("normal", args, "fixed:0.2", 1, "fixed:0.1", None)
+  body = run_case("keeps searching", args, "fixed:0.1", 100, "fixed:0.1", "max_iterations")
+  assert "fake news" in body["text"], "the model was not asked for a final answer"
+  body = run_case("slow model", args, "fixed:1.2", 100, "fixed:0.1", "deadline")
+  assert "factcheck.example" in body["text"], "the partial answer does not list the sources found"
+  body = run_case("slow tts", args, "fixed:0.2", 1, "fixed:2.5", "deadline", answer=LONG_ANSWER, params={"audio_mode": "url"})
+  assert body["audio_id"] != cache_key(body["text"], "en-SG-female-1"), "the cut short audio was cached as the whole answer's"
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,130 @@
+"""
+/tele latency when the first-choice model has a slow tail: new claims arrive
+at --rate per second while llama-3.3-70b-versatile usually answers quickly but
+stalls on --stall-rate of requests. The same traffic runs without hedging,
+hedged after the model's observed p95, and hedged at once:
+
+  python benchmarks/bench_hedging.py --requests 300 --rate 20 --stall-rate 0.02
+
+Reports p50/p95/p99 latency, agent runs started per request (the extra
+upstream load), how often the hedge answered first, and the seconds spent on
+runs that were cancelled.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+
+import backend
+from benchmarks.stubs import AgentStub, Latency, disable_admission, make_upstream_transport
+from model_router import ModelRouter
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+CLAIM = (
+  "Claim {i}: my auntie forwarded a message saying the government will give every household "
+  "a free durian voucher this weekend if they register on a website before midnight"
+)
+
+
+# Answers after a per-model delay, with the first-choice model stalling now and then
+class TailStub(AgentStub):
+  def __init__(self, args):
+    super().__init__()
+    self.rng = random.Random(args.seed)
+    self.stall_rate = args.stall_rate
+    self.stall = args.stall
+    self.latencies = {
+      "llama-3.3-70b-versatile": Latency(args.groq_latency, seed=args.seed),
+      "gemma2-9b-it": Latency(args.groq_latency, seed=args.seed + 1),
+      "gpt-4o": Latency(args.openai_latency, seed=args.seed + 2)
+    }
+    self.started = collections.Counter()
+    self.cancelled = collections.Counter()
+
+  async def astream_response_from_ai_agent(self, llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+    self.started[llm_id] += 1
+    self.latency = self.latencies[llm_id].sample()
+    if llm_id == "llama-3.3-70b-versatile" and self.rng.random() < self.stall_rate:
+      self.latency += self.stall
+    try:
+      async for event in super().astream_response_from_ai_agent(llm_id, provider, allow_search, query, system_prompt, thread_id):
+        yield event
+    except (asyncio.CancelledError, GeneratorExit):
+      self.cancelled[llm_id] += 1
+      raise
+
+
+def percentile(samples, q):
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def run(args, hedge, delay, budget):
+  stub = TailStub(args)
+  stub.install(backend)
+  router = backend.model_router = ModelRouter()
+  router.hedge_delay_setting = delay
+  router.hedge_budget = budget
+  backend.TELE_HEDGE = hedge
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+  latencies = []
+
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    async def one(i):
+      start = time.perf_counter()
+      response = await client.post("/tele", json=[CLAIM.format(i=i)])
+      response.raise_for_status()
+      latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for i in range(args.requests):
+      tasks.append(asyncio.create_task(one(i)))
+      await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+
+  return latencies, stub, router.hedge_stats()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--requests", type=int, default=300)
+  parser.add_argument("--rate", type=float, default=20, help="new claims per second")
+  parser.add_argument("--groq-latency", default="lognormal:0.6:0.25")
+  parser.add_argument("--openai-latency", default="lognormal:1.2:0.2")
+  parser.add_argument("--stall-rate", type=float, default=0.02)
+  parser.add_argument("--stall", type=float, default=6.0, help="seconds added to a stalled answer")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  disable_admission(backend)
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(tts_latency=0.05))
+
+  print(f"{args.requests} claims at {args.rate}/s, llama {args.groq_latency} stalling {args.stall}s on {args.stall_rate:.0%}, gpt-4o {args.openai_latency}\n")
+  print(f"{'mode':<16}{'p50':>7}{'p95':>7}{'p99':>7}{'max':>7}{'runs/req':>10}{'hedges':>8}{'won':>6}{'skipped':>9}{'extra s':>9}")
+  results = {}
+  for name, hedge, delay, budget in (("off", False, "p95", 0.1), ("hedge at p95", True, "p95", 0.1), ("hedge at once", True, "0", 1.0)):
+    latencies, stub, stats = asyncio.run(run(args, hedge, delay, budget))
+    runs = sum(stub.started.values()) / args.requests
+    results[name] = (latencies, runs)
+    print(f"{name:<16}{percentile(latencies, 0.5):>7.2f}{percentile(latencies, 0.95):>7.2f}{percentile(latencies, 0.99):>7.2f}"
+          f"{max(latencies):>7.2f}{runs:>10.2f}{stats['hedges']:>8}{stats['hedge_wins']:>6}{stats['skipped']:>9}{stats['extra_seconds']:>9.1f}")
+
+  off, p95 = results["off"], results["hedge at p95"]
+  # The stalls dominate the tail without hedging, and cost a few percent more runs to cut it
+  assert percentile(p95[0], 0.99) < percentile(off[0], 0.99) / 2, "hedging did not cut the p99"
+  assert p95[1] <= 1.0 + 0.1 + 0.02, "hedging went over its budget of extra runs"
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,135 @@
+"""
+Send a burst of /whatsapp claims against a slow and flaky WhatsApp relay and
+check that the HTTP requests return at once while the queue delivers every
+reply in the background, retrying failed deliveries with backoff:
+
+  python benchmarks/bench_job_queue.py --requests 100 --relay-latency 2.0 --relay-failure-rate 0.3
+
+Also checks that a job claimed by a worker that crashes is run again once its
+lease runs out.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import AgentStub, make_upstream_transport
+from job_queue import JobQueue, JobWorkers
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+
+def percentile(samples, q):
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def run(args, queue, calls):
+  backend.job_workers = JobWorkers(queue, {"whatsapp": backend.deliver_whatsapp_reply}, workers=args.workers, idle_poll=0.1)
+  backend.job_workers.start()
+
+  latencies = []
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+    async def send(i):
+      start = time.perf_counter()
+      response = await client.post("/whatsapp", json=[f"Claim {i}: free durian for every household this weekend"])
+      latencies.append(time.perf_counter() - start)
+      assert response.status_code == 202, response.text
+      return response.json()["job_id"]
+
+    start = time.perf_counter()
+    job_ids = await asyncio.gather(*[send(i) for i in range(args.requests)])
+
+    # Wait until every job is delivered or dead-lettered
+    while True:
+      stats = queue.stats()
+      if stats["depth"] == 0 and stats["running"] == 0:
+        break
+      await asyncio.sleep(0.1)
+    drained = time.perf_counter() - start
+
+  await backend.job_workers.stop()
+  jobs = [queue.get(job_id) for job_id in job_ids]
+  job_latencies = [job["updated_at"] - job["created_at"] for job in jobs if job["status"] == "done"]
+
+  print(f"requests:          {args.requests}, HTTP p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms")
+  print(f"queue drained in:  {drained:.2f}s with {args.workers} workers")
+  print(f"job latency:       p50 {percentile(job_latencies, 0.5):.2f}s, p95 {percentile(job_latencies, 0.95):.2f}s")
+  print(f"relay calls:       {calls['reply']} ({calls['failed']} failed and retried)")
+  print(f"queue:             {queue.stats()}")
+
+  assert percentile(latencies, 0.95) < args.relay_latency, "requests waited for the relay"
+  assert all(job["status"] in ("done", "dead") for job in jobs)
+  if args.max_attempts > 1 and args.relay_failure_rate < 0.5:
+    assert sum(job["status"] == "done" for job in jobs) >= args.requests * 0.9, "retries did not recover failed deliveries"
+
+
+def check_crash_recovery(path, lease=0.5):
+  queue = JobQueue(path, lease=lease)
+  job_id = queue.enqueue("whatsapp", {"claim": ["crash test"], "request_id": "crash"})
+  job = queue.claim()
+  assert job["id"] == job_id and queue.get(job_id)["status"] == "running"
+  queue.close()
+
+  # Another process opening the same file takes the job over once the lease runs out
+  reopened = JobQueue(path, lease=lease)
+  assert reopened.claim() is None, "job was taken over while its lease was still held"
+  time.sleep(lease)
+  job = reopened.claim()
+  assert job["id"] == job_id and job["attempts"] == 2
+  reopened.close()
+  print("crash recovery:    interrupted job taken over after its lease expired")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--requests", type=int, default=100)
+  parser.add_argument("--workers", type=int, default=8)
+  parser.add_argument("--llm-latency", type=float, default=0.2)
+  parser.add_argument("--tts-latency", type=float, default=0.1)
+  parser.add_argument("--relay-latency", type=float, default=2.0)
+  parser.add_argument("--relay-failure-rate", type=float, default=0.3)
+  parser.add_argument("--max-attempts", type=int, default=5)
+  parser.add_argument("--retry-base", type=float, default=0.2)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  calls = {"reply": 0, "failed": 0}
+  upstream = make_upstream_transport(tts_latency=args.tts_latency, relay_latency=args.relay_latency)
+
+  async def flaky_relay(request):
+    response = await upstream.handle_async_request(request)
+    if request.url.path.endswith("/reply"):
+      calls["reply"] += 1
+      if rng.random() < args.relay_failure_rate:
+        calls["failed"] += 1
+        return httpx.Response(503, json={"error": "relay unavailable"})
+    return response
+
+  AgentStub(latency=args.llm_latency).install(backend)
+  backend.http_client = httpx.AsyncClient(transport=httpx.MockTransport(flaky_relay))
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+
+  directory = tempfile.mkdtemp(prefix="jobs_")
+  queue = JobQueue(os.path.join(directory, "jobs.sqlite3"), max_attempts=args.max_attempts, retry_base=args.retry_base)
+  backend.job_queue = queue
+  asyncio.run(run(args, queue, calls))
+  queue.close()
+
+  check_crash_recovery(os.path.join(directory, "crash.sqlite3"))
+
+
+if __name__ == "__main__":
+  main()
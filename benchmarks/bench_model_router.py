@@ -0,0 +1,135 @@
+"""
+Simulated provider outage: /tele claims are sent while llama-3.3-70b-versatile
+answers every request with a 429 for a while, then recovers. The same traffic
+runs once with the model pinned, like the routes used to be, and once through
+the adaptive router:
+
+  python benchmarks/bench_model_router.py --requests 60 --outage 20:40
+
+Each model answers after its own stub latency. The report shows the success
+rate and latency per phase, which models answered and how many requests were
+moved to another model.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+import model_router
+from benchmarks.stubs import AgentStub, make_upstream_transport
+from model_router import ModelRouter
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+OUTAGE_MODEL = "llama-3.3-70b-versatile"
+MODEL_LATENCY = {"llama-3.3-70b-versatile": 0.4, "gemma2-9b-it": 0.2, "gpt-4o": 0.8}
+
+SHORT_CLAIM = "Claim {i}: MRT free tomorrow"
+LONG_CLAIM = (
+  "Claim {i}: my auntie forwarded a message saying the government will give every household "
+  "a free durian voucher this weekend if they register on a website before midnight"
+)
+
+
+class RateLimitError(Exception):
+  status_code = 429
+
+
+# Answers like AgentStub after a per-model delay, and rate limits the outage model while it is down
+class OutageStub(AgentStub):
+  def __init__(self):
+    super().__init__()
+    self.down = False
+    self.answered = collections.Counter()
+
+  async def astream_response_from_ai_agent(self, llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+    if self.down and llm_id == OUTAGE_MODEL:
+      await asyncio.sleep(0.05)
+      raise RateLimitError(f"{llm_id} is over its rate limit")
+
+    self.latency = MODEL_LATENCY[llm_id]
+    async for event in super().astream_response_from_ai_agent(llm_id, provider, allow_search, query, system_prompt, thread_id):
+      yield event
+    self.answered[llm_id] += 1
+
+
+def percentile(samples, q):
+  if not samples:
+    return 0.0
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def run(args, router, rng):
+  stub = OutageStub()
+  stub.install(backend)
+  backend.model_router = router
+  phases = collections.defaultdict(lambda: {"ok": 0, "failed": 0, "latencies": []})
+  outage_start, outage_end = (int(value) for value in args.outage.split(":"))
+
+  transport = httpx.ASGITransport(app=backend.app, raise_app_exceptions=False)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    for i in range(args.requests):
+      stub.down = outage_start <= i < outage_end
+      phase = "before" if i < outage_start else "outage" if stub.down else "after"
+      claim = (SHORT_CLAIM if rng.random() < args.short_ratio else LONG_CLAIM).format(i=i)
+
+      start = time.perf_counter()
+      response = await client.post("/tele", json=[claim])
+      result = phases[phase]
+      result["ok" if response.status_code == 200 else "failed"] += 1
+      result["latencies"].append(time.perf_counter() - start)
+
+  return phases, stub.answered
+
+
+def report(name, phases, answered, router):
+  print(f"\n{name}")
+  print(f"  {'phase':<8}{'ok':>5}{'failed':>8}{'p50':>8}{'p95':>8}")
+  for phase in ("before", "outage", "after"):
+    result = phases[phase]
+    print(f"  {phase:<8}{result['ok']:>5}{result['failed']:>8}"
+          f"{percentile(result['latencies'], 0.5):>8.2f}{percentile(result['latencies'], 0.95):>8.2f}")
+  print(f"  answered by: {dict(answered)}")
+  print(f"  fallbacks:   { {model: stats['fallbacks'] for model, stats in router.stats().items() if stats['fallbacks']} }")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--requests", type=int, default=60)
+  parser.add_argument("--outage", default="20:40", help="first:last request index during which the model is down")
+  parser.add_argument("--short-ratio", type=float, default=0.3)
+  parser.add_argument("--cooldown", type=float, default=1.0)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  # Forgive errors quickly so the short run also shows the model being used again after the outage
+  model_router.ROUTER_ERROR_DECAY = 2.0
+
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(tts_latency=0.05))
+  results = {}
+  for name, router in (
+    ("pinned to llama-3.3-70b-versatile", ModelRouter(models=[OUTAGE_MODEL], short_models=[], max_attempts=1)),
+    ("adaptive router", ModelRouter(cooldown=args.cooldown))
+  ):
+    backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+    backend.verdict_cache = VerdictCache(max_size=0)
+    phases, answered = asyncio.run(run(args, router, random.Random(args.seed)))
+    report(name, phases, answered, router)
+    results[name] = phases
+
+  adaptive = results["adaptive router"]
+  assert results["pinned to llama-3.3-70b-versatile"]["outage"]["failed"] > 0, "the outage did not fail the pinned model"
+  assert all(adaptive[phase]["failed"] == 0 for phase in adaptive), "the router returned errors during the outage"
+
+
+if __name__ == "__main__":
+  main()
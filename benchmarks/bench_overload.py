@@ -0,0 +1,140 @@
+"""
+Send /tele claims faster than the model provider can answer them and compare
+latency with and without admission control:
+
+  python benchmarks/bench_overload.py --capacity 8 --service-time 0.5 --rate 32 --duration 10
+
+The stub provider answers --capacity requests at a time and queues the rest,
+like an upstream that is at its quota. Without admission control every
+request is accepted and waits behind the growing backlog, so latency keeps
+climbing for as long as the overload lasts. With it, requests past the
+concurrency limit and its wait queue get a fast 503 with Retry-After, and the
+latency of the accepted ones stays bounded.
+
+Also checks that one client sending a burst is rate limited with 429s.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import AgentStub, disable_admission, make_upstream_transport
+from limits import ClientRateLimiter, ConcurrencyLimiter
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+
+# Answers like AgentStub, but only capacity requests at a time
+class CapacityStub(AgentStub):
+  def __init__(self, capacity, service_time):
+    super().__init__(latency=service_time)
+    self.capacity = capacity
+    self.slots = None
+
+  async def astream_response_from_ai_agent(self, llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+    if self.slots is None:
+      self.slots = asyncio.Semaphore(self.capacity)
+    async with self.slots:
+      async for event in super().astream_response_from_ai_agent(llm_id, provider, allow_search, query, system_prompt, thread_id):
+        yield event
+
+
+def percentile(samples, q):
+  if not samples:
+    return 0.0
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def overload(args):
+  CapacityStub(args.capacity, args.service_time).install(backend)
+  results = {"ok": [], "rejected": [], "other": 0, "retry_after": set()}
+
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+    async def send(i):
+      start = time.perf_counter()
+      response = await client.post("/tele", json=[f"Claim {i}: free durian for every household this weekend"])
+      elapsed = time.perf_counter() - start
+      if response.status_code == 200:
+        results["ok"].append(elapsed)
+      elif response.status_code in (429, 503):
+        results["rejected"].append(elapsed)
+        results["retry_after"].add(response.headers.get("retry-after"))
+      else:
+        results["other"] += 1
+
+    # Open loop: requests keep arriving at the same rate however slow the answers get
+    tasks = []
+    for i in range(int(args.rate * args.duration)):
+      tasks.append(asyncio.create_task(send(i)))
+      await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+
+  return results
+
+
+async def rate_limit_burst(burst):
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    responses = await asyncio.gather(*[
+      client.post("/tele", json=[f"Burst claim {i}"]) for i in range(burst * 3)
+    ])
+  return [response.status_code for response in responses], {response.headers.get("retry-after") for response in responses if response.status_code == 429}
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--capacity", type=int, default=8, help="requests the stub provider answers at once")
+  parser.add_argument("--service-time", type=float, default=0.5)
+  parser.add_argument("--rate", type=float, default=32, help="arriving requests per second")
+  parser.add_argument("--duration", type=float, default=10)
+  parser.add_argument("--max-queue", type=int, default=8, help="requests allowed to wait for a slot")
+  parser.add_argument("--wait-timeout", type=float, default=2.0)
+  args = parser.parse_args()
+
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(tts_latency=0.05))
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+
+  capacity_rps = args.capacity / args.service_time
+  print(f"provider capacity {capacity_rps:.0f} req/s, offered {args.rate:.0f} req/s for {args.duration:.0f}s\n")
+  print(f"{'mode':<22}{'ok':>6}{'503/429':>9}{'ok p50':>9}{'ok p95':>9}{'ok p99':>9}{'reject p99':>12}  retry-after")
+
+  disable_admission(backend)
+  modes = {"no admission control": None}
+  modes["admission control"] = ConcurrencyLimiter("/tele", args.capacity, args.max_queue, args.wait_timeout)
+  report = {}
+  for name, limiter in modes.items():
+    if limiter is not None:
+      backend.admission_limiters["/tele"] = limiter
+    results = asyncio.run(overload(args))
+    report[name] = results
+    print(f"{name:<22}{len(results['ok']):>6}{len(results['rejected']):>9}"
+          f"{percentile(results['ok'], 0.5):>9.2f}{percentile(results['ok'], 0.95):>9.2f}{percentile(results['ok'], 0.99):>9.2f}"
+          f"{percentile(results['rejected'], 0.99):>12.3f}  {sorted(value for value in results['retry_after'] if value)}")
+
+  # The accepted requests wait at most for the queue ahead of them, plus their own run
+  bound = (args.max_queue / args.capacity + 1) * args.service_time + args.wait_timeout
+  admitted = report["admission control"]
+  assert percentile(admitted["ok"], 0.99) <= bound, f"p99 latency of admitted requests is over {bound:.2f}s"
+  assert percentile(admitted["rejected"], 0.99) <= args.wait_timeout + 0.5, "rejections were not fast"
+  assert percentile(report["no admission control"]["ok"], 0.99) > bound, "the run did not overload the provider"
+
+  # One client over its rate limit gets 429s, the IP limiter is off by default so turn it on here
+  burst = 5
+  backend.client_rate_limiters["ip"] = ClientRateLimiter(per_minute=60, burst=burst)
+  codes, retry_after = asyncio.run(rate_limit_burst(burst))
+  print(f"\nrate limit burst:      {codes.count(200)} ok, {codes.count(429)} got 429 (retry-after {sorted(retry_after)})")
+  assert codes.count(200) == burst and codes.count(429) == 2 * burst
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,158 @@
+"""
+Replays a skewed (Zipf) workload of /chat requests without web search, with
+and without the response cache, against a stub agent, then checks each
+cache_control mode, per-model TTLs, size-based eviction and that entries
+survive a restart:
+
+  python benchmarks/bench_response_cache.py --requests 500 --distinct 50
+
+The stub agent answers in --llm-latency seconds, so "seconds saved" in the
+report is what the hits would have spent waiting on the model.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+
+import backend
+from benchmarks.stubs import AgentStub, disable_admission
+from response_cache import ResponseCache
+
+MODEL = "llama-3.3-70b-versatile"
+SYSTEM_PROMPT = "Act as an AI chatbot who is smart and friendly"
+
+
+def percentile(samples, q):
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def zipf_workload(requests, distinct, skew, seed):
+  rng = random.Random(seed)
+  weights = [1 / (rank ** skew) for rank in range(1, distinct + 1)]
+  questions = [f"Explain question number {i} about how CPF interest is calculated" for i in range(distinct)]
+  return rng.choices(questions, weights=weights, k=requests)
+
+
+def chat_request(question, model=MODEL, allow_search=False, cache_control="default"):
+  return {
+    "model_name": model,
+    "model_provider": "Groq",
+    "system_prompt": SYSTEM_PROMPT,
+    "messages": [question],
+    "allow_search": allow_search,
+    "cache_control": cache_control
+  }
+
+
+async def replay(client, workload, concurrency):
+  semaphore = asyncio.Semaphore(concurrency)
+  latencies = []
+
+  async def one(question):
+    async with semaphore:
+      start = time.perf_counter()
+      response = await client.post("/chat", json=chat_request(question))
+      response.raise_for_status()
+      latencies.append(time.perf_counter() - start)
+
+  start = time.perf_counter()
+  await asyncio.gather(*[one(question) for question in workload])
+  return time.perf_counter() - start, latencies
+
+
+async def check_cache_controls(client, agent):
+  question = "What is the GST rate in Singapore?"
+
+  async def calls_for(**kwargs):
+    before = agent.calls
+    response = await client.post("/chat", json=chat_request(question, **kwargs))
+    return response, agent.calls - before
+
+  response, calls = await calls_for(cache_control="only-if-cached")
+  assert response.status_code == 504 and calls == 0, "only-if-cached ran the agent on a miss"
+  response, calls = await calls_for()
+  assert calls == 1 and response.json()["cached"] is False
+  response, calls = await calls_for()
+  assert calls == 0 and response.json()["cached"] is True, "an identical request was not served from the cache"
+  response, calls = await calls_for(cache_control="only-if-cached")
+  assert response.status_code == 200 and calls == 0, "only-if-cached missed a cached answer"
+  response, calls = await calls_for(cache_control="bypass")
+  assert calls == 1 and response.json()["cached"] is False, "bypass was served from the cache"
+  response, calls = await calls_for(cache_control="refresh")
+  assert calls == 1 and response.json()["cached"] is False, "refresh was served from the cache"
+  # Answers that searched the web are not cached by default
+  await calls_for(allow_search=True)
+  response, calls = await calls_for(allow_search=True)
+  assert calls == 1, "an answer with web search was cached"
+  # A model with a TTL of 0 is never cached
+  await calls_for(model="gpt-4o")
+  response, calls = await calls_for(model="gpt-4o")
+  assert calls == 1, "a model with TTL 0 was cached"
+  print("cache_control: default, bypass, refresh and only-if-cached, search and per-model TTLs ok")
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--requests", type=int, default=500)
+  parser.add_argument("--distinct", type=int, default=50)
+  parser.add_argument("--skew", type=float, default=1.1)
+  parser.add_argument("--concurrency", type=int, default=20)
+  parser.add_argument("--llm-latency", type=float, default=0.5)
+  args = parser.parse_args()
+
+  agent = AgentStub(latency=args.llm_latency)
+  agent.install(backend)
+  disable_admission(backend)
+  workload = zipf_workload(args.requests, args.distinct, args.skew, seed=0)
+
+  async def run(cache):
+    backend.response_cache = cache
+    agent.calls = 0
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+      elapsed, latencies = await replay(client, workload, args.concurrency)
+      if cache is not None:
+        await check_cache_controls(client, agent)
+    return elapsed, latencies, agent.calls
+
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "responses.sqlite3")
+    print(f"{args.requests} /chat requests over {args.distinct} questions, agent answers in {args.llm_latency}s\n")
+    print(f"{'mode':<10}{'seconds':>9}{'req/s':>8}{'p50':>8}{'p95':>8}{'agent calls':>13}")
+    calls_by_mode = {}
+    for name, cache in (("no cache", None), ("cache", ResponseCache(path, model_ttls={"gpt-4o": 0}))):
+      elapsed, latencies, calls = asyncio.run(run(cache))
+      calls_by_mode[name] = calls
+      print(f"{name:<10}{elapsed:>9.2f}{args.requests / elapsed:>8.1f}{percentile(latencies, 0.5):>8.3f}"
+            f"{percentile(latencies, 0.95):>8.3f}{calls:>13}")
+
+    stats = cache.stats()
+    print(f"\n{stats}")
+    # Concurrent first requests for a question miss together and join one agent run, later ones hit
+    assert calls_by_mode["cache"] < calls_by_mode["no cache"] / 3, "the cache did not cut agent calls"
+    assert stats["tokens_saved"] > 0 and stats["seconds_saved"] >= stats["hits"] * args.llm_latency * 0.9
+
+    # Entries outlive the process that wrote them
+    restarted = ResponseCache(path)
+    assert restarted.stats()["entries"] == stats["entries"], "entries were lost on restart"
+
+    # Least recently used answers are evicted past max_bytes
+    small = ResponseCache(os.path.join(directory, "small.sqlite3"), max_bytes=1000)
+    for i in range(100):
+      small.put(str(i), MODEL, False, [SYSTEM_PROMPT], f"answer {i} " * 10, 0.5)
+    small_stats = small.stats()
+    assert small_stats["bytes"] <= 1000 and small_stats["evictions"] > 0 and small.get("99") is not None
+    print(f"eviction: {small_stats['entries']} entries in {small_stats['bytes']} bytes after 100 stores, {small_stats['evictions']} evicted")
+
+
+if __name__ == "__main__":
+  main()
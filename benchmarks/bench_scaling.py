@@ -0,0 +1,64 @@
+"""
+Throughput of the backend served by 1 to N worker processes, using the same
+stub upstreams and stub chat models as benchmarks/load_test.py:
+
+  python benchmarks/bench_scaling.py --max-workers 4 --endpoint tele --concurrency 64
+
+Part of the claims repeat (--unique-ratio), so the run also shows whether the
+verdict and TTS caches keep their hit rate as workers are added: with shared
+caches the upstream calls per request stay flat instead of growing with N.
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import drive, start_servers
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+  parser.add_argument("--endpoint", default="tele")
+  parser.add_argument("--concurrency", type=int, default=64)
+  parser.add_argument("--requests", type=int, default=400)
+  parser.add_argument("--unique-ratio", type=float, default=0.5)
+  parser.add_argument("--llm-latency", default="lognormal:0.5:0.3")
+  parser.add_argument("--search-latency", default="lognormal:0.3:0.3")
+  parser.add_argument("--tts-latency", default="lognormal:0.3:0.3")
+  parser.add_argument("--relay-latency", default="fixed:0.05")
+  parser.add_argument("--backend-port", type=int, default=3000)
+  parser.add_argument("--upstream-port", type=int, default=3001)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+  args.no_caches = False
+
+  print(f"{'workers':<9}{'rps':>8}{'p50':>8}{'p95':>8}{'speedup':>9}{'searches/req':>14}{'tts/req':>9}  cpu%")
+  baseline = None
+  for workers in range(1, args.max_workers + 1):
+    args.workers = workers
+    upstream, backend = start_servers(args)
+    try:
+      result = asyncio.run(drive(
+        f"http://127.0.0.1:{args.backend_port}", args.endpoint, args.concurrency,
+        args.requests, args.unique_ratio, backend.pid, args.seed
+      ))
+      counts = httpx.get(f"http://127.0.0.1:{args.upstream_port}/counts").json()
+    finally:
+      backend.terminate()
+      upstream.terminate()
+      backend.wait()
+      upstream.wait()
+
+    baseline = baseline or result["rps"]
+    cpu = sum(worker["cpu_percent"] for worker in result["workers"].values())
+    print(f"{workers:<9}{result['rps']:>8.1f}{result['p50']:>8.2f}{result['p95']:>8.2f}{result['rps'] / baseline:>8.2f}x"
+          f"{counts['search'] / args.requests:>14.2f}{counts['tts'] / args.requests:>9.2f}  {cpu:.0f}%")
+
+
+if __name__ == "__main__":
+  main()
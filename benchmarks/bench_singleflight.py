@@ -0,0 +1,75 @@
+"""
+Fire a burst of identical /tele requests at a slow stub LLM and check that
+they are coalesced into a single agent run and a single TTS call:
+
+  python benchmarks/bench_singleflight.py --burst 50 --llm-latency 1.0
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import AgentStub, disable_admission, make_upstream_transport
+from singleflight import SingleFlight
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+
+async def burst(size, claim):
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+      client.post("/tele", json=[claim]) for _ in range(size)
+    ])
+    return responses, time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--burst", type=int, default=50)
+  parser.add_argument("--llm-latency", type=float, default=1.0)
+  parser.add_argument("--tts-latency", type=float, default=0.3)
+  args = parser.parse_args()
+
+  calls = {"tts": 0}
+  agent = AgentStub(latency=args.llm_latency)
+  transport = make_upstream_transport(tts_latency=args.tts_latency)
+
+  async def counting_transport(request):
+    if request.url.path.endswith("/tts"):
+      calls["tts"] += 1
+    return await transport.handle_async_request(request)
+
+  agent.install(backend)
+  # The whole burst has to be in flight at once to be coalesced
+  disable_admission(backend)
+  backend.http_client = httpx.AsyncClient(transport=httpx.MockTransport(counting_transport))
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+  backend.agent_flights = SingleFlight()
+  backend.tts_flights = SingleFlight()
+
+  responses, elapsed = asyncio.run(burst(args.burst, "Wah the MRT free on Sunday ah?"))
+  bodies = {response.text for response in responses}
+
+  print(f"requests:        {len(responses)} in {elapsed:.2f}s")
+  print(f"agent runs:      {agent.calls}")
+  print(f"TTS calls:       {calls['tts']}")
+  print(f"agent flights:   {backend.agent_flights.stats()}")
+  print(f"TTS flights:     {backend.tts_flights.stats()}")
+
+  assert all(response.status_code == 200 for response in responses)
+  assert len(bodies) == 1, "coalesced requests returned different answers"
+  assert agent.calls == 1 and calls["tts"] == 1, "identical requests were not coalesced"
+  assert elapsed < args.llm_latency + args.tts_latency + 1.0
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,154 @@
+"""
+Runs tele_bot.py against a fake Telegram Bot API and a fake backend, with one
+/verify message from each of --chats chats waiting in getUpdates, and reports
+how long the bot takes to answer them all when updates are handled one at a
+time and when they are handled concurrently:
+
+  python benchmarks/bench_tele_bot.py --chats 50 --backend-latency 1.0
+
+Each backend answer takes --backend-latency seconds, like a fact-check does.
+The report also counts the connections the bot opened to the backend, which
+stay below the concurrency limit because the bot keeps one pooled session.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import tele_bot
+from benchmarks.stub_upstreams import MP3_FRAME
+
+TOKEN = "123456:bench"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def percentile(samples, q):
+  if not samples:
+    return 0.0
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+# Bot API methods the bot calls, and the /tele and /audio routes of the backend
+def build_app(chats, backend_latency):
+  app = web.Application()
+  state = app["state"] = {"updates": [], "sent": {}, "voices": {}, "connections": set(), "done": None}
+
+  def message(chat_id, **fields):
+    return {"message_id": len(state["sent"]) + 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, **fields}
+
+  async def bot_api(request):
+    method = request.match_info["method"]
+    data = await request.post()
+    if method == "getMe":
+      return web.json_response({"ok": True, "result": BOT_USER})
+    if method in ("deleteWebhook", "sendChatAction"):
+      return web.json_response({"ok": True, "result": True})
+    if method == "getUpdates":
+      offset = int(data.get("offset") or 0)
+      updates = [update for update in state["updates"] if update["update_id"] >= offset]
+      if not updates:
+        await asyncio.sleep(0.2)
+      return web.json_response({"ok": True, "result": updates})
+
+    chat_id = int(data["chat_id"])
+    if method == "sendMessage":
+      state["sent"][chat_id] = time.perf_counter()
+      return web.json_response({"ok": True, "result": message(chat_id, text=data["text"])})
+    if method == "sendVoice":
+      state["voices"][chat_id] = time.perf_counter()
+      if len(state["voices"]) == chats:
+        state["done"].set()
+      voice = {"file_id": f"voice-{chat_id}", "file_unique_id": f"voice-{chat_id}", "duration": 1}
+      return web.json_response({"ok": True, "result": message(chat_id, voice=voice)})
+    return web.json_response({"ok": False, "error_code": 400, "description": f"unknown method {method}"}, status=400)
+
+  async def tele(request):
+    state["connections"].add(request.transport.get_extra_info("peername"))
+    await request.json()
+    await asyncio.sleep(backend_latency)
+    chat_id = request.query["chat_id"]
+    return web.json_response({"text": "Wah this one fake news lah.", "audio_url": f"/audio/{chat_id}"})
+
+  async def audio(request):
+    state["connections"].add(request.transport.get_extra_info("peername"))
+    return web.Response(body=b"ID3\x04\x00\x00\x00\x00\x00\x00" + MP3_FRAME * 40, content_type="audio/mpeg")
+
+  app.router.add_post(r"/bot{token}/{method}", bot_api)
+  app.router.add_post("/tele", tele)
+  app.router.add_get("/audio/{audio_id}", audio)
+  return app
+
+
+async def run(args, concurrent_updates):
+  app = build_app(args.chats, args.backend_latency)
+  state = app["state"]
+  state["done"] = asyncio.Event()
+  runner = web.AppRunner(app)
+  await runner.setup()
+  site = web.TCPSite(runner, "127.0.0.1", 0)
+  await site.start()
+  url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+  tele_bot.BACKEND_URL = url
+
+  application = tele_bot.build_application(TOKEN, url, concurrent_updates)
+  async with application:
+    await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(poll_interval=0.0)
+
+    start = time.perf_counter()
+    state["updates"] = [
+      {
+        "update_id": i + 1,
+        "message": {
+          "message_id": 1,
+          "date": int(time.time()),
+          "chat": {"id": 1000 + i, "type": "private"},
+          "from": {"id": 1000 + i, "is_bot": False, "first_name": f"User {i}"},
+          "text": "/verify free durian for every household",
+          "entities": [{"type": "bot_command", "offset": 0, "length": 7}]
+        }
+      }
+      for i in range(args.chats)
+    ]
+    await asyncio.wait_for(state["done"].wait(), args.chats * (args.backend_latency + 1) + 10)
+    elapsed = time.perf_counter() - start
+
+    await application.updater.stop()
+    await application.stop()
+    await application.post_shutdown(application)
+  await runner.cleanup()
+
+  latencies = [sent - start for sent in state["voices"].values()]
+  return elapsed, latencies, len(state["connections"])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--chats", type=int, default=50)
+  parser.add_argument("--backend-latency", type=float, default=1.0)
+  parser.add_argument("--concurrent-updates", type=int, default=tele_bot.TELEGRAM_CONCURRENT_UPDATES)
+  args = parser.parse_args()
+
+  print(f"{args.chats} chats, backend answers in {args.backend_latency}s\n")
+  print(f"{'updates at once':<18}{'seconds':>9}{'updates/s':>11}{'p50':>8}{'p95':>8}{'backend conns':>15}")
+  results = {}
+  for concurrent_updates in (1, args.concurrent_updates):
+    elapsed, latencies, connections = asyncio.run(run(args, concurrent_updates))
+    results[concurrent_updates] = elapsed
+    print(f"{concurrent_updates:<18}{elapsed:>9.2f}{args.chats / elapsed:>11.1f}"
+          f"{percentile(latencies, 0.5):>8.2f}{percentile(latencies, 0.95):>8.2f}{connections:>15}")
+    assert connections <= concurrent_updates, "the bot opened more backend connections than updates it handles at once"
+
+  # Concurrently, the chats wait for the backend together instead of one after another
+  assert results[args.concurrent_updates] < results[1] / 2, "concurrent updates did not raise throughput"
+
+
+if __name__ == "__main__":
+  main()
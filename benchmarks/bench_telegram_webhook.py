@@ -0,0 +1,236 @@
+"""
+Serves the real backend with a stub agent and a fake Telegram Bot API, sends
+/verify messages from --chats chats every --interval seconds, and measures the
+time from each message reaching Telegram to the bot's voice reply, with the
+bot long polling and with the bot in webhook mode inside the backend:
+
+  python benchmarks/bench_telegram_webhook.py --chats 40 --interval 0.01
+
+In polling mode the bot fetches updates with getUpdates and calls the backend
+over HTTP. In webhook mode the fake Telegram posts each update to
+/telegram/webhook, like Telegram does, and the bot calls /tele in process.
+Also checks that webhook updates without the secret token are refused.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+import uvicorn
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Keep the job queue and caches of this run out of the working directory
+directory = tempfile.mkdtemp(prefix="bench_telegram_webhook_")
+os.environ.setdefault("JOB_QUEUE_PATH", os.path.join(directory, "jobs.sqlite3"))
+os.environ.setdefault("TTS_CACHE_DIR", os.path.join(directory, "tts_cache"))
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+
+import backend
+import tele_bot
+from benchmarks.stubs import FAKE_MP3, AgentStub, disable_admission
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def percentile(samples, q):
+  if not samples:
+    return 0.0
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def free_port():
+  with socket.socket() as sock:
+    sock.bind(("127.0.0.1", 0))
+    return sock.getsockname()[1]
+
+
+# The Bot API methods the bot calls, the JigsawStack TTS route of the backend, and a way to
+# send an update the way Telegram does: kept for getUpdates, or posted to the webhook once set
+class FakeTelegram:
+  def __init__(self, chats):
+    self.chats = chats
+    self.updates = []
+    self.new_update = asyncio.Condition()
+    self.sent_at = {}
+    self.replied_at = {}
+    self.calls = {"getUpdates": 0, "webhook": 0}
+    self.webhook = None
+    self.secret = None
+    self.done = asyncio.Event()
+    self.session = None
+    self.deliveries = []
+
+  def build_app(self):
+    app = web.Application()
+    app.router.add_post(r"/bot{token}/{method}", self.bot_api)
+    app.router.add_post("/v1/ai/tts", self.tts)
+    return app
+
+  async def bot_api(self, request):
+    method = request.match_info["method"]
+    data = await request.post()
+    if method == "getMe":
+      return self.ok(BOT_USER)
+    if method in ("deleteWebhook", "sendChatAction"):
+      return self.ok(True)
+    if method == "setWebhook":
+      self.webhook = data["url"]
+      self.secret = data.get("secret_token")
+      return self.ok(True)
+    if method == "getUpdates":
+      self.calls["getUpdates"] += 1
+      return self.ok(await self.get_updates(int(data.get("offset") or 0), float(data.get("timeout") or 0)))
+
+    chat_id = int(data["chat_id"])
+    message = {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+    if method == "sendVoice":
+      self.replied_at[chat_id] = time.perf_counter()
+      if len(self.replied_at) == self.chats:
+        self.done.set()
+      message["voice"] = {"file_id": f"voice-{chat_id}", "file_unique_id": f"voice-{chat_id}", "duration": 1}
+    else:
+      message["text"] = data.get("text", "")
+    return self.ok(message)
+
+  # Long polling: hold the request until there is an update past the offset or the timeout passes
+  async def get_updates(self, offset, timeout):
+    async with self.new_update:
+      try:
+        await asyncio.wait_for(
+          self.new_update.wait_for(lambda: any(update["update_id"] >= offset for update in self.updates)),
+          timeout
+        )
+      except asyncio.TimeoutError:
+        pass
+      return [update for update in self.updates if update["update_id"] >= offset]
+
+  async def tts(self, request):
+    await request.json()
+    return web.Response(body=FAKE_MP3, content_type="audio/mpeg")
+
+  def ok(self, result):
+    return web.json_response({"ok": True, "result": result})
+
+  async def send(self, i):
+    chat_id = 1000 + i
+    update = {
+      "update_id": i + 1,
+      "message": {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"User {i}"},
+        "text": f"/verify claim {i}: free durian for every household",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 7}]
+      }
+    }
+    self.sent_at[chat_id] = time.perf_counter()
+    if self.webhook:
+      # Telegram delivers to webhooks over several connections at once
+      self.deliveries.append(asyncio.create_task(self.deliver(update)))
+      return
+    async with self.new_update:
+      self.updates.append(update)
+      self.new_update.notify_all()
+
+  async def deliver(self, update):
+    self.calls["webhook"] += 1
+    async with self.session.post(self.webhook, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": self.secret}) as response:
+      assert response.status == 200, f"webhook answered {response.status}"
+
+  def latencies(self):
+    return [self.replied_at[chat_id] - sent for chat_id, sent in self.sent_at.items() if chat_id in self.replied_at]
+
+
+async def run(args, mode):
+  telegram = FakeTelegram(args.chats)
+  runner = web.AppRunner(telegram.build_app())
+  await runner.setup()
+  telegram_port = free_port()
+  await web.TCPSite(runner, "127.0.0.1", telegram_port).start()
+  telegram_url = f"http://127.0.0.1:{telegram_port}"
+  telegram.session = aiohttp.ClientSession()
+
+  backend_port = free_port()
+  backend_url = f"http://127.0.0.1:{backend_port}"
+  backend.JIGSAWSTACK_TTS_URL = f"{telegram_url}/v1/ai/tts"
+  backend.TELEGRAM_WEBHOOK_URL = backend_url if mode == "webhook" else None
+  tele_bot.TOKEN = TOKEN
+  tele_bot.TELEGRAM_API_URL = telegram_url
+  tele_bot.BACKEND_URL = backend_url
+  tele_bot.TELEGRAM_WEBHOOK_SECRET = SECRET
+  server = uvicorn.Server(uvicorn.Config(backend.app, host="127.0.0.1", port=backend_port, log_level="warning"))
+  serving = asyncio.create_task(server.serve())
+  while not server.started:
+    await asyncio.sleep(0.01)
+
+  application = None
+  if mode == "polling":
+    application = tele_bot.build_application(TOKEN, telegram_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    await application.updater.start_polling(timeout=10)
+  else:
+    assert telegram.webhook == f"{backend_url}{tele_bot.TELEGRAM_WEBHOOK_PATH}", "the backend did not set the webhook"
+    # Updates without the secret must not reach the bot
+    async with telegram.session.post(f"{backend_url}{tele_bot.TELEGRAM_WEBHOOK_PATH}", json={"update_id": 0}) as response:
+      assert response.status == 403, f"an update without the secret got {response.status}"
+
+  start = time.perf_counter()
+  for i in range(args.chats):
+    await telegram.send(i)
+    await asyncio.sleep(args.interval)
+  await asyncio.wait_for(telegram.done.wait(), 60)
+  elapsed = time.perf_counter() - start
+  await asyncio.gather(*telegram.deliveries)
+
+  if application is not None:
+    await application.updater.stop()
+    await application.stop()
+    await application.post_shutdown(application)
+    await application.shutdown()
+  server.should_exit = True
+  await serving
+  await telegram.session.close()
+  await runner.cleanup()
+  return telegram.latencies(), elapsed, telegram.calls
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--chats", type=int, default=40)
+  parser.add_argument("--interval", type=float, default=0.01, help="seconds between messages")
+  parser.add_argument("--llm-latency", type=float, default=0.5)
+  args = parser.parse_args()
+
+  AgentStub(latency=args.llm_latency).install(backend)
+  disable_admission(backend)
+  # The stub answers without agents
+  backend.WARMUP = False
+  # The bot fetches the audio by id, which is served from the memory tier. Every claim differs so nothing is reused.
+  backend.tts_cache = TTSCache(disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+
+  print(f"{args.chats} chats, one message every {args.interval}s, agent answers in {args.llm_latency}s\n")
+  print(f"{'mode':<10}{'replies':>9}{'p50':>8}{'p95':>8}{'max':>8}{'seconds':>9}  telegram calls")
+  for mode in ("polling", "webhook"):
+    latencies, elapsed, calls = asyncio.run(run(args, mode))
+    print(f"{mode:<10}{len(latencies):>9}{percentile(latencies, 0.5):>8.3f}{percentile(latencies, 0.95):>8.3f}"
+          f"{max(latencies):>8.3f}{elapsed:>9.2f}  {calls}")
+    assert len(latencies) == args.chats, f"{mode}: {args.chats - len(latencies)} messages got no reply"
+
+
+if __name__ == "__main__":
+  main()
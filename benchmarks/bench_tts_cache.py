@@ -0,0 +1,71 @@
+"""
+Replay a skewed (Zipf) workload of fact-check answers through get_TTS_file,
+with and without the TTS cache, against a stubbed JigsawStack API:
+
+  python benchmarks/bench_tts_cache.py --requests 2000 --distinct 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import make_upstream_transport
+from tts_cache import TTSCache
+
+
+def zipf_workload(requests, distinct, skew, seed):
+  rng = random.Random(seed)
+  weights = [1 / (rank ** skew) for rank in range(1, distinct + 1)]
+  texts = [f"Wah this one fake news lah, claim number {i} not true. Check the sources." for i in range(distinct)]
+  return rng.choices(texts, weights=weights, k=requests)
+
+
+async def replay(workload, concurrency):
+  semaphore = asyncio.Semaphore(concurrency)
+
+  async def one(text):
+    async with semaphore:
+      return await backend.get_TTS_file(text=text, voice="en-SG-female-1")
+
+  start = time.perf_counter()
+  await asyncio.gather(*[one(text) for text in workload])
+  return time.perf_counter() - start
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--requests", type=int, default=2000)
+  parser.add_argument("--distinct", type=int, default=200)
+  parser.add_argument("--skew", type=float, default=1.1)
+  parser.add_argument("--concurrency", type=int, default=50)
+  parser.add_argument("--tts-latency", type=float, default=0.3)
+  args = parser.parse_args()
+
+  workload = zipf_workload(args.requests, args.distinct, args.skew, seed=0)
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(tts_latency=args.tts_latency))
+
+  with tempfile.TemporaryDirectory() as directory:
+    modes = {
+      "no cache": TTSCache(memory_bytes=0, disk_bytes=0, directory=directory),
+      "memory + disk": TTSCache(directory=directory),
+    }
+
+    print(f"{'mode':<16}{'seconds':>10}{'req/s':>10}{'hit ratio':>12}{'MB saved':>10}")
+    for name, cache in modes.items():
+      backend.tts_cache = cache
+      elapsed = asyncio.run(replay(workload, args.concurrency))
+      stats = cache.stats()
+      print(f"{name:<16}{elapsed:>10.2f}{args.requests / elapsed:>10.1f}"
+            f"{stats['hit_ratio']:>12.2%}{stats['bytes_saved'] / 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,59 @@
+"""
+Wall-clock latency of a long answer when TTS waits for the whole answer,
+against synthesizing sentence chunks while the LLM is still generating:
+
+  python benchmarks/bench_tts_pipeline.py --sentences 8 --llm-latency 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from benchmarks.stubs import AgentStub, make_upstream_transport
+from tts_cache import TTSCache
+
+SENTENCE = "Wah this one confirm fake news lah, the government never say anything like that one."
+
+
+async def sequential(agent):
+  text = await agent.aget_response_from_ai_agent("llama-3.3-70b-versatile", "Groq", True, ["claim"], "")
+  return await backend.synthesize_speech(text, "en-SG-female-1")
+
+
+async def pipelined():
+  _, audio = await backend.generate_with_speech("llama-3.3-70b-versatile", "Groq", True, ["claim"], "", "en-SG-female-1")
+  return audio
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--sentences", type=int, default=8)
+  parser.add_argument("--llm-latency", type=float, default=3.0)
+  parser.add_argument("--tts-latency", type=float, default=0.3)
+  parser.add_argument("--tts-seconds-per-char", type=float, default=0.004)
+  args = parser.parse_args()
+
+  agent = AgentStub(latency=args.llm_latency, answer=" ".join([SENTENCE] * args.sentences))
+  agent.install(backend)
+  backend.http_client = httpx.AsyncClient(transport=make_upstream_transport(
+    tts_latency=args.tts_latency,
+    tts_seconds_per_char=args.tts_seconds_per_char
+  ))
+
+  print(f"{'mode':<12}{'seconds':>10}{'audio KB':>10}")
+  for name, run in (("sequential", lambda: sequential(agent)), ("pipelined", pipelined)):
+    backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+    start = time.perf_counter()
+    audio = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12}{elapsed:>10.2f}{len(audio) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,152 @@
+"""
+Runs /chat, /chat/stream and /tele through the real ReAct agent, with stub
+chat models that report token usage and stub upstreams, and checks the token,
+tool call and cost accounting against what the stubs reported:
+
+  python benchmarks/bench_usage.py --requests 20 --searches 2
+
+The /chat requests use a short and a long system prompt, so GET /usage should
+rank the long one as the costlier, and a run stopped at its first search should
+still be accounted, under the "cancelled" outcome. Also reports the time the accounting adds
+to each agent run, and summarizes the rolling usage log like
+`python accounting.py .usage.jsonl` does.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+
+import accounting
+import ai_agent
+import backend
+import search_cache
+from benchmarks.stub_upstreams import build_app
+from benchmarks.stubs import Latency, StubChatModel, disable_admission
+from tts_cache import TTSCache
+from verdict_cache import VerdictCache
+
+MODEL = "llama-3.3-70b-versatile"
+SHORT_PROMPT = "Act as an AI chatbot who is smart and friendly"
+LONG_PROMPT = " ".join(["You are a careful fact-checker. Explain your reasoning, cite every source and answer in Singlish."] * 20)
+
+
+def configure(searches):
+  def stub_model(model, **kwargs):
+    return StubChatModel(model_id=model, latency=Latency("fixed:0.01"), searches=searches)
+
+  ai_agent.ChatGroq = stub_model
+  ai_agent.ChatOpenAI = stub_model
+  ai_agent.agent_registry = ai_agent.AgentRegistry()
+
+  transport = httpx.ASGITransport(app=build_app(Latency("fixed:0.01"), Latency("fixed:0.01"), Latency("fixed:0.01")))
+  search_cache.async_client = httpx.AsyncClient(transport=transport, base_url="http://upstream")
+  search_cache.search_cache.ttl = 0
+  search_cache.TAVILY_SEARCH_URL = "http://upstream/search"
+  backend.http_client = httpx.AsyncClient(transport=transport, base_url="http://upstream")
+  backend.JIGSAWSTACK_TTS_URL = "http://upstream/v1/ai/tts"
+  backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+  backend.verdict_cache = VerdictCache(max_size=0)
+  backend.response_cache = None
+
+
+def chat_request(i, system_prompt):
+  return {
+    "model_name": MODEL,
+    "model_provider": "Groq",
+    "system_prompt": system_prompt,
+    "messages": [f"Question {i}: is it true that CPF interest is going up?"],
+    "allow_search": True
+  }
+
+
+async def run(args):
+  transport = httpx.ASGITransport(app=backend.app)
+  async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+    for i in range(args.requests):
+      (await client.post("/chat", json=chat_request(i, LONG_PROMPT if i % 2 else SHORT_PROMPT))).raise_for_status()
+
+    # The usage event of the stream carries what was counted for that run
+    events = []
+    async with client.stream("POST", "/chat/stream", json=chat_request("stream", SHORT_PROMPT)) as response:
+      async for line in response.aiter_lines():
+        events.append(line)
+    usage_event = [event for event in map(json.loads, events) if event["type"] == "usage"][0]
+
+    for i in range(args.requests // 2):
+      (await client.post("/tele", json=[f"Claim {i}: free durian for every household"], params={"chat_id": str(i)})).raise_for_status()
+
+    return usage_event, (await client.get("/usage")).json(), (await client.get("/stats")).json()["usage"]
+
+
+# Stop a run at its first search, like the slower run of a hedged request is cancelled
+async def cancelled_run():
+  stream = ai_agent.astream_response_from_ai_agent(MODEL, "Groq", True, ["Claim: free durian, cancelled"], SHORT_PROMPT)
+  async for event in stream:
+    if event["type"] == "tool_call":
+      break
+  await stream.aclose()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--requests", type=int, default=20)
+  parser.add_argument("--searches", type=int, default=2)
+  args = parser.parse_args()
+
+  disable_admission(backend)
+  configure(args.searches)
+
+  with tempfile.TemporaryDirectory() as directory:
+    log_path = os.path.join(directory, "usage.jsonl")
+    ledger = accounting.usage_ledger = ai_agent.usage_ledger = backend.usage_ledger = accounting.UsageLedger(log_path)
+    usage_event, report, stats = asyncio.run(run(args))
+
+    runs = args.requests + 1 + args.requests // 2
+    answer_tokens = len(StubChatModel.model_fields["answer"].default.split())
+    print(f"usage event of one /chat/stream run: {usage_event}\n")
+    print(f"{'route':<14}{'requests':>9}{'prompt tok':>12}{'output tok':>12}{'calls':>7}{'rounds':>8}{'tools':>7}{'cost $':>10}")
+    for row in report["by_route"]:
+      print(f"{row['key']:<14}{row['requests']:>9}{row['prompt_tokens']:>12}{row['completion_tokens']:>12}"
+            f"{row['model_calls']:>7}{row['iterations']:>8}{row['tool_calls']:>7}{row['cost']:>10.5f}")
+    print("\nsystem prompts, costliest first:")
+    for row in report["by_system_prompt"]:
+      print(f"  {row['requests']:>4} runs {row['prompt_tokens']:>8} prompt tokens  ${row['cost']:.5f}  {row['prompt'][:50]!r}")
+
+    totals = report["totals"]
+    assert totals["requests"] == runs, f"{totals['requests']} runs recorded, {runs} made"
+    assert totals["tool_calls"] == totals["iterations"] == runs * args.searches, "tool calls or search rounds were miscounted"
+    assert totals["model_calls"] == runs * (args.searches + 1)
+    # Each search round costs 10 output tokens in the stub, then the answer
+    assert usage_event["completion_tokens"] == 10 * args.searches + answer_tokens, "completion tokens do not match the stub's"
+    assert usage_event["cost"] == accounting.cost_of(MODEL, usage_event["prompt_tokens"], usage_event["completion_tokens"])
+    assert report["by_system_prompt"][0]["prompt"] == LONG_PROMPT[:80], "the long system prompt is not ranked costliest"
+    assert stats["requests"] == runs and set(stats["by_route"]) == {"/chat", "/chat/stream", "/tele"}
+    with open(ledger.path) as f:
+      assert sum(1 for _ in f) == runs, "not every run reached the usage log"
+
+    # The tokens a cancelled run already used are accounted as well
+    asyncio.run(cancelled_run())
+    cancelled = ledger.stats()["by_outcome"].get("cancelled")
+    assert cancelled and cancelled["requests"] == 1 and cancelled["prompt_tokens"] > 0, "a cancelled run was not accounted"
+    print(f"\ncancelled run: {cancelled['prompt_tokens']} prompt tokens, {cancelled['model_calls']} model calls, ${cancelled['cost']:.5f}")
+
+    accounting.summarize(log_path, top=3)
+
+    # What recording a run costs, against the milliseconds to seconds of the run itself
+    usage = {"prompt_tokens": 1000, "completion_tokens": 100, "model_calls": 3, "iterations": 2, "tool_calls": 2}
+    start = time.perf_counter()
+    for i in range(10000):
+      ledger.record(MODEL, "/chat", f"prompt {i % 100}", usage)
+    print(f"\nrecording one run, log line included: {(time.perf_counter() - start) / 10000 * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+  main()
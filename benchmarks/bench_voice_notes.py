@@ -0,0 +1,133 @@
+"""
+Size and latency of answers sent as MP3 against Opus voice notes, for short,
+medium and long answers:
+
+  python benchmarks/bench_voice_notes.py --ffmpeg /usr/bin/ffmpeg --mp3-bitrate 128k
+
+Each sentence chunk is synthesized by a stub TTS that answers after
+--tts-latency seconds with real MP3 audio of speech length (made by ffmpeg),
+while the answer is generated one sentence every --sentence-interval seconds.
+The audio is then built three ways:
+
+- mp3: the stitched TTS output, as before
+- transcode after: the stitched MP3 transcoded once it is complete
+- streaming: each chunk fed to the encoder as soon as it is ready
+
+The upload column is the time to send the base64 payload at --uplink-mbps.
+Also checks that a voice note is still made when a tool call cancels the
+sentences streamed before it, as when the agent searches mid-answer.
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import os
+import subprocess
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--ffmpeg", default=os.getenv("FFMPEG_PATH", "ffmpeg"))
+parser.add_argument("--mp3-bitrate", default="128k", help="bitrate of the stub TTS audio")
+parser.add_argument("--opus-bitrate", default="24k")
+parser.add_argument("--tts-latency", type=float, default=0.4)
+parser.add_argument("--sentence-interval", type=float, default=0.3)
+parser.add_argument("--uplink-mbps", type=float, default=2.0)
+args = parser.parse_args()
+
+# Read by audio.py when it is imported
+os.environ["FFMPEG_PATH"] = args.ffmpeg
+os.environ["OPUS_BITRATE"] = args.opus_bitrate
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import backend
+from audio import audio_format, transcode_to_opus
+
+SENTENCE = "Wah this one fake news lah, the government never say they will give free durian to every household."
+ANSWERS = {"short": 2, "medium": 6, "long": 16}
+# Roughly how fast TTS voices speak
+CHARS_PER_SECOND = 15
+
+
+# MP3 of speech length for text, a tone with noise so the encoders have something to work on.
+# Made once per text so generating it does not compete with the encoder.
+@functools.lru_cache
+def speech_mp3(text):
+  seconds = max(1.0, len(text) / CHARS_PER_SECOND)
+  return subprocess.run([
+    args.ffmpeg, "-hide_banner", "-loglevel", "error",
+    "-f", "lavfi", "-i", "sine=frequency=220:sample_rate=24000",
+    "-f", "lavfi", "-i", "anoisesrc=color=pink:sample_rate=24000:amplitude=0.1",
+    "-filter_complex", "amix=inputs=2", "-t", str(seconds), "-ac", "1",
+    "-c:a", "libmp3lame", "-b:a", args.mp3_bitrate, "-f", "mp3", "pipe:1"
+  ], capture_output=True, check=True).stdout
+
+
+async def stub_synthesize_speech(text, voice):
+  await asyncio.sleep(args.tts_latency)
+  return speech_mp3(text)
+
+
+async def run(sentences, mode):
+  encoder = backend.OpusEncoder() if mode == "streaming" else None
+  pipeline = backend.SpeechPipeline("en-SG-female-1", encoder=encoder)
+  start = time.perf_counter()
+  for _ in range(sentences):
+    await asyncio.sleep(args.sentence_interval)
+    pipeline.add(SENTENCE)
+  audio = await pipeline.finish()
+  if mode == "transcode after":
+    audio = await transcode_to_opus(audio)
+  elif mode == "streaming":
+    audio = pipeline.voice_note
+  return audio, time.perf_counter() - start
+
+
+# A sentence is fed to the encoder, then a tool call throws it away and the answer starts over
+async def after_search(sentences):
+  pipeline = backend.SpeechPipeline("en-SG-female-1", encoder=backend.OpusEncoder())
+  pipeline.add(SENTENCE)
+  await asyncio.sleep(args.tts_latency / 2)
+  pipeline.cancel()
+  for _ in range(sentences):
+    pipeline.add(SENTENCE)
+  audio = await pipeline.finish(5)
+  return audio, pipeline.voice_note
+
+
+def main():
+  backend.synthesize_speech = stub_synthesize_speech
+  speech_mp3(SENTENCE)
+  uplink = args.uplink_mbps * 1_000_000 / 8
+
+  print(f"TTS MP3 at {args.mp3_bitrate}, voice notes at {args.opus_bitrate}, TTS latency {args.tts_latency}s, uplink {args.uplink_mbps} Mbit/s\n")
+  print(f"{'answer':<8}{'audio s':>8}  {'mode':<17}{'bytes':>9}{'base64':>9}{'smaller':>9}{'ready s':>9}{'upload s':>10}")
+  for name, sentences in ANSWERS.items():
+    mp3_size = None
+    ready = {}
+    for mode in ("mp3", "transcode after", "streaming"):
+      audio, seconds = asyncio.run(run(sentences, mode))
+      assert audio is not None and audio_format(audio) == ("mp3" if mode == "mp3" else "ogg"), f"{mode} did not produce its format"
+      if mode != "mp3":
+        assert b"OpusHead" in audio[:100], f"{mode} is not an Opus stream"
+      size = len(audio)
+      ready[mode] = seconds
+      mp3_size = mp3_size or size
+      encoded = len(base64.b64encode(audio))
+      duration = len(SENTENCE) * sentences / CHARS_PER_SECOND
+      print(f"{name:<8}{duration:>8.0f}  {mode:<17}{size:>9}{encoded:>9}{mp3_size / size:>8.1f}x{seconds:>9.2f}{encoded / uplink:>10.2f}")
+      if mode != "mp3":
+        assert size < mp3_size, f"{name}: the voice note is bigger than the MP3"
+    print()
+    # The streamed voice note is ready soon after the MP3, not a whole transcode later
+    assert ready["streaming"] < ready["transcode after"], f"{name}: streaming was not faster than transcoding after"
+
+  audio, voice_note = asyncio.run(after_search(2))
+  assert audio is not None and voice_note is not None and audio_format(voice_note) == "ogg", "no voice note after a tool call"
+  print(f"after a tool call: {len(audio)} bytes MP3, {len(voice_note)} bytes voice note")
+
+
+if __name__ == "__main__":
+  main()
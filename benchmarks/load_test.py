@@ -0,0 +1,273 @@
+"""
+Offline load test of /chat, /tele and /whatsapp.
+
+Starts benchmarks/stub_upstreams.py (Tavily, JigsawStack and the WhatsApp
+relay on :3001) and benchmarks/stub_backend.py (backend.py with stub chat
+models), drives each endpoint at the given concurrency levels and reports
+throughput, latency percentiles, and CPU and memory per backend worker:
+
+  python benchmarks/load_test.py --concurrency 10 50 --requests 200
+  python benchmarks/load_test.py --json results.json
+  python benchmarks/load_test.py --baseline results.json --max-regression 0.2
+
+With --baseline the run exits non-zero when throughput drops or p95 latency
+grows by more than --max-regression, so it can gate CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+# CPU seconds and resident memory of a process and its children, read from /proc
+def process_tree(pid):
+  pids = [pid]
+  for child in open(f"/proc/{pid}/task/{pid}/children").read().split():
+    pids.extend(process_tree(int(child)))
+  return pids
+
+
+def process_usage(pid):
+  usage = {}
+  for worker in process_tree(pid):
+    try:
+      fields = open(f"/proc/{worker}/stat").read().rsplit(")", 1)[1].split()
+      rss_pages = int(open(f"/proc/{worker}/statm").read().split()[1])
+    except OSError:
+      continue
+    usage[worker] = {
+      "cpu_seconds": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+      "rss_mb": rss_pages * PAGE_SIZE / 1e6
+    }
+  return usage
+
+
+def percentile(samples, q):
+  return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def payload(endpoint, claim):
+  if endpoint == "chat":
+    return {
+      "model_name": "llama-3.3-70b-versatile",
+      "model_provider": "Groq",
+      "system_prompt": "You are a helpful assistant",
+      "messages": [claim],
+      "allow_search": True,
+      "tts_enabled": True,
+      "audio_mode": "url"
+    }
+  return [claim]
+
+
+WORDS = (
+  "government mrt hawker vouchers cpf covid vaccine flood haze election minister bus "
+  "water price tax school holiday scam bank police hospital airport island ban free "
+  "grant rebate levy curfew strike outage recall contaminated fine arrest"
+).split()
+
+
+# Unique claims are random word salads so the verdict cache cannot match them
+def claims(count, unique_ratio, seed):
+  rng = random.Random(seed)
+  popular = [f"Forwarded message number {i}: free MRT rides for everyone this weekend" for i in range(10)]
+  return [
+    " ".join(rng.choice(WORDS) for _ in range(12))
+    if rng.random() < unique_ratio else rng.choice(popular)
+    for i in range(count)
+  ]
+
+
+async def drive(base_url, endpoint, concurrency, requests, unique_ratio, backend_pid, seed):
+  work = claims(requests, unique_ratio, seed)
+  latencies = []
+  errors = 0
+  peak = {}
+
+  async def worker(client):
+    nonlocal errors
+    while work:
+      claim = work.pop()
+      start = time.perf_counter()
+      try:
+        response = await client.post(f"/{endpoint}", json=payload(endpoint, claim))
+        if response.status_code not in (200, 202):
+          errors += 1
+      except httpx.HTTPError:
+        errors += 1
+      latencies.append(time.perf_counter() - start)
+
+  # Sample memory while the load runs, keeping the peak per worker
+  async def sample_memory():
+    while True:
+      for worker_pid, usage in process_usage(backend_pid).items():
+        peak[worker_pid] = max(peak.get(worker_pid, 0.0), usage["rss_mb"])
+      await asyncio.sleep(0.25)
+
+  limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+  async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+    before = process_usage(backend_pid)
+    sampler = asyncio.create_task(sample_memory())
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    # /whatsapp only queues the claim, so also time how long the workers take to deliver every reply
+    drain_seconds = None
+    if endpoint == "whatsapp":
+      while True:
+        jobs = (await client.get("/stats")).json()["jobs"]
+        if jobs["depth"] == 0 and jobs["running"] == 0:
+          break
+        await asyncio.sleep(0.25)
+      drain_seconds = time.perf_counter() - start
+    sampler.cancel()
+    measured = time.perf_counter() - start
+    after = process_usage(backend_pid)
+
+  latencies.sort()
+  workers = {
+    str(worker_pid): {
+      "cpu_percent": 100 * (usage["cpu_seconds"] - before.get(worker_pid, {"cpu_seconds": 0.0})["cpu_seconds"]) / measured,
+      "peak_rss_mb": peak.get(worker_pid, usage["rss_mb"])
+    }
+    for worker_pid, usage in after.items()
+  }
+
+  return {
+    "endpoint": endpoint,
+    "concurrency": concurrency,
+    "requests": requests,
+    "errors": errors,
+    "seconds": elapsed,
+    "rps": requests / elapsed,
+    "p50": percentile(latencies, 0.5),
+    "p95": percentile(latencies, 0.95),
+    "p99": percentile(latencies, 0.99),
+    "drain_seconds": drain_seconds,
+    "workers": workers
+  }
+
+
+def wait_ready(url, timeout=60):
+  deadline = time.time() + timeout
+  while time.time() < deadline:
+    try:
+      if httpx.get(url, timeout=1.0).status_code == 200:
+        return
+    except httpx.HTTPError:
+      pass
+    time.sleep(0.25)
+  raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args):
+  upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+  upstream = subprocess.Popen([
+    sys.executable, os.path.join(BENCHMARKS_DIR, "stub_upstreams.py"),
+    "--port", str(args.upstream_port),
+    "--search-latency", args.search_latency,
+    "--tts-latency", args.tts_latency,
+    "--relay-latency", args.relay_latency,
+    "--seed", str(args.seed)
+  ])
+  backend_command = [
+    sys.executable, os.path.join(BENCHMARKS_DIR, "stub_backend.py"),
+    "--port", str(args.backend_port),
+    "--upstream", upstream_url,
+    "--llm-latency", args.llm_latency,
+    "--seed", str(args.seed),
+    "--workers", str(args.workers)
+  ]
+  if args.no_caches:
+    backend_command.append("--no-caches")
+  backend = subprocess.Popen(backend_command)
+
+  wait_ready(f"{upstream_url}/counts")
+  wait_ready(f"http://127.0.0.1:{args.backend_port}/ready")
+  return upstream, backend
+
+
+# Regressions against a previous --json run at the same endpoint and concurrency
+def compare(results, baseline, max_regression):
+  previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+  failures = []
+  for result in results:
+    old = previous.get((result["endpoint"], result["concurrency"]))
+    if old is None:
+      continue
+    if result["rps"] < old["rps"] * (1 - max_regression):
+      failures.append(f"{result['endpoint']}@{result['concurrency']}: rps {old['rps']:.1f} -> {result['rps']:.1f}")
+    if result["p95"] > old["p95"] * (1 + max_regression):
+      failures.append(f"{result['endpoint']}@{result['concurrency']}: p95 {old['p95']:.2f}s -> {result['p95']:.2f}s")
+  return failures
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--endpoints", nargs="+", default=["chat", "tele", "whatsapp"])
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50])
+  parser.add_argument("--requests", type=int, default=200)
+  parser.add_argument("--unique-ratio", type=float, default=1.0, help="share of requests with a claim never seen before")
+  parser.add_argument("--llm-latency", default="lognormal:1.0:0.4")
+  parser.add_argument("--search-latency", default="lognormal:0.8:0.4")
+  parser.add_argument("--tts-latency", default="lognormal:0.6:0.3")
+  parser.add_argument("--relay-latency", default="fixed:0.05")
+  parser.add_argument("--no-caches", action="store_true")
+  parser.add_argument("--workers", type=int, default=1, help="backend worker processes")
+  parser.add_argument("--backend-port", type=int, default=3000)
+  parser.add_argument("--upstream-port", type=int, default=3001)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--json", help="write results to this file")
+  parser.add_argument("--baseline", help="compare against results written by an earlier --json run")
+  parser.add_argument("--max-regression", type=float, default=0.2)
+  args = parser.parse_args()
+
+  upstream, backend = start_servers(args)
+  results = []
+  try:
+    print(f"{'endpoint':<10}{'conc':>6}{'rps':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'errors':>8}  workers (cpu%, peak MB)")
+    for endpoint in args.endpoints:
+      for concurrency in args.concurrency:
+        result = asyncio.run(drive(
+          f"http://127.0.0.1:{args.backend_port}", endpoint, concurrency,
+          args.requests, args.unique_ratio, backend.pid, args.seed + concurrency
+        ))
+        results.append(result)
+        workers = ", ".join(f"{w['cpu_percent']:.0f}%/{w['peak_rss_mb']:.0f}MB" for w in result["workers"].values())
+        print(f"{endpoint:<10}{concurrency:>6}{result['rps']:>9.1f}{result['p50']:>8.2f}{result['p95']:>8.2f}"
+              f"{result['p99']:>8.2f}{result['errors']:>8}  {workers}")
+        if result["drain_seconds"] is not None:
+          print(f"{'':<16}queued replies delivered after {result['drain_seconds']:.2f}s")
+  finally:
+    backend.terminate()
+    upstream.terminate()
+    backend.wait()
+    upstream.wait()
+
+  config = {key: value for key, value in vars(args).items() if key not in ("json", "baseline")}
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump({"config": config, "results": results}, f, indent=2)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      failures = compare(results, json.load(f), args.max_regression)
+    for failure in failures:
+      print(f"REGRESSION {failure}")
+    if failures:
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
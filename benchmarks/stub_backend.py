@@ -0,0 +1,95 @@
+"""
+Run backend.py with every paid upstream replaced by a local stand-in:
+the chat models by StubChatModel, and Tavily, JigsawStack and the WhatsApp
+relay by the server in benchmarks/stub_upstreams.py:
+
+  python benchmarks/stub_backend.py --port 3000 --upstream http://127.0.0.1:3001
+  python benchmarks/stub_backend.py --workers 4
+
+The caches and the job queue live in a fresh temporary directory, shared by
+all workers.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# The Tavily tool refuses to build without a key
+os.environ.setdefault("TAVILY_API_KEY", "stub")
+# Keep the usage log out of the working tree
+os.environ.setdefault("USAGE_LOG_PATH", "")
+
+
+def install_stubs(upstream, llm_latency, seed=0, caches=True):
+  import ai_agent
+  import backend
+  import search_cache
+  from benchmarks.stubs import Latency, StubChatModel, disable_admission
+  from tts_cache import TTSCache
+  from verdict_cache import VerdictCache
+
+  latency = Latency(llm_latency, seed)
+
+  def stub_model(model, **kwargs):
+    return StubChatModel(model_id=model, latency=latency)
+
+  ai_agent.ChatGroq = stub_model
+  ai_agent.ChatOpenAI = stub_model
+  search_cache.TAVILY_SEARCH_URL = f"{upstream}/search"
+  backend.JIGSAWSTACK_TTS_URL = f"{upstream}/v1/ai/tts"
+  backend.WHATSAPP_SERVER_URL = f"{upstream}/reply"
+  # Measure the pipeline, admission control has its own benchmark
+  disable_admission(backend)
+
+  if not caches:
+    backend.tts_cache = TTSCache(memory_bytes=0, disk_bytes=0)
+    backend.verdict_cache = VerdictCache(max_size=0)
+    search_cache.search_cache.ttl = 0
+
+  return backend.app
+
+
+# Entry point for each worker process, configured through the environment by main()
+def create_app():
+  return install_stubs(
+    os.environ["STUB_UPSTREAM"],
+    os.environ["STUB_LLM_LATENCY"],
+    int(os.environ["STUB_SEED"]) + os.getpid(),
+    caches=os.environ["STUB_CACHES"] == "1"
+  )
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=3000)
+  parser.add_argument("--upstream", default="http://127.0.0.1:3001")
+  parser.add_argument("--llm-latency", default="lognormal:1.0:0.4")
+  parser.add_argument("--no-caches", action="store_true")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--workers", type=int, default=1)
+  args = parser.parse_args()
+
+  # Set before backend.py is imported, here and in every worker
+  directory = tempfile.mkdtemp(prefix="stub_backend_")
+  os.environ["TTS_CACHE_DIR"] = os.path.join(directory, "tts_cache")
+  os.environ["JOB_QUEUE_PATH"] = os.path.join(directory, "jobs.sqlite3")
+  os.environ["SHARED_CACHE_PATH"] = os.path.join(directory, "shared_cache.sqlite3")
+  os.environ["STUB_UPSTREAM"] = args.upstream
+  os.environ["STUB_LLM_LATENCY"] = args.llm_latency
+  os.environ["STUB_SEED"] = str(args.seed)
+  os.environ["STUB_CACHES"] = "0" if args.no_caches else "1"
+
+  if args.workers > 1:
+    uvicorn.run("benchmarks.stub_backend:create_app", factory=True, workers=args.workers,
+                host=args.host, port=args.port, log_level="warning")
+  else:
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,88 @@
+"""
+Local stand-ins for the Tavily search API, the JigsawStack TTS API and the
+WhatsApp relay, each answering after a delay drawn from a configurable
+distribution (see benchmarks/stubs.py for the format):
+
+  python benchmarks/stub_upstreams.py --port 3001 --tts-latency lognormal:0.6:0.3
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks.stubs import Latency
+
+# Roughly what a low bitrate MP3 of speech weighs per character of text
+AUDIO_BYTES_PER_CHAR = 250
+MP3_FRAME = b"\xff\xfb\x90\x00" + bytes(252)
+
+
+def build_app(search_latency, tts_latency, relay_latency):
+  app = FastAPI()
+  app.state.counts = {"search": 0, "tts": 0, "reply": 0}
+
+  @app.post("/search")
+  async def search(request: Request):
+    body = await request.json()
+    app.state.counts["search"] += 1
+    await asyncio.sleep(search_latency.sample())
+    return {
+      "query": body.get("query"),
+      "results": [
+        {
+          "title": f"Fact check result {i}",
+          "url": f"https://factcheck.example/{i}",
+          "content": f"Official sources say the claim '{body.get('query')}' is not accurate.",
+          "score": 0.9 - i * 0.1
+        }
+        for i in range(body.get("max_results") or 2)
+      ]
+    }
+
+  @app.post("/v1/ai/tts")
+  async def tts(request: Request):
+    body = await request.json()
+    app.state.counts["tts"] += 1
+    await asyncio.sleep(tts_latency.sample())
+    frames = max(1, len(body.get("text", "")) * AUDIO_BYTES_PER_CHAR // len(MP3_FRAME))
+    return Response(content=b"ID3\x04\x00\x00\x00\x00\x00\x00" + MP3_FRAME * frames, media_type="audio/mpeg")
+
+  @app.post("/reply")
+  async def reply(request: Request):
+    await request.body()
+    app.state.counts["reply"] += 1
+    await asyncio.sleep(relay_latency.sample())
+    return {"ok": True}
+
+  @app.get("/counts")
+  def counts():
+    return app.state.counts
+
+  return app
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=3001)
+  parser.add_argument("--search-latency", default="lognormal:0.8:0.4")
+  parser.add_argument("--tts-latency", default="lognormal:0.6:0.3")
+  parser.add_argument("--relay-latency", default="fixed:0.05")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  app = build_app(
+    Latency(args.search_latency, args.seed),
+    Latency(args.tts_latency, args.seed + 1),
+    Latency(args.relay_latency, args.seed + 2)
+  )
+  uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+  main()
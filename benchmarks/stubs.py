@@ -0,0 +1,200 @@
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from typing import Any
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Deterministic stand-ins for the paid upstreams used by backend.py
+# An empty ID3v2 tag followed by 16 KB of frame-like bytes
+FAKE_MP3 = b"ID3\x04\x00\x00\x00\x00\x00\x00" + (b"\xff\xfb\x90\x00" + bytes(252)) * 64
+
+
+def sample_latency(mean, jitter=0.0, rng=random):
+  if jitter <= 0:
+    return mean
+  return max(0.0, rng.gauss(mean, jitter))
+
+
+# Latency distributions are given as "kind:mean[:spread]", e.g. "fixed:0.5",
+# "normal:0.5:0.1", "lognormal:0.5:0.4" (sigma of the log) or "exponential:0.5"
+class Latency:
+  def __init__(self, spec, seed=0):
+    parts = spec.split(":")
+    self.spec = spec
+    self.kind = parts[0]
+    self.mean = float(parts[1]) if len(parts) > 1 else 0.0
+    self.spread = float(parts[2]) if len(parts) > 2 else 0.0
+    self.rng = random.Random(seed)
+
+    if self.kind not in ("fixed", "normal", "lognormal", "exponential"):
+      raise ValueError(f"Unknown latency distribution: {spec}")
+
+  def sample(self):
+    if self.kind == "fixed" or self.mean <= 0:
+      return self.mean
+    if self.kind == "normal":
+      return max(0.0, self.rng.gauss(self.mean, self.spread))
+    if self.kind == "lognormal":
+      # Shift mu so the distribution keeps the requested mean
+      mu = math.log(self.mean) - self.spread ** 2 / 2
+      return self.rng.lognormvariate(mu, self.spread)
+    return self.rng.expovariate(1 / self.mean)
+
+  def __repr__(self):
+    return self.spec
+
+
+# Chat model that searches `searches` times when it has tools, then answers after a sampled delay
+class StubChatModel(BaseChatModel):
+  model_id: str = "stub"
+  latency: Any = None
+  answer: str = "Wah this one fake news lah. The government never announce anything like that. Check the official sources before you forward."
+  has_tools: bool = False
+  tokens_per_chunk: int = 3
+  searches: int = 1
+
+  @property
+  def _llm_type(self):
+    return "stub-chat-model"
+
+  def bind_tools(self, tools, **kwargs):
+    return self.model_copy(update={"has_tools": bool(tools)})
+
+  def delay(self):
+    return self.latency.sample() if self.latency is not None else 0.0
+
+  def reply(self, messages):
+    prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+    usage = {"input_tokens": prompt_tokens, "output_tokens": 0, "total_tokens": prompt_tokens}
+
+    # Searches made since the latest question
+    searched = 0
+    for message in reversed(messages):
+      if isinstance(message, HumanMessage):
+        break
+      searched += isinstance(message, ToolMessage)
+
+    if self.has_tools and searched < self.searches:
+      query = f"{str(messages[-1].content)[:200]} {searched}" if searched else str(messages[-1].content)[:200]
+      return AIMessage(
+        content="",
+        tool_calls=[{"name": "tavily_search_results_json", "args": {"query": query}, "id": uuid.uuid4().hex}],
+        usage_metadata={**usage, "output_tokens": 10, "total_tokens": prompt_tokens + 10}
+      )
+
+    output_tokens = len(self.answer.split())
+    return AIMessage(
+      content=self.answer,
+      usage_metadata={**usage, "output_tokens": output_tokens, "total_tokens": prompt_tokens + output_tokens}
+    )
+
+  def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+    time.sleep(self.delay())
+    return ChatResult(generations=[ChatGeneration(message=self.reply(messages))])
+
+  async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+    await asyncio.sleep(self.delay())
+    return ChatResult(generations=[ChatGeneration(message=self.reply(messages))])
+
+  # Spread the answer over the sampled delay, a few words per chunk
+  async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+    message = self.reply(messages)
+    delay = self.delay()
+
+    if message.tool_calls:
+      await asyncio.sleep(delay)
+      call = message.tool_calls[0]
+      yield ChatGenerationChunk(message=AIMessageChunk(
+        content="",
+        tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}],
+        usage_metadata=message.usage_metadata
+      ))
+      return
+
+    words = message.content.split(" ")
+    chunks = [" ".join(words[i:i + self.tokens_per_chunk]) for i in range(0, len(words), self.tokens_per_chunk)]
+    for i, chunk in enumerate(chunks):
+      await asyncio.sleep(delay / len(chunks))
+      last = i == len(chunks) - 1
+      yield ChatGenerationChunk(message=AIMessageChunk(
+        content=chunk if last else chunk + " ",
+        usage_metadata=message.usage_metadata if last else None
+      ))
+
+
+# Stand-in for the ai_agent functions, answering after a configurable delay
+class AgentStub:
+  def __init__(self, latency=0.5, jitter=0.0, seed=0, answer=None):
+    self.latency = latency
+    self.jitter = jitter
+    self.rng = random.Random(seed)
+    self.answer = answer
+    self.calls = 0
+
+  def answer_for(self, llm_id, query):
+    return self.answer or f"[{llm_id}] " + " ".join(query)
+
+  async def aget_response_from_ai_agent(self, llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+    self.calls += 1
+    await asyncio.sleep(sample_latency(self.latency, self.jitter, self.rng))
+    return self.answer_for(llm_id, query)
+
+  def get_response_from_ai_agent(self, llm_id, provider, allow_search, query, system_prompt):
+    self.calls += 1
+    time.sleep(sample_latency(self.latency, self.jitter, self.rng))
+    return self.answer_for(llm_id, query)
+
+  # Tokens are spread evenly over the latency, like a model generating them
+  async def astream_response_from_ai_agent(self, llm_id, provider, allow_search, query, system_prompt, thread_id=None):
+    self.calls += 1
+    tokens = self.answer_for(llm_id, query).split(" ")
+    delay = sample_latency(self.latency, self.jitter, self.rng) / len(tokens)
+    for i, token in enumerate(tokens):
+      await asyncio.sleep(delay)
+      yield {"type": "token", "content": token if i == len(tokens) - 1 else token + " "}
+
+  # The stub keeps no conversations, so every claim of a chat is answered standalone
+  async def has_conversation(self, llm_id, provider, allow_search, system_prompt, thread_id):
+    return False
+
+  async def remember_turn(self, llm_id, provider, allow_search, system_prompt, thread_id, query, answer):
+    pass
+
+  # Point backend.py at this stub
+  def install(self, backend):
+    backend.aget_response_from_ai_agent = self.aget_response_from_ai_agent
+    backend.astream_response_from_ai_agent = self.astream_response_from_ai_agent
+    backend.has_conversation = self.has_conversation
+    backend.remember_turn = self.remember_turn
+
+
+def make_upstream_transport(tts_latency=0.3, relay_latency=0.05, jitter=0.0, seed=0, audio=FAKE_MP3, tts_seconds_per_char=0.0):
+  rng = random.Random(seed)
+
+  # Answers both the JigsawStack TTS call and the WhatsApp relay
+  async def handler(request):
+    if request.url.path.endswith("/tts"):
+      chars = len(request.read())
+      await asyncio.sleep(sample_latency(tts_latency, jitter, rng) + chars * tts_seconds_per_char)
+      return httpx.Response(200, content=audio, headers={"content-type": "audio/mpeg"})
+
+    await asyncio.sleep(sample_latency(relay_latency, jitter, rng))
+    return httpx.Response(200, json={"ok": True})
+
+  return httpx.MockTransport(handler)
+
+
+# Lift backend.py's concurrency limits and rate limits, for benchmarks that measure the pipeline itself
+def disable_admission(backend):
+  for limiter in backend.admission_limiters.values():
+    limiter.limit = 10 ** 9
+    limiter.max_queue = None
+  for limiter in backend.client_rate_limiters.values():
+    limiter.rate = 0
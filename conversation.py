@@ -0,0 +1,169 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+
+# History tokens kept per chat before old turns are compacted, and how they are compacted:
+# "summarize" replaces them with a summary written by the chat's model, "truncate" drops them
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "2000"))
+CONVERSATION_COMPACTION = os.getenv("CONVERSATION_COMPACTION", "summarize")
+# Chats kept before the least recently active one is forgotten
+CONVERSATION_MAX_THREADS = int(os.getenv("CONVERSATION_MAX_THREADS", "10000"))
+# SQLite file for the checkpoints, used when langgraph-checkpoint-sqlite is installed
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", ".checkpoints.sqlite3")
+
+SUMMARY_PROMPT = (
+  "Summarize this conversation between a user and a fact-checking assistant in a few sentences. "
+  "Keep the claims that were checked, the verdicts and the sources, so follow-up questions can be answered."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+logger = logging.getLogger(__name__)
+
+
+# Rough token count, about 4 characters per token plus a few tokens of overhead per message
+def count_tokens(messages):
+  total = 0
+  for message in messages:
+    total += 4 + len(str(message.content)) // 4
+    for call in getattr(message, "tool_calls", None) or []:
+      total += len(str(call.get("args", ""))) // 4
+  return total
+
+
+def make_checkpointer(path=CHECKPOINT_PATH):
+  try:
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+  except ImportError:
+    from langgraph.checkpoint.memory import MemorySaver
+    logger.warning("langgraph-checkpoint-sqlite is not installed, conversations are kept in memory only")
+    return MemorySaver()
+
+  return AsyncSqliteSaver(aiosqlite.connect(path))
+
+
+def transcript(messages):
+  lines = []
+  for message in messages:
+    if isinstance(message, HumanMessage):
+      lines.append(f"User: {message.content}")
+    elif isinstance(message, AIMessage) and message.content:
+      lines.append(f"Assistant: {message.content}")
+    elif isinstance(message, ToolMessage):
+      lines.append(f"Search result: {str(message.content)[:500]}")
+    elif isinstance(message, SystemMessage):
+      lines.append(str(message.content))
+  return "\n".join(lines)
+
+
+# Per-chat conversation state kept by a LangGraph checkpointer, bounded by a token budget
+class ConversationStore:
+  def __init__(self, budget=CONVERSATION_TOKEN_BUDGET, compaction=CONVERSATION_COMPACTION, max_threads=CONVERSATION_MAX_THREADS):
+    self.budget = budget
+    self.compaction = compaction
+    self.max_threads = max_threads
+    self.saver = None
+    # thread id -> None, least recently active first
+    self.threads = OrderedDict()
+    self.compactions = 0
+    self.summaries = 0
+    self.tokens_removed = 0
+    self.lock = threading.Lock()
+
+  # Created on first use, the SQLite saver has to be made inside the event loop
+  @property
+  def checkpointer(self):
+    if self.saver is None:
+      self.saver = make_checkpointer()
+    return self.saver
+
+  # Mark a chat as active and forget the least recently active ones over the cap
+  def touch(self, thread_id):
+    with self.lock:
+      self.threads[thread_id] = None
+      self.threads.move_to_end(thread_id)
+      evicted = []
+      while len(self.threads) > self.max_threads:
+        evicted.append(self.threads.popitem(last=False)[0])
+
+    for old in evicted:
+      asyncio.ensure_future(self.delete(old))
+
+  async def clear(self, thread_id):
+    with self.lock:
+      self.threads.pop(thread_id, None)
+    await self.delete(thread_id)
+
+  async def delete(self, thread_id):
+    try:
+      await self.checkpointer.adelete_thread(str(thread_id))
+    except Exception as e:
+      logger.warning(f"Error deleting conversation {thread_id}: {str(e)}")
+
+  # Add a turn that was answered without running the agent, e.g. from the verdict cache
+  async def append(self, agent, config, question, answer):
+    await agent.aupdate_state(config, {"messages": [HumanMessage(content=question), AIMessage(content=answer)]}, as_node="agent")
+
+  async def message_ids(self, agent, config):
+    state = await agent.aget_state(config)
+    return {message.id for message in (state.values or {}).get("messages", [])}
+
+  # Drop the messages a failed run left behind, so the next run does not see half a turn
+  async def rollback(self, agent, config, known_ids):
+    state = await agent.aget_state(config)
+    added = [message for message in (state.values or {}).get("messages", []) if message.id not in known_ids]
+    if added:
+      await agent.aupdate_state(config, {"messages": [RemoveMessage(id=message.id) for message in added]}, as_node="agent")
+
+  # Compact the stored history when it is over budget. Returns the history tokens before and after.
+  async def compact(self, agent, config, llm):
+    state = await agent.aget_state(config)
+    messages = (state.values or {}).get("messages", [])
+    before = count_tokens(messages)
+    if before <= self.budget:
+      return before, before
+
+    # Keep the latest whole turns within half the budget, a turn starts at a user message
+    keep_from = len(messages)
+    kept = 0
+    for i in range(len(messages) - 1, -1, -1):
+      kept += count_tokens([messages[i]])
+      if kept > self.budget // 2:
+        break
+      if isinstance(messages[i], HumanMessage):
+        keep_from = i
+    old, recent = messages[:keep_from], messages[keep_from:]
+
+    replacement = []
+    if self.compaction == "summarize":
+      try:
+        summary = await llm.ainvoke([SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=transcript(old))])
+        replacement.append(SystemMessage(content=SUMMARY_PREFIX + str(summary.content)))
+        self.summaries += 1
+      except Exception as e:
+        logger.warning(f"Error summarizing conversation, truncating instead: {str(e)}")
+
+    # Remove everything and add the kept turns back under new ids so they stay after the summary
+    update = [RemoveMessage(id=message.id) for message in messages]
+    update += replacement + [message.model_copy(update={"id": None}) for message in recent]
+    await agent.aupdate_state(config, {"messages": update}, as_node="agent")
+
+    after = count_tokens(replacement + recent)
+    with self.lock:
+      self.compactions += 1
+      self.tokens_removed += before - after
+    return before, after
+
+  def stats(self):
+    with self.lock:
+      return {
+        "threads": len(self.threads),
+        "token_budget": self.budget,
+        "compactions": self.compactions,
+        "summaries": self.summaries,
+        "tokens_removed": self.tokens_removed
+      }
@@ -0,0 +1,91 @@
+import os
+import copy
+import time
+from contextvars import ContextVar
+
+from metrics import Counter, register
+
+# Seconds a request may take end to end, and the share of it the agent may use,
+# the rest is kept for synthesizing the speech of the last sentences
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "60"))
+AGENT_DEADLINE_SHARE = float(os.getenv("AGENT_DEADLINE_SHARE", "0.8"))
+
+deadline_exceeded = register(Counter(
+  "aichatbot_deadline_exceeded_total",
+  "Stages cut short because the request deadline passed",
+  ["stage"]
+))
+partial_answers = register(Counter("aichatbot_partial_answers_total", "Answers returned before the agent finished", ["reason"]))
+
+# Deadline of the request currently being handled, None when it has none
+current_deadline = ContextVar("current_deadline", default=None)
+
+
+# Time budget of one request. The agent, its tool calls and TTS each take their timeouts from it,
+# and whichever stage cuts the answer short marks it partial.
+class Deadline:
+  def __init__(self, seconds, agent_share):
+    now = time.monotonic()
+    self.seconds = seconds
+    self.expires = now + seconds
+    self.agent_expires = now + seconds * agent_share
+    self.partial = None
+
+  def remaining(self):
+    return max(0.0, self.expires - time.monotonic())
+
+  def agent_remaining(self):
+    return max(0.0, self.agent_expires - time.monotonic())
+
+  # Keep the first reason, later stages usually only fail because of it
+  def mark_partial(self, reason):
+    if reason is not None and self.partial is None:
+      self.partial = reason
+
+
+def start_deadline(seconds=None):
+  deadline = Deadline(REQUEST_DEADLINE if seconds is None else seconds, AGENT_DEADLINE_SHARE)
+  current_deadline.set(deadline)
+  return deadline
+
+
+# Seconds left for a stage, capped at limit, or limit alone when the request has no deadline
+# Give the current task a deadline of its own with the same time budget, for runs racing to answer
+# one request, e.g. hedged model runs, so a run that loses cannot mark the answer partial
+def start_child_deadline():
+  deadline = current_deadline.get()
+  if deadline is None:
+    return None
+  child = copy.copy(deadline)
+  child.partial = None
+  current_deadline.set(child)
+  return child
+
+
+def time_left(stage="request", limit=None):
+  deadline = current_deadline.get()
+  if deadline is None:
+    return limit
+  left = deadline.agent_remaining() if stage == "agent" else deadline.remaining()
+  return left if limit is None else min(left, limit)
+
+
+def exceeded(stage):
+  deadline_exceeded.inc(stage=stage)
+
+
+# Record that the answer being built was cut short, e.g. by "deadline" or "max_iterations".
+# count=False records an answer already counted, e.g. one shared with another request.
+def mark_partial(reason, count=True):
+  if reason is None:
+    return
+  if count:
+    partial_answers.inc(reason=reason)
+  deadline = current_deadline.get()
+  if deadline is not None:
+    deadline.mark_partial(reason)
+
+
+def partial_reason():
+  deadline = current_deadline.get()
+  return deadline.partial if deadline is not None else None
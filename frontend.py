@@ -1,4 +1,5 @@
 import os
+import json
 import requests
 import streamlit as st
 
@@ -33,11 +34,79 @@ else:
 # Checkbox for web search
 allow_web_search = st.checkbox("Allow Web Search")
 
+# Checkbox for streaming the response as it is generated
+stream_response = st.checkbox("Stream Response", value=True)
+
 # Text box for user query
 user_query = st.text_area("Enter your query: ", height=150, placeholder="Ask Anything!")
 
 # BACKEND ENDPOINT URL
-API_URL = "http://127.0.0.1:3000/chat"
+BACKEND_URL = "http://127.0.0.1:3000"
+API_URL = f"{BACKEND_URL}/chat"
+STREAM_API_URL = f"{BACKEND_URL}/chat/stream"
+
+
+# Fetch binary audio served by the backend, no base64 involved
+def fetch_audio(audio_url):
+    response = requests.get(f"{BACKEND_URL}{audio_url}")
+    if response.status_code == 200:
+        return response.content
+    return None
+
+
+# Render NDJSON events from the streaming endpoint as they arrive
+def render_stream(response):
+    st.subheader("Agent Response")
+    ttft_placeholder = st.empty()
+    tools_placeholder = st.empty()
+    text_placeholder = st.empty()
+    text = ""
+    tool_calls = []
+    audio_chunks = []
+
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            continue
+
+        event = json.loads(line)
+
+        if event["type"] == "ttft":
+            ttft_placeholder.caption(f"Time to first token: {event['seconds']:.2f}s")
+
+        elif event["type"] == "token":
+            text += event["content"]
+            text_placeholder.markdown(text)
+
+        elif event["type"] == "tool_call":
+            # Tokens before a tool call are the model thinking, not the answer
+            text = ""
+            tool_calls.append(f"Searching: {event['input']}")
+            tools_placeholder.info("\n\n".join(tool_calls))
+
+        elif event["type"] == "fallback":
+            text = ""
+            tools_placeholder.info(f"{event['from']} is unavailable, answering with {event['to']}")
+
+        elif event["type"] == "audio":
+            audio = fetch_audio(event["audio_url"]) if event.get("audio_url") else None
+            if audio:
+                audio_chunks.append(audio)
+                st.audio(audio, format="audio/mp3")
+            else:
+                st.warning("Audio generation failed for part of the response.")
+
+        elif event["type"] == "partial":
+            st.warning("The answer was cut short before the agent finished checking.")
+
+        elif event["type"] == "done":
+            text_placeholder.markdown(event["text"])
+            ttft_placeholder.caption(f"Time to first token: {event['ttft'] or 0:.2f}s, total: {event['seconds']:.2f}s")
+
+        elif event["type"] == "error":
+            st.error(f"Error: {event['error']}")
+
+    if audio_chunks:
+        st.session_state['last_audio_chunks'] = audio_chunks
 
 # Submit button to send request
 if st.button("Ask Agent"):
@@ -53,9 +122,18 @@ if st.button("Ask Agent"):
             "system_prompt": system_prompt,
             "allow_search": allow_web_search,
             "tts_enabled": True,
-            "voice": selected_voice
+            "voice": selected_voice,
+            "audio_mode": "url"
         }
         
+        if stream_response:
+            with requests.post(STREAM_API_URL, json=request, stream=True) as response:
+                if response.status_code == 200 and "ndjson" in response.headers.get("content-type", ""):
+                    render_stream(response)
+                else:
+                    st.error(f"Error: {response.status_code} - {response.text}")
+            st.stop()
+
         response = requests.post(API_URL, json=request)
 
         if response.status_code == 200:
@@ -67,9 +145,11 @@ if st.button("Ask Agent"):
             st.markdown(response_data["text"])
             
             # Play audio if available
-            if "audio" in response_data and response_data["audio"]:
-                st.session_state['last_audio'] = response_data["audio"]
-                st.audio(f"data:audio/mp3;base64,{response_data['audio']}", format="audio/mp3")
+            if response_data.get("audio_url"):
+                audio = fetch_audio(response_data["audio_url"])
+                if audio:
+                    st.session_state['last_audio'] = audio
+                    st.audio(audio, format="audio/mp3")
 
         elif response.status_code == 500:
             # Audio generation failed but we have text
@@ -99,4 +179,9 @@ if st.button("Ask Agent"):
 
 # Button to play last response
 if 'last_audio' in st.session_state and st.session_state['last_audio'] and st.button("Play Last Response Again"):
-    st.audio(f"data:audio/mp3;base64,{st.session_state['last_audio']}", format="audio/mp3")
\ No newline at end of file
+    st.audio(st.session_state['last_audio'], format="audio/mp3")
+
+# Button to play last streamed response, one chunk per sentence
+if 'last_audio_chunks' in st.session_state and st.session_state['last_audio_chunks'] and st.button("Play Last Streamed Response Again"):
+    for chunk in st.session_state['last_audio_chunks']:
+        st.audio(chunk, format="audio/mp3")
\ No newline at end of file
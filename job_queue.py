@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+
+from metrics import Histogram, register
+
+# Where queued jobs are kept, so they survive a restart
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", ".jobs.sqlite3")
+
+# Workers processing jobs at once, attempts before a job is dead-lettered, and retry backoff in seconds
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE = float(os.getenv("JOB_RETRY_BASE", "2"))
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", "300"))
+
+# A running job whose worker has not finished it within this many seconds is assumed lost and run again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+
+logger = logging.getLogger(__name__)
+
+job_seconds = register(Histogram(
+  "aichatbot_job_seconds",
+  "Time from enqueue until a job is delivered or dead-lettered",
+  ["kind", "outcome"]
+))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  run_at REAL NOT NULL,
+  created_at REAL NOT NULL,
+  updated_at REAL NOT NULL,
+  last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, run_at);
+"""
+
+
+# Exponential backoff with full jitter, so retries after an outage do not arrive together
+def backoff(attempts, base=JOB_RETRY_BASE, cap=JOB_RETRY_MAX):
+  return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+# Persistent job queue in SQLite with retries and a dead-letter state.
+# Several server processes can share one queue: a claimed job is leased to its
+# worker until run_at, and taken over by another worker if the lease runs out.
+class JobQueue:
+  def __init__(self, path=JOB_QUEUE_PATH, max_attempts=JOB_MAX_ATTEMPTS, retry_base=JOB_RETRY_BASE, retry_max=JOB_RETRY_MAX, lease=JOB_LEASE_SECONDS):
+    self.path = path
+    self.max_attempts = max_attempts
+    self.retry_base = retry_base
+    self.retry_max = retry_max
+    self.lease = lease
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+
+  def enqueue(self, kind, payload):
+    now = time.time()
+    with self.lock:
+      cursor = self.db.execute(
+        "INSERT INTO jobs (kind, payload, run_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, json.dumps(payload), now, now, now)
+      )
+    return cursor.lastrowid
+
+  # Take the oldest job that is due, or whose lease ran out, and lease it
+  def claim(self):
+    now = time.time()
+    with self.lock:
+      self.db.execute("BEGIN IMMEDIATE")
+      try:
+        row = self.db.execute(
+          "SELECT id, kind, payload, attempts, created_at, status FROM jobs "
+          "WHERE status IN ('queued', 'running') AND run_at <= ? ORDER BY run_at LIMIT 1",
+          (now,)
+        ).fetchone()
+        if row is not None:
+          self.db.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, run_at = ?, updated_at = ? WHERE id = ?",
+            (now + self.lease, now, row[0])
+          )
+        self.db.execute("COMMIT")
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+
+    if row is None:
+      return None
+    if row[5] == "running":
+      logger.warning(f"Job {row[0]} lease expired, running it again")
+    return {
+      "id": row[0],
+      "kind": row[1],
+      "payload": json.loads(row[2]),
+      "attempts": row[3] + 1,
+      "created_at": row[4]
+    }
+
+  def complete(self, job):
+    with self.lock:
+      self.db.execute("UPDATE jobs SET status = 'done', updated_at = ? WHERE id = ?", (time.time(), job["id"]))
+    job_seconds.observe(time.time() - job["created_at"], kind=job["kind"], outcome="done")
+
+  # Retry later, or dead-letter the job once it has used all its attempts
+  def fail(self, job, error):
+    now = time.time()
+    if job["attempts"] >= self.max_attempts:
+      with self.lock:
+        self.db.execute(
+          "UPDATE jobs SET status = 'dead', last_error = ?, updated_at = ? WHERE id = ?",
+          (error, now, job["id"])
+        )
+      job_seconds.observe(now - job["created_at"], kind=job["kind"], outcome="dead")
+      logger.error(f"Job {job['id']} dead-lettered after {job['attempts']} attempts: {error}")
+      return
+
+    delay = backoff(job["attempts"], self.retry_base, self.retry_max)
+    with self.lock:
+      self.db.execute(
+        "UPDATE jobs SET status = 'queued', run_at = ?, last_error = ?, updated_at = ? WHERE id = ?",
+        (now + delay, error, now, job["id"])
+      )
+    logger.warning(f"Job {job['id']} failed (attempt {job['attempts']}), retrying in {delay:.1f}s: {error}")
+
+  # Hand a job back without counting the attempt, e.g. when the server shuts down mid-job
+  def release(self, job):
+    with self.lock:
+      self.db.execute(
+        "UPDATE jobs SET status = 'queued', attempts = attempts - 1, run_at = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+        (time.time(), time.time(), job["id"])
+      )
+
+  # Put dead-lettered jobs back in the queue with fresh attempts
+  def retry_dead(self, kind=None):
+    now = time.time()
+    query = "UPDATE jobs SET status = 'queued', attempts = 0, run_at = ?, updated_at = ? WHERE status = 'dead'"
+    params = [now, now]
+    if kind is not None:
+      query += " AND kind = ?"
+      params.append(kind)
+    with self.lock:
+      return self.db.execute(query, params).rowcount
+
+  # Jobs of a kind waiting to run, including ones waiting for a retry
+  def depth(self, kind):
+    with self.lock:
+      return self.db.execute("SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = 'queued'", (kind,)).fetchone()[0]
+
+  def get(self, job_id):
+    with self.lock:
+      row = self.db.execute(
+        "SELECT id, kind, status, attempts, created_at, updated_at, last_error FROM jobs WHERE id = ?",
+        (job_id,)
+      ).fetchone()
+    if row is None:
+      return None
+    return dict(zip(("id", "kind", "status", "attempts", "created_at", "updated_at", "last_error"), row))
+
+  # Seconds until the next job is due or a lease runs out, None when there is nothing to wait for
+  def next_due(self):
+    with self.lock:
+      row = self.db.execute("SELECT MIN(run_at) FROM jobs WHERE status IN ('queued', 'running')").fetchone()
+    if row[0] is None:
+      return None
+    return max(0.0, row[0] - time.time())
+
+  # Drop delivered jobs older than max_age seconds
+  def prune(self, max_age=24 * 3600):
+    with self.lock:
+      return self.db.execute(
+        "DELETE FROM jobs WHERE status = 'done' AND updated_at < ?", (time.time() - max_age,)
+      ).rowcount
+
+  def stats(self):
+    with self.lock:
+      rows = self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+      oldest = self.db.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    counts = dict(rows)
+    return {
+      "depth": counts.get("queued", 0),
+      "running": counts.get("running", 0),
+      "done": counts.get("done", 0),
+      "dead": counts.get("dead", 0),
+      "oldest_queued_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0
+    }
+
+  def close(self):
+    with self.lock:
+      self.db.close()
+
+
+# Pool of async workers running queued jobs through a handler per job kind
+class JobWorkers:
+  def __init__(self, queue, handlers, workers=JOB_WORKERS, idle_poll=1.0):
+    self.queue = queue
+    self.handlers = handlers
+    self.workers = workers
+    self.idle_poll = idle_poll
+    self.wakeup = asyncio.Event()
+    self.tasks = []
+
+  def start(self):
+    self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+  async def stop(self):
+    for task in self.tasks:
+      task.cancel()
+    await asyncio.gather(*self.tasks, return_exceptions=True)
+    self.tasks = []
+
+  # Only the insert runs in a thread, the event is set on the loop the workers wait on
+  async def enqueue(self, kind, payload):
+    job_id = await asyncio.to_thread(self.queue.enqueue, kind, payload)
+    self.wakeup.set()
+    return job_id
+
+  async def work(self):
+    while True:
+      # Cleared before looking, so a job enqueued meanwhile still wakes this worker
+      self.wakeup.clear()
+      job = await asyncio.to_thread(self.queue.claim)
+
+      if job is None:
+        # Sleep until a new job arrives or a retry comes due
+        due = await asyncio.to_thread(self.queue.next_due)
+        try:
+          await asyncio.wait_for(self.wakeup.wait(), min(due, self.idle_poll) if due is not None else self.idle_poll)
+        except asyncio.TimeoutError:
+          pass
+        continue
+
+      try:
+        await self.handlers[job["kind"]](job["payload"])
+      except asyncio.CancelledError:
+        # Shutting down, let another worker or the next start pick it up
+        self.queue.release(job)
+        raise
+      except Exception as e:
+        await asyncio.to_thread(self.queue.fail, job, f"{type(e).__name__}: {e}")
+      else:
+        await asyncio.to_thread(self.queue.complete, job)
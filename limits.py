@@ -0,0 +1,308 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from metrics import Counter, Histogram, register
+
+# Requests per minute and requests in flight allowed to each upstream API, 0 means no limit.
+# Set them to the quotas of your provider plans, they are per server worker.
+GROQ_RPM = float(os.getenv("GROQ_RPM", "0"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+TAVILY_RPM = float(os.getenv("TAVILY_RPM", "0"))
+TAVILY_MAX_CONCURRENCY = int(os.getenv("TAVILY_MAX_CONCURRENCY", "0"))
+JIGSAWSTACK_RPM = float(os.getenv("JIGSAWSTACK_RPM", "0"))
+JIGSAWSTACK_MAX_CONCURRENCY = int(os.getenv("JIGSAWSTACK_MAX_CONCURRENCY", "0"))
+
+# Clients tracked by the per-client rate limiter before the least recently seen one is forgotten
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+
+logger = logging.getLogger(__name__)
+
+admission_rejections = register(Counter(
+  "aichatbot_admission_rejections_total",
+  "Requests turned away before being handled",
+  ["route", "reason"]
+))
+admission_wait_seconds = register(Histogram("aichatbot_admission_wait_seconds", "Time requests waited for a slot", ["route"]))
+upstream_wait_seconds = register(Histogram("aichatbot_upstream_wait_seconds", "Time calls waited for an upstream limiter", ["upstream"]))
+
+
+# Raised when a request cannot be admitted, with the seconds the client should wait before retrying
+class Overloaded(Exception):
+  def __init__(self, reason, retry_after):
+    super().__init__(f"{reason}, retry after {retry_after:.1f}s")
+    self.reason = reason
+    self.retry_after = retry_after
+
+
+# Bounds the requests handled at once. Up to max_queue more wait for a slot, for at most timeout seconds,
+# and anything past that is rejected at once so a burst cannot pile up behind slow requests.
+class ConcurrencyLimiter:
+  def __init__(self, name, limit, max_queue=None, timeout=None):
+    self.name = name
+    self.limit = limit
+    self.max_queue = max_queue
+    self.timeout = timeout
+    self.active = 0
+    self.waiters = deque()
+    # EWMA of how long a slot is held, to tell rejected clients when to come back
+    self.hold_seconds = 1.0
+    self.admitted = 0
+    self.rejected = 0
+
+  def retry_after(self):
+    return max(1.0, self.hold_seconds * (len(self.waiters) + 1) / max(1, self.limit))
+
+  async def acquire(self):
+    if self.active < self.limit and not self.waiters:
+      self.active += 1
+      self.admitted += 1
+      return time.perf_counter()
+
+    if self.max_queue is not None and len(self.waiters) >= self.max_queue:
+      self.rejected += 1
+      raise Overloaded("queue_full", self.retry_after())
+
+    start = time.perf_counter()
+    waiter = asyncio.get_running_loop().create_future()
+    self.waiters.append(waiter)
+    try:
+      await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+    except asyncio.TimeoutError:
+      if waiter.done() and not waiter.cancelled():
+        # The slot was handed over just as the wait ran out, give it to the next waiter
+        self.release()
+      self.rejected += 1
+      raise Overloaded("wait_timeout", self.retry_after())
+    except BaseException:
+      if waiter.done() and not waiter.cancelled():
+        self.release()
+      raise
+    finally:
+      if waiter in self.waiters:
+        self.waiters.remove(waiter)
+      if not waiter.done():
+        waiter.cancel()
+
+    admission_wait_seconds.observe(time.perf_counter() - start, route=self.name)
+    self.admitted += 1
+    return time.perf_counter()
+
+  # Hand the slot straight to the oldest waiter, so a new arrival cannot jump the queue
+  def release(self, acquired=None):
+    if acquired is not None:
+      self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * (time.perf_counter() - acquired)
+    while self.waiters:
+      waiter = self.waiters.popleft()
+      if not waiter.done():
+        waiter.set_result(None)
+        return
+    self.active -= 1
+
+  def stats(self):
+    return {
+      "limit": self.limit,
+      "max_queue": self.max_queue if self.max_queue is not None else -1,
+      "active": self.active,
+      "waiting": len(self.waiters),
+      "admitted": self.admitted,
+      "rejected": self.rejected,
+      "hold_seconds": round(self.hold_seconds, 3)
+    }
+
+
+class TokenBucket:
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.updated = time.monotonic()
+
+  def refill(self, now):
+    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  # Take a token if there is one, otherwise return the seconds until there will be
+  def take(self, now):
+    self.refill(now)
+    if self.tokens >= 1:
+      self.tokens -= 1
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+  # Take a token even when there is none yet and return the seconds to wait for it,
+  # so callers queue up behind each other instead of all retrying at once
+  def reserve(self, now):
+    self.refill(now)
+    self.tokens -= 1
+    return max(0.0, -self.tokens / self.rate)
+
+
+# Token bucket per client, e.g. per Telegram chat or per IP
+class ClientRateLimiter:
+  def __init__(self, per_minute, burst, max_clients=RATE_LIMIT_MAX_CLIENTS):
+    self.rate = per_minute / 60
+    self.burst = burst
+    self.max_clients = max_clients
+    self.buckets = OrderedDict()
+    self.limited = 0
+    self.lock = threading.Lock()
+
+  # Seconds the client has to wait, or 0 when the request is allowed
+  def check(self, client):
+    if self.rate <= 0:
+      return 0.0
+
+    with self.lock:
+      bucket = self.buckets.get(client)
+      if bucket is None:
+        bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+        if len(self.buckets) > self.max_clients:
+          self.buckets.popitem(last=False)
+      self.buckets.move_to_end(client)
+      wait = bucket.take(time.monotonic())
+      if wait:
+        self.limited += 1
+      return wait
+
+  def stats(self):
+    with self.lock:
+      return {"per_minute": self.rate * 60, "burst": self.burst, "clients": len(self.buckets), "limited": self.limited}
+
+
+# Keeps calls to one upstream API under its rate and concurrency quotas by making them wait.
+# Also a LangChain rate limiter, so chat models wait for it before every model call.
+class UpstreamLimiter(BaseRateLimiter):
+  def __init__(self, name, per_minute=0, concurrency=0):
+    self.name = name
+    self.bucket = TokenBucket(per_minute / 60, max(1.0, per_minute / 60)) if per_minute > 0 else None
+    self.slots = ConcurrencyLimiter(name, concurrency) if concurrency > 0 else None
+    self.calls = 0
+    self.waited = 0
+    self.lock = threading.Lock()
+
+  def reserve(self):
+    with self.lock:
+      self.calls += 1
+      if self.bucket is None:
+        return 0.0
+      wait = self.bucket.reserve(time.monotonic())
+      if wait:
+        self.waited += 1
+    return wait
+
+  def acquire(self, *, blocking=True):
+    wait = self.reserve()
+    if wait:
+      time.sleep(wait)
+    upstream_wait_seconds.observe(wait, upstream=self.name)
+    return True
+
+  async def aacquire(self, *, blocking=True):
+    wait = self.reserve()
+    if wait:
+      await asyncio.sleep(wait)
+    upstream_wait_seconds.observe(wait, upstream=self.name)
+    return True
+
+  # Wait for the rate limit and a concurrency slot, held until the call finishes
+  async def __aenter__(self):
+    await self.aacquire()
+    if self.slots is not None:
+      await self.slots.acquire()
+    return self
+
+  async def __aexit__(self, *exc):
+    if self.slots is not None:
+      self.slots.release()
+
+  def stats(self):
+    return {
+      "per_minute": self.bucket.rate * 60 if self.bucket is not None else 0,
+      "in_flight": self.slots.active if self.slots is not None else 0,
+      "calls": self.calls,
+      "waited": self.waited
+    }
+
+
+upstream_limiters = {
+  "groq": UpstreamLimiter("groq", GROQ_RPM),
+  "openai": UpstreamLimiter("openai", OPENAI_RPM),
+  "tavily": UpstreamLimiter("tavily", TAVILY_RPM, TAVILY_MAX_CONCURRENCY),
+  "jigsawstack": UpstreamLimiter("jigsawstack", JIGSAWSTACK_RPM, JIGSAWSTACK_MAX_CONCURRENCY)
+}
+
+
+def get_upstream_stats():
+  return {name: limiter.stats() for name, limiter in upstream_limiters.items()}
+
+
+# Who a request counts against: ("chat", id) when the route has a Telegram chat, otherwise ("ip", address)
+def client_key(scope):
+  chat_id = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("chat_id")
+  if chat_id:
+    return "chat", chat_id[0]
+  client = scope.get("client")
+  return "ip", client[0] if client else "unknown"
+
+
+# ASGI middleware turning requests away with 429 when their client is over its rate limit,
+# and with 503 when the route's concurrency limiter is full. Slots are held until the response,
+# streamed or not, is fully sent.
+class AdmissionMiddleware:
+  def __init__(self, app, limiters, rate_limiters=None, rate_limited=()):
+    self.app = app
+    self.limiters = limiters
+    # Client kind -> ClientRateLimiter, see client_key
+    self.rate_limiters = rate_limiters or {}
+    self.rate_limited = set(rate_limited)
+
+  async def __call__(self, scope, receive, send):
+    path = scope.get("path", "")
+    if scope["type"] != "http" or scope.get("method") == "GET":
+      return await self.app(scope, receive, send)
+
+    if path in self.rate_limited:
+      kind, client = client_key(scope)
+      rate_limiter = self.rate_limiters.get(kind)
+      wait = rate_limiter.check(client) if rate_limiter is not None else 0.0
+      if wait:
+        admission_rejections.inc(route=path, reason="rate_limit")
+        return await self.reject(send, 429, "rate_limit", wait)
+
+    limiter = self.limiters.get(path)
+    if limiter is None:
+      return await self.app(scope, receive, send)
+
+    try:
+      acquired = await limiter.acquire()
+    except Overloaded as e:
+      admission_rejections.inc(route=path, reason=e.reason)
+      logger.warning(f"Rejected {path}: {e}")
+      return await self.reject(send, 503, e.reason, e.retry_after)
+
+    try:
+      await self.app(scope, receive, send)
+    finally:
+      limiter.release(acquired)
+
+  async def reject(self, send, status_code, reason, retry_after):
+    body = json.dumps({"error": "too many requests" if status_code == 429 else "server overloaded", "reason": reason}).encode()
+    await send({
+      "type": "http.response.start",
+      "status": status_code,
+      "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(math.ceil(retry_after)).encode())
+      ]
+    })
+    await send({"type": "http.response.body", "body": body})
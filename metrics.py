@@ -0,0 +1,171 @@
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger("trace")
+
+# Histogram buckets in seconds, from cache hits up to slow ReAct loops
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Trace of the request currently being handled
+current_trace = ContextVar("current_trace", default=None)
+
+
+# Label values escaped as the exposition format requires
+def escape_label(value):
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+  if not labels:
+    return ""
+  parts = [f'{key}="{escape_label(value)}"' for key, value in labels]
+  return "{" + ",".join(parts) + "}"
+
+
+# Prometheus style histogram with one series per label set
+class Histogram:
+  def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+    self.name = name
+    self.help_text = help_text
+    self.label_names = tuple(label_names)
+    self.buckets = tuple(buckets)
+    self.series = {}
+    self.lock = threading.Lock()
+
+  def observe(self, value, **labels):
+    key = tuple((name, str(labels.get(name, ""))) for name in self.label_names)
+    with self.lock:
+      series = self.series.get(key)
+      if series is None:
+        series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          series["counts"][i] += 1
+      series["sum"] += value
+      series["count"] += 1
+
+  def render(self):
+    lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+    with self.lock:
+      for key, series in sorted(self.series.items()):
+        for bound, count in zip(self.buckets, series["counts"]):
+          lines.append(f"{self.name}_bucket{format_labels(key + (('le', str(bound)),))} {count}")
+        lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series['count']}")
+        lines.append(f"{self.name}_sum{format_labels(key)} {series['sum']}")
+        lines.append(f"{self.name}_count{format_labels(key)} {series['count']}")
+    return lines
+
+
+class Counter:
+  def __init__(self, name, help_text, label_names=()):
+    self.name = name
+    self.help_text = help_text
+    self.label_names = tuple(label_names)
+    self.series = {}
+    self.lock = threading.Lock()
+
+  def inc(self, amount=1, **labels):
+    key = tuple((name, str(labels.get(name, ""))) for name in self.label_names)
+    with self.lock:
+      self.series[key] = self.series.get(key, 0) + amount
+
+  def render(self):
+    lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+    with self.lock:
+      for key, value in sorted(self.series.items()):
+        lines.append(f"{self.name}{format_labels(key)} {value}")
+    return lines
+
+
+stage_seconds = Histogram("aichatbot_stage_seconds", "Time spent in each stage of the agent pipeline", ["stage", "name"])
+request_seconds = Histogram("aichatbot_request_seconds", "End to end HTTP request time", ["route", "status"])
+stage_errors = Counter("aichatbot_stage_errors_total", "Stages that raised an error", ["stage", "name"])
+
+registry = [request_seconds, stage_seconds, stage_errors]
+
+
+def register(metric):
+  registry.append(metric)
+  return metric
+
+
+# Flatten nested numeric stats into gauges, e.g. tts_cache.memory_hits -> aichatbot_tts_cache_memory_hits
+def stats_to_gauges(stats, prefix="aichatbot"):
+  lines = []
+  for key, value in stats.items():
+    # Keys such as model names may hold characters that are not valid in metric names
+    name = re.sub(r"\W", "_", f"{prefix}_{key}")
+    if isinstance(value, dict):
+      lines.extend(stats_to_gauges(value, name))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+      lines.append(f"# TYPE {name} gauge")
+      lines.append(f"{name} {value}")
+  return lines
+
+
+def render_metrics(stats=None):
+  lines = []
+  for metric in registry:
+    lines.extend(metric.render())
+  if stats:
+    lines.extend(stats_to_gauges(stats))
+  return "\n".join(lines) + "\n"
+
+
+def new_request_id():
+  return uuid.uuid4().hex
+
+
+def start_trace(request_id, route):
+  trace = {"request_id": request_id, "route": route, "start": time.perf_counter(), "spans": []}
+  current_trace.set(trace)
+  return trace
+
+
+# Record a finished stage in the histogram and in the trace of the current request
+def record_span(stage, seconds, name="", error=None, trace=None):
+  stage_seconds.observe(seconds, stage=stage, name=name)
+  if error is not None:
+    stage_errors.inc(stage=stage, name=name)
+
+  trace = trace if trace is not None else current_trace.get()
+  if trace is not None:
+    span = {
+      "stage": stage,
+      "offset": round(time.perf_counter() - trace["start"] - seconds, 4),
+      "seconds": round(seconds, 4)
+    }
+    if name:
+      span["name"] = name
+    if error is not None:
+      span["error"] = error
+    trace["spans"].append(span)
+
+
+@contextmanager
+def span(stage, name=""):
+  start = time.perf_counter()
+  try:
+    yield
+  except BaseException as e:
+    record_span(stage, time.perf_counter() - start, name, error=type(e).__name__)
+    raise
+  record_span(stage, time.perf_counter() - start, name)
+
+
+def finish_trace(trace, status_code):
+  seconds = time.perf_counter() - trace["start"]
+  request_seconds.observe(seconds, route=trace["route"], status=status_code)
+  logger.info(json.dumps({
+    "request_id": trace["request_id"],
+    "route": trace["route"],
+    "status": status_code,
+    "seconds": round(seconds, 4),
+    "spans": trace["spans"]
+  }))
@@ -0,0 +1,424 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextvars import ContextVar
+
+from deadline import time_left, exceeded, mark_partial, partial_reason, start_child_deadline
+from metrics import Counter, Histogram, register, current_trace
+
+# Model -> provider of every model the router may use
+MODEL_PROVIDERS = {
+  "llama-3.3-70b-versatile": "Groq",
+  "gpt-4o": "OpenAI",
+  "deepseek-r1-distill-qwen-32b": "Groq",
+  "gemma2-9b-it": "Groq"
+}
+
+# Models picked from when a route does not name one, and the small models preferred for short claims
+ROUTER_MODELS = os.getenv("ROUTER_MODELS", "llama-3.3-70b-versatile,gemma2-9b-it,gpt-4o").split(",")
+ROUTER_SHORT_MODELS = os.getenv("ROUTER_SHORT_MODELS", "gemma2-9b-it").split(",")
+ROUTER_SHORT_CLAIM_CHARS = int(os.getenv("ROUTER_SHORT_CLAIM_CHARS", "120"))
+
+# Models tried per request, seconds an attempt may take when the request has no deadline (see attempt_timeout),
+# and how long a rate limited model is skipped
+ROUTER_MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "3"))
+ROUTER_TIMEOUT = float(os.getenv("ROUTER_TIMEOUT", "30"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+# Seconds past the request deadline an attempt gets to return what it has, its stages stop at the deadline themselves
+ROUTER_DEADLINE_GRACE = float(os.getenv("ROUTER_DEADLINE_GRACE", "2"))
+
+# Weight of the latest sample in the EWMAs, and how fast a model's error rate is forgiven, in seconds
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+ROUTER_ERROR_DECAY = float(os.getenv("ROUTER_ERROR_DECAY", "60"))
+
+# Requests in flight on one model before its expected latency doubles, and the latency assumed for an unused model
+ROUTER_MODEL_CONCURRENCY = float(os.getenv("ROUTER_MODEL_CONCURRENCY", "8"))
+ROUTER_PRIOR_LATENCY = float(os.getenv("ROUTER_PRIOR_LATENCY", "2.0"))
+# Seconds added to the score at a 100% error rate
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", "20"))
+
+# Hedged runs start a second model when the first has not answered within the hedge delay, and keep the first good answer.
+# The delay is a percentile of the first model's recent latencies such as "p95", or fixed seconds, "0" starts both at once.
+ROUTER_HEDGE_DELAY = os.getenv("ROUTER_HEDGE_DELAY", "p95")
+# Successful latencies kept per model for the percentile, and how many are needed before it is trusted over ROUTER_PRIOR_LATENCY
+ROUTER_LATENCY_WINDOW = int(os.getenv("ROUTER_LATENCY_WINDOW", "200"))
+ROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("ROUTER_HEDGE_MIN_SAMPLES", "20"))
+# Extra runs allowed per hedged request, so hedging cannot double the load when every model is slow
+ROUTER_HEDGE_BUDGET = float(os.getenv("ROUTER_HEDGE_BUDGET", "0.1"))
+# Unspent budget saved for a burst of slow answers, in hedges
+HEDGE_BURST = 10.0
+
+logger = logging.getLogger(__name__)
+
+model_seconds = register(Histogram("aichatbot_model_seconds", "Time of each model attempt", ["model", "outcome"]))
+model_fallbacks = register(Counter("aichatbot_model_fallbacks_total", "Requests moved to another model", ["model", "reason"]))
+model_hedges = register(Counter("aichatbot_model_hedges_total", "Hedged requests by which run answered", ["outcome"]))
+
+# Model that gave the answer of the last run or run_hedged in this task, which a fallback may have changed
+answered_by = ContextVar("answered_by", default=None)
+
+# Client errors that another model would reject the same way
+NON_RETRYABLE_STATUS = (400, 413, 422)
+
+
+# Why an attempt failed, or None when the error should not be retried on another model
+def failure_reason(error):
+  if isinstance(error, (asyncio.TimeoutError, TimeoutError)) or "Timeout" in type(error).__name__:
+    return "timeout"
+
+  status_code = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+  if status_code == 429 or "RateLimit" in type(error).__name__:
+    return "rate_limit"
+  if status_code in NON_RETRYABLE_STATUS or isinstance(error, (ValueError, TypeError)):
+    return None
+  return "error"
+
+
+# A timeout because the request's own deadline passed, not because the model was slow
+def past_deadline(error):
+  return isinstance(error, (asyncio.TimeoutError, TimeoutError)) and time_left() == 0
+
+
+# What an attempt's latency is compared with: runs of the same function for the same route,
+# e.g. /tele runs with TTS apart from /chat runs without
+def run_kind(fn):
+  trace = current_trace.get()
+  return trace["route"] if trace else "", getattr(fn, "__name__", "")
+
+
+def retry_after(error):
+  headers = getattr(getattr(error, "response", None), "headers", None) or {}
+  try:
+    return float(headers.get("retry-after"))
+  except (TypeError, ValueError):
+    return None
+
+
+# Live latency, error rate and load of one model
+class ModelHealth:
+  def __init__(self, model):
+    self.model = model
+    self.latency = None
+    self.error_rate = 0.0
+    self.error_updated = time.time()
+    self.in_flight = 0
+    self.cooldown_until = 0.0
+    self.requests = 0
+    self.errors = 0
+    self.fallbacks = 0
+    # Run kind (see run_kind) -> recent successful latencies
+    self.samples = {}
+
+  def current_error_rate(self, now):
+    return self.error_rate * math.exp(-(now - self.error_updated) / ROUTER_ERROR_DECAY)
+
+  # Expected seconds for a new request, lower is better
+  def score(self, now):
+    latency = self.latency if self.latency is not None else ROUTER_PRIOR_LATENCY
+    return latency * (1 + self.in_flight / ROUTER_MODEL_CONCURRENCY) + ROUTER_ERROR_PENALTY * self.current_error_rate(now)
+
+  def record(self, seconds, failed, now, kind=None):
+    self.requests += 1
+    self.error_rate = self.current_error_rate(now) * (1 - ROUTER_EWMA_ALPHA) + ROUTER_EWMA_ALPHA * failed
+    self.error_updated = now
+    if failed:
+      self.errors += 1
+    else:
+      self.latency = seconds if self.latency is None else self.latency * (1 - ROUTER_EWMA_ALPHA) + ROUTER_EWMA_ALPHA * seconds
+      if kind is not None:
+        self.samples.setdefault(kind, deque(maxlen=ROUTER_LATENCY_WINDOW)).append(seconds)
+
+  def percentile(self, kind, q):
+    samples = self.samples.get(kind, ())
+    if len(samples) < ROUTER_HEDGE_MIN_SAMPLES:
+      return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+# Picks a model for each request and fails over to the next one on rate limits, timeouts and provider errors
+class ModelRouter:
+  def __init__(self, models=ROUTER_MODELS, short_models=ROUTER_SHORT_MODELS, short_claim_chars=ROUTER_SHORT_CLAIM_CHARS,
+               max_attempts=ROUTER_MAX_ATTEMPTS, timeout=ROUTER_TIMEOUT, cooldown=ROUTER_COOLDOWN):
+    self.models = list(models)
+    self.short_models = [model for model in short_models if model in self.models]
+    self.short_claim_chars = short_claim_chars
+    self.max_attempts = max_attempts
+    self.timeout = timeout
+    self.cooldown = cooldown
+    self.health = {model: ModelHealth(model) for model in MODEL_PROVIDERS}
+    self.lock = threading.Lock()
+    self.hedge_delay_setting = ROUTER_HEDGE_DELAY
+    self.hedge_budget = ROUTER_HEDGE_BUDGET
+    self.hedge_tokens = 1.0
+    self.hedge_counts = {"requests": 0, "hedges": 0, "hedge_wins": 0, "primary_wins": 0, "skipped": 0, "extra_seconds": 0.0}
+
+  # Models to try in order: the one asked for, then the preferred size for the claim, then the rest,
+  # each group by expected latency, with rate limited models last
+  def candidates(self, claim, preferred=None):
+    now = time.time()
+    short = len(claim) <= self.short_claim_chars
+    with self.lock:
+      def rank(model):
+        health = self.health[model]
+        in_size = (model in self.short_models) == short or not self.short_models
+        return (model != preferred, health.cooldown_until > now, not in_size, health.score(now))
+
+      pool = self.models + ([preferred] if preferred is not None and preferred not in self.models else [])
+      return sorted(pool, key=rank)[:self.max_attempts]
+
+  def start(self, model):
+    with self.lock:
+      self.health[model].in_flight += 1
+
+  def finish(self, model, seconds, error=None, kind=None):
+    now = time.time()
+    reason = failure_reason(error) if error is not None else None
+    with self.lock:
+      health = self.health[model]
+      health.in_flight -= 1
+      health.record(seconds, error is not None, now, kind)
+      if reason in ("rate_limit", "timeout"):
+        health.cooldown_until = now + (retry_after(error) or self.cooldown)
+    model_seconds.observe(seconds, model=model, outcome=reason or ("ok" if error is None else "error"))
+    return reason
+
+  # A cancelled run says nothing about the model's latency, e.g. the slower run of a hedged request or a client
+  # that went away. The seconds of hedged runs are counted as the extra load hedging costs.
+  def abandon(self, model, seconds, hedged=False):
+    with self.lock:
+      self.health[model].in_flight -= 1
+      if hedged:
+        self.hedge_counts["extra_seconds"] += seconds
+    model_seconds.observe(seconds, model=model, outcome="cancelled")
+
+  # Running out of the request's deadline says nothing about the model, so it is neither cooled down nor failed over
+  def out_of_time(self, model, seconds):
+    with self.lock:
+      self.health[model].in_flight -= 1
+    exceeded("agent")
+    model_seconds.observe(seconds, model=model, outcome="deadline")
+
+  # Seconds an attempt may take. Under a request deadline the agent stops itself at its share and answers with
+  # what it has, and the rest is kept for the speech of the last sentences, so an attempt may take all that is
+  # left of the request. ROUTER_TIMEOUT bounds attempts without a deadline, and limit caps it when given.
+  def attempt_timeout(self, limit=None):
+    left = time_left()
+    if left is None:
+      return self.timeout
+    left += ROUTER_DEADLINE_GRACE
+    return left if limit is None else min(left, limit)
+
+  def fallback(self, model, reason, error, next_model):
+    with self.lock:
+      self.health[model].fallbacks += 1
+    model_fallbacks.inc(model=model, reason=reason)
+    logger.warning(f"Model {model} failed ({reason}: {type(error).__name__}), falling back to {next_model}")
+
+  # Run fn(llm_id=..., provider=..., **kwargs) on the best model, moving on to the next model when it fails
+  async def run(self, claim, fn, preferred=None, **kwargs):
+    candidates = self.candidates(claim, preferred)
+    kind = run_kind(fn)
+    for attempt, model in enumerate(candidates):
+      self.start(model)
+      start = time.perf_counter()
+      try:
+        result = await asyncio.wait_for(fn(llm_id=model, provider=MODEL_PROVIDERS[model], **kwargs), self.attempt_timeout())
+      except Exception as e:
+        if past_deadline(e):
+          self.out_of_time(model, time.perf_counter() - start)
+          raise
+        reason = self.finish(model, time.perf_counter() - start, e)
+        if reason is None or attempt == len(candidates) - 1:
+          raise
+        self.fallback(model, reason, e, candidates[attempt + 1])
+        continue
+      except asyncio.CancelledError:
+        self.abandon(model, time.perf_counter() - start)
+        raise
+
+      self.finish(model, time.perf_counter() - start, kind=kind)
+      answered_by.set(model)
+      return result
+
+  # Seconds to wait for model before starting another one alongside it
+  def hedge_delay(self, model, kind):
+    setting = self.hedge_delay_setting
+    if not setting.startswith("p"):
+      return float(setting)
+    with self.lock:
+      delay = self.health[model].percentile(kind, float(setting[1:]) / 100)
+    return delay if delay is not None else ROUTER_PRIOR_LATENCY
+
+  # Every hedged request earns hedge_budget of a hedge, saved up to a burst of HEDGE_BURST
+  def earn_hedge(self):
+    with self.lock:
+      self.hedge_counts["requests"] += 1
+      self.hedge_tokens = min(HEDGE_BURST, self.hedge_tokens + self.hedge_budget)
+
+  # Each hedge spends one
+  def take_hedge(self):
+    with self.lock:
+      if self.hedge_tokens < 1:
+        self.hedge_counts["skipped"] += 1
+        model_hedges.inc(outcome="skipped")
+        return False
+      self.hedge_tokens -= 1
+      self.hedge_counts["hedges"] += 1
+      return True
+
+  # One run of a hedged request, returning its result with the reason it was cut short, if it was.
+  # Runs in a task of its own, so its deadline is its own.
+  async def attempt(self, model, fn, kind, **kwargs):
+    start_child_deadline()
+    self.start(model)
+    start = time.perf_counter()
+    try:
+      result = await asyncio.wait_for(fn(llm_id=model, provider=MODEL_PROVIDERS[model], **kwargs), self.attempt_timeout())
+    except asyncio.CancelledError:
+      self.abandon(model, time.perf_counter() - start, hedged=True)
+      raise
+    except Exception as e:
+      if past_deadline(e):
+        self.out_of_time(model, time.perf_counter() - start)
+      else:
+        self.finish(model, time.perf_counter() - start, e)
+      raise
+    self.finish(model, time.perf_counter() - start, kind=kind)
+    return result, partial_reason()
+
+  # Same as run, but a model slower than its hedge delay gets a second model started alongside it.
+  # The first good answer wins and the other run is cancelled. The second model is from another provider
+  # when there is one, as a provider's models tend to slow down together.
+  async def run_hedged(self, claim, fn, preferred=None, **kwargs):
+    candidates = self.candidates(claim, preferred)
+    primary = candidates[0]
+    provider = MODEL_PROVIDERS[primary]
+    candidates = [primary] + sorted(candidates[1:], key=lambda model: MODEL_PROVIDERS[model] == provider)
+
+    self.earn_hedge()
+    kind = run_kind(fn)
+    running = {}
+    launched = 0
+    # Whether the wait for a hedge is over, and whether a hedge was started
+    hedged = False
+    hedge = False
+    error = None
+
+    def launch():
+      nonlocal launched
+      model = candidates[launched]
+      launched += 1
+      running[asyncio.ensure_future(self.attempt(model, fn, kind, **kwargs))] = model
+      return self.hedge_delay(model, kind)
+
+    delay = launch()
+    try:
+      while running:
+        can_hedge = not hedged and launched < len(candidates)
+        done, _ = await asyncio.wait(running, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+
+        if not done:
+          # Slower than usual, start the next model if the budget allows, only once per request
+          hedged = True
+          if self.take_hedge():
+            hedge = True
+            launch()
+          continue
+
+        for task in done:
+          model = running.pop(task)
+          try:
+            result, partial = task.result()
+          except Exception as e:
+            reason = failure_reason(e)
+            if reason is None or past_deadline(e):
+              raise
+            error = e
+            # Move on to the next model when no other run is left
+            if not running and launched < len(candidates):
+              self.fallback(model, reason, e, candidates[launched])
+              delay = launch()
+            continue
+
+          if hedge:
+            won = model != primary
+            with self.lock:
+              self.hedge_counts["hedge_wins" if won else "primary_wins"] += 1
+            model_hedges.inc(outcome="hedge_won" if won else "primary_won")
+          # Only the run that answered says whether the answer was cut short
+          mark_partial(partial, count=False)
+          answered_by.set(model)
+          return result
+
+      raise error
+    finally:
+      for task in running:
+        task.cancel()
+      if running:
+        await asyncio.gather(*running, return_exceptions=True)
+
+  # Stream events from fn(llm_id=..., provider=..., **kwargs), failing over only until the first token is sent
+  async def astream(self, claim, fn, preferred=None, **kwargs):
+    candidates = self.candidates(claim, preferred)
+    kind = run_kind(fn)
+    for attempt, model in enumerate(candidates):
+      self.start(model)
+      start = time.perf_counter()
+      stream = fn(llm_id=model, provider=MODEL_PROVIDERS[model], **kwargs)
+      answered = False
+      try:
+        while True:
+          # Only the wait for the first event is bounded, a long answer may stream for longer
+          next_event = stream.__anext__()
+          event = await (next_event if answered else asyncio.wait_for(next_event, self.attempt_timeout(self.timeout)))
+          answered = answered or event.get("type") == "token"
+          yield event
+      except StopAsyncIteration:
+        self.finish(model, time.perf_counter() - start, kind=kind)
+        return
+      except Exception as e:
+        if past_deadline(e):
+          self.out_of_time(model, time.perf_counter() - start)
+          raise
+        reason = self.finish(model, time.perf_counter() - start, e)
+        if reason is None or answered or attempt == len(candidates) - 1:
+          raise
+        self.fallback(model, reason, e, candidates[attempt + 1])
+        yield {"type": "fallback", "from": model, "to": candidates[attempt + 1], "reason": reason}
+      except (asyncio.CancelledError, GeneratorExit):
+        # Closed by a client that went away, or cancelled along with its request
+        self.abandon(model, time.perf_counter() - start)
+        raise
+      finally:
+        await stream.aclose()
+
+  def stats(self):
+    now = time.time()
+    with self.lock:
+      return {
+        model: {
+          "latency_ewma": health.latency or 0.0,
+          "error_rate": round(health.current_error_rate(now), 4),
+          "in_flight": health.in_flight,
+          "cooling_down": health.cooldown_until > now,
+          "requests": health.requests,
+          "errors": health.errors,
+          "fallbacks": health.fallbacks
+        }
+        for model, health in self.health.items()
+        if health.requests or model in self.models
+      }
+
+  # How often hedging started a second model, how often that one answered first, and the
+  # upstream seconds spent on runs that were cancelled
+  def hedge_stats(self):
+    with self.lock:
+      counts = dict(self.hedge_counts)
+    counts["extra_load"] = counts["hedges"] / counts["requests"] if counts["requests"] else 0.0
+    counts["hedge_win_rate"] = counts["hedge_wins"] / counts["hedges"] if counts["hedges"] else 0.0
+    return counts
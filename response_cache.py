@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from tts_cache import normalize_text
+
+# SQLite file of cached /chat answers, the cache is off when unset
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+# Seconds an answer is reused. Answers that searched the web go stale with the news, so they are not cached by default.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 60 * 60)))
+RESPONSE_CACHE_SEARCH_TTL = float(os.getenv("RESPONSE_CACHE_SEARCH_TTL", "0"))
+# Per-model TTLs in seconds overriding RESPONSE_CACHE_TTL, e.g. "gpt-4o=3600,gemma2-9b-it=86400". 0 never caches that model.
+RESPONSE_CACHE_MODEL_TTLS = {
+  model.strip(): float(ttl)
+  for model, ttl in (item.split("=") for item in os.getenv("RESPONSE_CACHE_MODEL_TTLS", "").split(",") if item.strip())
+}
+# Answer bytes kept before the least recently used are evicted
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# What a request may do with the cache: "default" reads and writes it, "bypass" neither,
+# "refresh" recomputes and overwrites the entry, "only-if-cached" answers from it or not at all
+CACHE_CONTROLS = ("default", "bypass", "refresh", "only-if-cached")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+  key TEXT PRIMARY KEY,
+  model TEXT NOT NULL,
+  text TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  seconds REAL NOT NULL,
+  tokens INTEGER NOT NULL,
+  expires REAL NOT NULL,
+  accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires);
+"""
+
+
+# Rough token count, about 4 characters per token plus a few tokens of overhead per message
+def estimate_tokens(*texts):
+  return sum(4 + len(text) // 4 for text in texts)
+
+
+def response_key(model, system_prompt, messages, allow_search):
+  request = [model, normalize_text(system_prompt), [normalize_text(message) for message in messages], bool(allow_search)]
+  return hashlib.sha256(json.dumps(request).encode("utf-8")).hexdigest()
+
+
+# Cache of /chat answers in SQLite, shared by every server worker and kept across restarts.
+# Entries remember how long the answer took and roughly how many tokens it cost, to report what hits saved.
+class ResponseCache:
+  def __init__(self, path, ttl=RESPONSE_CACHE_TTL, search_ttl=RESPONSE_CACHE_SEARCH_TTL, model_ttls=RESPONSE_CACHE_MODEL_TTLS, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+    self.path = path
+    self.ttl = ttl
+    self.search_ttl = search_ttl
+    self.model_ttls = model_ttls
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.bypassed = 0
+    self.refreshed = 0
+    self.stores = 0
+    self.evictions = 0
+    self.seconds_saved = 0.0
+    self.tokens_saved = 0
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+
+  # Seconds to keep an answer from model, 0 when it is not cached
+  def ttl_for(self, model, allow_search):
+    if allow_search:
+      return min(self.search_ttl, self.model_ttls.get(model, self.search_ttl))
+    return self.model_ttls.get(model, self.ttl)
+
+  # The cached answer for the request, or None when cache_control says to compute it
+  def get(self, key, cache_control="default"):
+    if cache_control in ("bypass", "refresh"):
+      with self.lock:
+        if cache_control == "bypass":
+          self.bypassed += 1
+        else:
+          self.refreshed += 1
+      return None
+
+    now = time.time()
+    with self.lock:
+      row = self.db.execute(
+        "SELECT model, text, seconds, tokens, expires FROM responses WHERE key = ? AND expires > ?",
+        (key, now)
+      ).fetchone()
+      if row is None:
+        self.misses += 1
+        return None
+
+      self.db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+      model, text, seconds, tokens, expires = row
+      self.hits += 1
+      self.seconds_saved += seconds
+      self.tokens_saved += tokens
+      return {"model": model, "text": text, "seconds": seconds, "tokens": tokens, "expires": expires}
+
+  def put(self, key, model, allow_search, prompt, text, seconds, cache_control="default"):
+    ttl = self.ttl_for(model, allow_search)
+    if cache_control not in ("default", "refresh") or ttl <= 0:
+      return False
+
+    size = len(text.encode("utf-8"))
+    if size > self.max_bytes:
+      return False
+    now = time.time()
+
+    with self.lock:
+      self.db.execute("BEGIN IMMEDIATE")
+      try:
+        self.db.execute(
+          "INSERT OR REPLACE INTO responses (key, model, text, size, seconds, tokens, expires, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          (key, model, text, size, seconds, estimate_tokens(*prompt, text), now + ttl, now)
+        )
+        self.evict(now)
+        self.db.execute("COMMIT")
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+      self.stores += 1
+    return True
+
+  # Caller must hold the lock, inside a transaction
+  def evict(self, now):
+    self.evictions += self.db.execute("DELETE FROM responses WHERE expires <= ?", (now,)).rowcount
+    used = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if used <= self.max_bytes:
+      return
+    for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+      if used <= self.max_bytes:
+        break
+      self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+      self.evictions += 1
+      used -= size
+
+  def stats(self):
+    with self.lock:
+      entries, used = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+      lookups = self.hits + self.misses
+      return {
+        "entries": entries,
+        "bytes": used,
+        "hits": self.hits,
+        "misses": self.misses,
+        "bypassed": self.bypassed,
+        "refreshed": self.refreshed,
+        "stores": self.stores,
+        "evictions": self.evictions,
+        "hit_ratio": self.hits / lookups if lookups else 0.0,
+        "seconds_saved": self.seconds_saved,
+        "tokens_saved": self.tokens_saved
+      }
@@ -0,0 +1,230 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Optional
+
+import httpx
+from langchain_core.tools import BaseTool
+
+from singleflight import SingleFlight
+from limits import upstream_limiters
+from deadline import time_left, exceeded
+
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "5000"))
+# Max searches in flight at once for one request, 1 runs the searches an agent asks for in one step one by one
+SEARCH_MAX_PARALLEL = int(os.getenv("SEARCH_MAX_PARALLEL", "4"))
+# Seconds one search may take, less when the request deadline is closer
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", "15"))
+
+logger = logging.getLogger(__name__)
+
+# Search stats and fan-out limit of the request currently being handled
+request_search_stats = ContextVar("request_search_stats", default=None)
+request_search_limit = ContextVar("request_search_limit", default=None)
+
+
+def normalize_query(query):
+  return " ".join(query.lower().split())
+
+
+def start_request_search_stats():
+  stats = {"searches": 0, "cache_hits": 0, "seconds": 0.0}
+  request_search_stats.set(stats)
+  request_search_limit.set(asyncio.Semaphore(max(1, SEARCH_MAX_PARALLEL)))
+  return stats
+
+
+def record_search(hit, seconds):
+  search_stats.record(hit, seconds)
+
+  stats = request_search_stats.get()
+  if stats is not None:
+    stats["searches"] += 1
+    stats["cache_hits"] += int(hit)
+    stats["seconds"] += seconds
+
+
+# The model is told the search failed and answers without it, so this is the only trace of it
+def record_search_error(query, error):
+  logger.warning(f"Search failed for {query!r}: {error!r}")
+  search_stats.record_error()
+
+
+# TTL cache of search results keyed on the normalized query
+class SearchCache:
+  def __init__(self, ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE):
+    self.ttl = ttl
+    self.max_size = max_size
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, query):
+    key = normalize_query(query)
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+      if entry[0] <= time.time():
+        del self.entries[key]
+        return None
+      self.entries.move_to_end(key)
+      return entry[1]
+
+  def put(self, query, result):
+    key = normalize_query(query)
+    with self.lock:
+      self.entries[key] = (time.time() + self.ttl, result)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+
+class SearchStats:
+  def __init__(self):
+    self.searches = 0
+    self.cache_hits = 0
+    self.errors = 0
+    self.upstream_seconds = 0.0
+    self.lock = threading.Lock()
+
+  def record(self, hit, seconds):
+    with self.lock:
+      self.searches += 1
+      if hit:
+        self.cache_hits += 1
+      else:
+        self.upstream_seconds += seconds
+
+  def record_error(self):
+    with self.lock:
+      self.errors += 1
+
+  def stats(self):
+    with self.lock:
+      upstream = self.searches - self.cache_hits
+      return {
+        "searches": self.searches,
+        "cache_hits": self.cache_hits,
+        "errors": self.errors,
+        "hit_ratio": self.cache_hits / self.searches if self.searches else 0.0,
+        "avg_upstream_seconds": self.upstream_seconds / upstream if upstream else 0.0
+      }
+
+
+search_cache = SearchCache()
+search_stats = SearchStats()
+search_flights = SingleFlight()
+
+
+def get_search_stats():
+  return {
+    **search_stats.stats(),
+    "entries": len(search_cache.entries)
+  }
+
+
+# Pooled HTTP clients shared by every search
+sync_client = httpx.Client(timeout=httpx.Timeout(30.0))
+async_client = None
+
+
+def get_async_client():
+  global async_client
+  if async_client is None:
+    async_client = httpx.AsyncClient(
+      timeout=httpx.Timeout(30.0),
+      limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+  return async_client
+
+
+# Wraps the Tavily tool with a result cache and pooled connections
+class CachedSearchTool(BaseTool):
+  tool: Any
+  response_format: str = "content_and_artifact"
+
+  def __init__(self, tool, **kwargs):
+    super().__init__(
+      tool=tool,
+      name=tool.name,
+      description=tool.description,
+      args_schema=tool.args_schema,
+      **kwargs
+    )
+
+  def params(self, query):
+    return {
+      "api_key": self.tool.api_wrapper.tavily_api_key.get_secret_value(),
+      "query": query,
+      "max_results": self.tool.max_results,
+      "search_depth": self.tool.search_depth,
+      "include_domains": self.tool.include_domains,
+      "exclude_domains": self.tool.exclude_domains,
+      "include_answer": self.tool.include_answer,
+      "include_raw_content": self.tool.include_raw_content,
+      "include_images": self.tool.include_images
+    }
+
+  def _run(self, query: str, run_manager: Optional[Any] = None):
+    start = time.perf_counter()
+    cached = search_cache.get(query)
+    if cached is not None:
+      record_search(True, time.perf_counter() - start)
+      return cached
+
+    try:
+      upstream_limiters["tavily"].acquire()
+      response = sync_client.post(TAVILY_SEARCH_URL, json=self.params(query), timeout=TOOL_CALL_TIMEOUT)
+      response.raise_for_status()
+      raw_results = response.json()
+    except Exception as e:
+      record_search_error(query, e)
+      return repr(e), {}
+
+    result = (self.tool.api_wrapper.clean_results(raw_results["results"]), raw_results)
+    search_cache.put(query, result)
+    record_search(False, time.perf_counter() - start)
+    return result
+
+  async def _arun(self, query: str, run_manager: Optional[Any] = None):
+    start = time.perf_counter()
+    cached = search_cache.get(query)
+    if cached is not None:
+      record_search(True, time.perf_counter() - start)
+      return cached
+
+    try:
+      # The same query from concurrent requests only hits Tavily once.
+      # A search that runs out of time is reported to the model as an error, so it answers without it.
+      result = await asyncio.wait_for(search_flights.do(normalize_query(query), self.fetch_async, query), time_left(limit=TOOL_CALL_TIMEOUT))
+    except asyncio.TimeoutError as e:
+      exceeded("tool")
+      record_search_error(query, e)
+      return repr(e), {}
+    except Exception as e:
+      record_search_error(query, e)
+      return repr(e), {}
+
+    record_search(False, time.perf_counter() - start)
+    return result
+
+  async def fetch_async(self, query):
+    client = get_async_client()
+
+    # Bound how many searches this request runs at once when the agent fans out, and stay under the Tavily quota
+    async with request_search_limit.get() or contextlib.nullcontext(), upstream_limiters["tavily"]:
+      response = await client.post(TAVILY_SEARCH_URL, json=self.params(query))
+      response.raise_for_status()
+      raw_results = response.json()
+
+    result = (self.tool.api_wrapper.clean_results(raw_results["results"]), raw_results)
+    search_cache.put(query, result)
+    return result
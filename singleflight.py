@@ -0,0 +1,34 @@
+import asyncio
+
+
+# Share one in-flight computation between concurrent callers with the same key
+class SingleFlight:
+  def __init__(self):
+    self.in_flight = {}
+    self.leaders = 0
+    self.coalesced = 0
+
+  async def do(self, key, fn, *args, **kwargs):
+    task = self.in_flight.get(key)
+
+    if task is None:
+      self.leaders += 1
+      task = asyncio.ensure_future(fn(*args, **kwargs))
+      self.in_flight[key] = task
+      task.add_done_callback(lambda done: self.forget(key, done))
+    else:
+      self.coalesced += 1
+
+    # Shield so one caller disconnecting does not cancel the work for the others
+    return await asyncio.shield(task)
+
+  def forget(self, key, task):
+    if self.in_flight.get(key) is task:
+      del self.in_flight[key]
+
+  def stats(self):
+    return {
+      "in_flight": len(self.in_flight),
+      "leaders": self.leaders,
+      "coalesced": self.coalesced
+    }
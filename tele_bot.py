@@ -1,13 +1,57 @@
 from telegram import Update
 from telegram.constants import ChatAction
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-import aiohttp
-import base64
+import functools
+import httpx
+import logging
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:3000")
+
+# Updates handled at once, each waits on the backend for most of its time
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "32"))
+# Bot API server to use instead of api.telegram.org, e.g. a local telegram-bot-api server
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Seconds to wait for a backend answer, longer than the backend's own request deadline
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "90"))
+
+# Public base URL Telegram posts updates to in webhook mode, e.g. https://bot.example.com.
+# Webhook mode runs inside the backend (see backend.py), and the bot is not polled.
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_PATH = "/telegram/webhook"
+# Sent by Telegram with every webhook update, so nobody else can post updates to the bot
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+
+logger = logging.getLogger(__name__)
+
+# One client for the bot's lifetime, so connections to the backend are kept alive and reused
+backend_client = None
+
+
+# Client for the backend at BACKEND_URL, or for the backend app itself when the bot runs inside it,
+# so updates go through the same routes, admission control and rate limits without a localhost hop
+def open_backend_client(app=None):
+  timeout = httpx.Timeout(BACKEND_TIMEOUT)
+  if app is not None:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://backend", timeout=timeout)
+  limits = httpx.Limits(max_connections=TELEGRAM_CONCURRENT_UPDATES, max_keepalive_connections=TELEGRAM_CONCURRENT_UPDATES)
+  return httpx.AsyncClient(base_url=BACKEND_URL, limits=limits, timeout=timeout)
+
+
+# Log how long each update took to handle
+def timed(handler):
+  @functools.wraps(handler)
+  async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    start = time.perf_counter()
+    try:
+      return await handler(update, context)
+    finally:
+      logger.info(f"Handled update {update.update_id} ({handler.__name__}) in {time.perf_counter() - start:.2f}s")
+  return wrapper
 
 # Command Handlers
 
@@ -25,18 +69,34 @@ async def clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Clear any stored conversation data for this user
     if context.user_data:
         context.user_data.clear()
+    
+    # The conversation itself is kept by the backend
+    try:
+        response = await backend_client.delete(f"/tele/conversations/{update.effective_chat.id}")
+        if response.status_code != 200:
+            await update.message.reply_text("Sorry, something went wrong")
+            return
+    except Exception as e:
+        await update.message.reply_text(f'Error connecting to server: {str(e)}')
+        return
         
     await update.message.reply_text("Chat context has been cleared.")
 
 # reply with results on /verify {text}
 async def verify_news(update: Update, context: ContextTypes.DEFAULT_TYPE):
+  # A question asked in reply to one of the bot's answers is a follow-up on that claim,
+  # anything else is checked as a new claim
+  reply = update.message.reply_to_message
+  follow_up = False
+
   # if message is preceeded with /verify
   if context.args:
     message = " ".join(context.args)
+    follow_up = reply is not None and reply.from_user is not None and reply.from_user.id == context.bot.id
     
   # if message is replied to using /verify 
-  elif update.message.reply_to_message:
-    message = update.message.reply_to_message.text
+  elif reply:
+    message = reply.text
   
   else:
     await update.message.reply_text("Provide text to verify")
@@ -51,49 +111,127 @@ async def verify_news(update: Update, context: ContextTypes.DEFAULT_TYPE):
   # Backend looks for List[str]
   messages = [message]
   
+  # Lets the backend trace this update end to end
+  headers = {"X-Request-ID": f"tg-{update.update_id}"}
+  
   try:
-    async with aiohttp.ClientSession() as session:
-      async with session.post("http://localhost:3000/tele", json=messages) as response:
-        if response.status == 200:
-          
-          # Get results
-          results = await response.json()
-          
-          # Reply user
-          await update.message.reply_text(results['text'])
-          
-          # Process audio file
-          if 'audio' in results and results["audio"]:
-            # Decode base64 to bianry
-            audio_binary = base64.b64decode(results['audio'])
-            
-            # Write to file
-            with open('results.mp3', 'wb') as f:
-              f.write(audio_binary)
-            
-            # Send audio to user
-            await context.bot.send_voice(
-              chat_id=update.effective_chat.id,
-              voice=open('results.mp3', 'rb')
-            )
-
-        else:
-          await update.message.reply_text("Sorry, something went wrong")
+    # Ask for the audio by id so it is fetched as binary instead of base64 in JSON, as an Opus voice note,
+    # and pass the chat so follow-up questions continue the same conversation
+    params = {"audio_mode": "url", "audio_format": "opus", "chat_id": str(update.effective_chat.id)}
+    if follow_up:
+      params["follow_up"] = "true"
+    response = await backend_client.post("/tele", params=params, json=messages, headers=headers)
+    if response.status_code == 200:
+      
+      # Get results
+      results = response.json()
+      
+      # Reply user, saying so when the check was cut short
+      text = results['text']
+      if results.get("partial"):
+        text += "\n\n(Not fully checked, ran out of time)"
+      await update.message.reply_text(text)
+      
+      # Process audio file
+      if results.get("audio_url"):
+        audio_response = await backend_client.get(results['audio_url'], headers=headers)
+        if audio_response.status_code == 200:
+          # Send audio to user straight from memory, nothing is written to disk
+          await context.bot.send_voice(
+            chat_id=update.effective_chat.id,
+            voice=audio_response.content
+          )
+
+    elif response.status_code in (429, 503):
+      # Too many messages from this chat, or the server is busy
+      wait = response.headers.get("Retry-After", "a few")
+      await update.message.reply_text(f"Wah very busy now, try again in {wait} seconds ah")
+
+    else:
+      await update.message.reply_text("Sorry, something went wrong")
           
   except Exception as e:
     await update.message.reply_text(f'Error connecting to server: {str(e)}')     
     
     
-# Run bot
-def main():
+# backend_app is the backend's ASGI app when the bot runs inside it
+def build_application(token, base_url=None, concurrent_updates=TELEGRAM_CONCURRENT_UPDATES, backend_app=None):
+  async def open_client(application):
+    global backend_client
+    backend_client = open_backend_client(backend_app)
+
+  async def close_client(application):
+    await backend_client.aclose()
+
   # Create application and give token
-  application = Application.builder().token(TOKEN).build()
+  builder = (
+    Application.builder()
+    .token(token)
+    # Handle updates from different chats at the same time instead of one after another
+    .concurrent_updates(concurrent_updates)
+    # The bot's own connections to Telegram, one per update being handled
+    .connection_pool_size(max(1, concurrent_updates))
+    .post_init(open_client)
+    .post_shutdown(close_client)
+  )
+  if backend_app is not None:
+    # Updates are pushed to the webhook route instead of fetched
+    builder = builder.updater(None)
+  if base_url:
+    builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+  application = builder.build()
   
   # Add commands
-  application.add_handler(CommandHandler("start", start))
-  application.add_handler(CommandHandler("help", help_command))
-  application.add_handler(CommandHandler("clear", clear))
-  application.add_handler(CommandHandler("verify", verify_news))
+  application.add_handler(CommandHandler("start", timed(start)))
+  application.add_handler(CommandHandler("help", timed(help_command)))
+  application.add_handler(CommandHandler("clear", timed(clear)))
+  application.add_handler(CommandHandler("verify", timed(verify_news)))
+  return application
+
+
+# The bot in webhook mode: Telegram posts updates to the backend, which hands them to the bot
+class WebhookBot:
+  def __init__(self, token, backend_app, webhook_url, api_url=None, secret=""):
+    self.application = build_application(token, api_url, backend_app=backend_app)
+    self.webhook_url = webhook_url
+    self.secret = secret
+    self.received = 0
+
+  async def start(self):
+    await self.application.initialize()
+    await self.application.post_init(self.application)
+    await self.application.start()
+    # Every replica registers the same URL, so this is safe to repeat behind a load balancer
+    await self.application.bot.set_webhook(
+      url=f"{self.webhook_url}{TELEGRAM_WEBHOOK_PATH}",
+      secret_token=self.secret or None,
+      allowed_updates=Update.ALL_TYPES
+    )
+    logger.info(f"Telegram webhook set to {self.webhook_url}{TELEGRAM_WEBHOOK_PATH}")
+
+  async def stop(self):
+    await self.application.stop()
+    await self.application.post_shutdown(self.application)
+    await self.application.shutdown()
+
+  def authorized(self, secret_header):
+    return not self.secret or secret_header == self.secret
+
+  # Queue the update and return at once, Telegram resends updates it does not get a quick 200 for
+  async def process(self, data):
+    self.received += 1
+    await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+
+# Run bot
+def main():
+  logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+  # The Telegram client logs every Bot API call
+  logging.getLogger("httpx").setLevel(logging.WARNING)
+  if TELEGRAM_WEBHOOK_URL:
+    logger.error("TELEGRAM_WEBHOOK_URL is set, so the bot is served by the backend in webhook mode. Unset it to poll.")
+    return
+  application = build_application(TOKEN, TELEGRAM_API_URL)
   
   # Run bot until CTRL + C
   application.run_polling(allowed_updates=Update.ALL_TYPES)
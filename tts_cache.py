@@ -0,0 +1,211 @@
+import os
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# Cache sizes, in bytes of audio
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+
+logger = logging.getLogger(__name__)
+
+# What cache_key returns, anything else from a client is not looked up on disk
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}(\.ogg)?")
+
+
+# Same answer with different spacing should reuse the same audio
+def normalize_text(text):
+  text = unicodedata.normalize("NFC", text)
+  return " ".join(text.split())
+
+
+def cache_key(text, voice, extension="mp3"):
+  raw = f"{voice}\0{normalize_text(text)}".encode("utf-8")
+  return key_with_extension(hashlib.sha256(raw).hexdigest(), extension)
+
+
+# MP3 keys are the bare hash, other formats such as "ogg" voice notes carry their extension,
+# so their files on disk are named for what they hold
+def key_with_extension(digest, extension="mp3"):
+  return digest if extension == "mp3" else f"{digest}.{extension}"
+
+
+# Two tier cache of TTS audio: in-memory LRU in front of an on-disk store
+class TTSCache:
+  def __init__(self, memory_bytes=TTS_CACHE_MEMORY_BYTES, disk_bytes=TTS_CACHE_DISK_BYTES, directory=TTS_CACHE_DIR):
+    self.memory_bytes = memory_bytes
+    self.disk_bytes = disk_bytes
+    self.directory = directory
+    self.memory = OrderedDict()
+    self.memory_used = 0
+    self.disk = OrderedDict()
+    self.disk_used = 0
+    self.memory_hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.bytes_saved = 0
+    self.lock = threading.Lock()
+
+    if self.disk_bytes > 0:
+      os.makedirs(self.directory, exist_ok=True)
+      self.load_disk_index()
+
+  # Rebuild the disk index, oldest files first
+  def load_disk_index(self):
+    entries = []
+    for name in os.listdir(self.directory):
+      if name.endswith(".mp3"):
+        key = name[:-4]
+      elif name.endswith(".ogg"):
+        key = name
+      else:
+        continue
+      stat = os.stat(os.path.join(self.directory, name))
+      entries.append((stat.st_mtime, key, stat.st_size))
+
+    for _, key, size in sorted(entries):
+      self.disk[key] = size
+      self.disk_used += size
+
+  def path_for(self, key):
+    return os.path.join(self.directory, key if "." in key else f"{key}.mp3")
+
+  def get(self, text, voice, extension="mp3"):
+    key = cache_key(text, voice, extension)
+
+    with self.lock:
+      audio = self.memory.get(key)
+      if audio is not None:
+        self.memory.move_to_end(key)
+        self.memory_hits += 1
+        self.bytes_saved += len(audio)
+        return audio
+
+    # Other server workers write to the same directory, so look on disk even for keys missing from the index
+    if self.disk_bytes > 0:
+      try:
+        with open(self.path_for(key), "rb") as f:
+          audio = f.read()
+        os.utime(self.path_for(key))
+      except OSError:
+        audio = None
+        # Evicted by another server worker
+        with self.lock:
+          if key in self.disk:
+            self.disk_used -= self.disk.pop(key)
+
+      if audio is not None:
+        with self.lock:
+          self.index_disk(key, len(audio))
+          self.disk_hits += 1
+          self.bytes_saved += len(audio)
+          self.put_memory(key, audio)
+        return audio
+
+    with self.lock:
+      self.misses += 1
+    return None
+
+  def put(self, text, voice, audio, extension="mp3"):
+    key = cache_key(text, voice, extension)
+    self.store(key, audio)
+    return key
+
+  def contains(self, key):
+    with self.lock:
+      return key in self.memory or key in self.disk
+
+  # Find audio by its content address without counting it as a lookup.
+  # Returns the bytes when held in memory, otherwise the path of the file on disk.
+  def locate(self, key):
+    if not KEY_PATTERN.fullmatch(key):
+      return None, None
+    with self.lock:
+      audio = self.memory.get(key)
+      if audio is not None:
+        return audio, None
+      if key in self.disk:
+        return None, self.path_for(key)
+
+    # Written by another server worker
+    if self.disk_bytes > 0:
+      try:
+        size = os.path.getsize(self.path_for(key))
+      except OSError:
+        return None, None
+      with self.lock:
+        self.index_disk(key, size)
+      return None, self.path_for(key)
+    return None, None
+
+  def store(self, key, audio):
+    with self.lock:
+      self.put_memory(key, audio)
+
+    if self.disk_bytes <= 0 or len(audio) > self.disk_bytes:
+      return
+
+    # Write to a temp file first so readers never see a partial file
+    tmp_path = f"{self.path_for(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+      with open(tmp_path, "wb") as f:
+        f.write(audio)
+      os.replace(tmp_path, self.path_for(key))
+    except OSError as e:
+      logger.warning(f"Error writing TTS cache file: {str(e)}")
+      return
+
+    with self.lock:
+      self.index_disk(key, len(audio))
+      self.evict_disk()
+
+  # Caller must hold the lock
+  def index_disk(self, key, size):
+    if key not in self.disk:
+      self.disk[key] = size
+      self.disk_used += size
+    self.disk.move_to_end(key)
+
+  # Caller must hold the lock
+  def put_memory(self, key, audio):
+    if len(audio) > self.memory_bytes:
+      return
+
+    if key in self.memory:
+      self.memory_used -= len(self.memory.pop(key))
+
+    self.memory[key] = audio
+    self.memory_used += len(audio)
+
+    while self.memory_used > self.memory_bytes:
+      _, evicted = self.memory.popitem(last=False)
+      self.memory_used -= len(evicted)
+
+  # Caller must hold the lock
+  def evict_disk(self):
+    while self.disk_used > self.disk_bytes and self.disk:
+      key, size = self.disk.popitem(last=False)
+      self.disk_used -= size
+      try:
+        os.remove(self.path_for(key))
+      except OSError:
+        pass
+
+  def stats(self):
+    with self.lock:
+      lookups = self.memory_hits + self.disk_hits + self.misses
+      return {
+        "memory_hits": self.memory_hits,
+        "disk_hits": self.disk_hits,
+        "misses": self.misses,
+        "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        "bytes_saved": self.bytes_saved,
+        "memory_bytes": self.memory_used,
+        "memory_entries": len(self.memory),
+        "disk_bytes": self.disk_used,
+        "disk_entries": len(self.disk)
+      }
@@ -0,0 +1,343 @@
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", str(6 * 60 * 60)))
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "10000"))
+VERDICT_SIMILARITY = float(os.getenv("VERDICT_SIMILARITY", "0.85"))
+
+# MinHash signature layout: NUM_BANDS * ROWS_PER_BAND permutations
+NUM_BANDS = 16
+ROWS_PER_BAND = 4
+NUM_PERM = NUM_BANDS * ROWS_PER_BAND
+SHINGLE_SIZE = 5
+MERSENNE_PRIME = (1 << 61) - 1
+
+_rng = random.Random(1)
+_PERMUTATIONS = [
+  (_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+  for _ in range(NUM_PERM)
+]
+
+
+# Numbers with their currency or percent sign, and negations
+NUMBER = re.compile(r"[$€£¥]?\d+(?:[.,]\d+)*%?")
+NEGATION = re.compile(
+  r"\b(?:no|not|never|none|nobody|nothing|neither|nor|cannot|without|"
+  r"dont|doesnt|didnt|isnt|arent|wasnt|werent|wont|cant|couldnt|shouldnt|wouldnt|havent|hasnt|hadnt|\w+n['’]t)\b"
+)
+
+
+# Forwarded hoaxes differ by case, punctuation, emoji and spacing
+def normalize_claim(text):
+  text = unicodedata.normalize("NFKC", text).lower()
+  text = re.sub(r"[^\w\s]", " ", text)
+  return " ".join(text.split())
+
+
+# Claims that differ in these say different things however similar the rest is, e.g. "GST goes up to 9%"
+# and "GST goes up to 10%", so a cached verdict is only reused when they match exactly
+def key_facts(text):
+  text = unicodedata.normalize("NFKC", text).lower()
+  return " ".join(sorted(NUMBER.findall(text)) + sorted(NEGATION.findall(text)))
+
+
+def shingles(text):
+  if len(text) <= SHINGLE_SIZE:
+    return {text}
+  return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(text):
+  hashed = [
+    int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+    for shingle in shingles(text)
+  ]
+  return tuple(
+    min((a * h + b) % MERSENNE_PRIME for h in hashed)
+    for a, b in _PERMUTATIONS
+  )
+
+
+def similarity(signature_a, signature_b):
+  return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / NUM_PERM
+
+
+def band_keys(signature):
+  return [
+    (band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+    for band in range(NUM_BANDS)
+  ]
+
+
+# Cache of fact-check verdicts that also matches near-duplicate claims. Entries keep the key of
+# the verdict's audio in the TTS cache rather than the audio, which is bounded by bytes there.
+class VerdictCache:
+  def __init__(self, ttl=VERDICT_CACHE_TTL, max_size=VERDICT_CACHE_SIZE, threshold=VERDICT_SIMILARITY):
+    self.ttl = ttl
+    self.max_size = max_size
+    self.threshold = threshold
+    # (namespace, normalized claim) -> entry
+    self.entries = OrderedDict()
+    # (namespace, band) -> keys of entries sharing that band
+    self.buckets = {}
+    self.exact_hits = 0
+    self.similar_hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+  def get(self, namespace, claim):
+    normalized = normalize_claim(claim)
+    facts = key_facts(claim)
+    key = (namespace, normalized)
+    now = time.time()
+
+    # Exact match on the normalized claim first
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None and entry["expires"] > now and entry["facts"] == facts:
+        self.entries.move_to_end(key)
+        self.exact_hits += 1
+        return entry
+
+    signature = minhash(normalized)
+
+    # Then near-duplicates found through the LSH buckets
+    with self.lock:
+      best, best_score = None, 0.0
+      for band in band_keys(signature):
+        for candidate_key in self.buckets.get((namespace, band), ()):
+          candidate = self.entries.get(candidate_key)
+          if candidate is None or candidate["expires"] <= now or candidate["facts"] != facts:
+            continue
+          score = similarity(signature, candidate["signature"])
+          if score > best_score:
+            best, best_score = candidate, score
+
+      if best is not None and best_score >= self.threshold:
+        self.entries.move_to_end(best["key"])
+        self.similar_hits += 1
+        return best
+
+      self.misses += 1
+      return None
+
+  def put(self, namespace, claim, text, audio_key):
+    normalized = normalize_claim(claim)
+    key = (namespace, normalized)
+    entry = {
+      "key": key,
+      "signature": minhash(normalized),
+      "facts": key_facts(claim),
+      "text": text,
+      "audio_key": audio_key,
+      "expires": time.time() + self.ttl
+    }
+
+    with self.lock:
+      if key in self.entries:
+        self.remove(key)
+
+      self.entries[key] = entry
+      for band in band_keys(entry["signature"]):
+        self.buckets.setdefault((namespace, band), set()).add(key)
+
+      self.evict()
+
+  # Caller must hold the lock
+  def remove(self, key):
+    entry = self.entries.pop(key)
+    for band in band_keys(entry["signature"]):
+      bucket = self.buckets.get((key[0], band))
+      if bucket is not None:
+        bucket.discard(key)
+        if not bucket:
+          del self.buckets[(key[0], band)]
+
+  # Caller must hold the lock
+  def evict(self):
+    if len(self.entries) <= self.max_size:
+      return
+
+    now = time.time()
+    expired = [key for key, entry in self.entries.items() if entry["expires"] <= now]
+    for key in expired:
+      self.remove(key)
+
+    while len(self.entries) > self.max_size:
+      self.remove(next(iter(self.entries)))
+
+  def stats(self):
+    with self.lock:
+      lookups = self.exact_hits + self.similar_hits + self.misses
+      return {
+        "entries": len(self.entries),
+        "exact_hits": self.exact_hits,
+        "similar_hits": self.similar_hits,
+        "misses": self.misses,
+        "hit_ratio": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0
+      }
+
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+  namespace TEXT NOT NULL,
+  claim TEXT NOT NULL,
+  signature TEXT NOT NULL,
+  facts TEXT NOT NULL,
+  text TEXT NOT NULL,
+  audio_key TEXT,
+  expires REAL NOT NULL,
+  accessed REAL NOT NULL,
+  PRIMARY KEY (namespace, claim)
+);
+CREATE INDEX IF NOT EXISTS verdicts_accessed ON verdicts (accessed);
+CREATE INDEX IF NOT EXISTS verdicts_expires ON verdicts (expires);
+CREATE TABLE IF NOT EXISTS verdict_bands (
+  namespace TEXT NOT NULL,
+  band TEXT NOT NULL,
+  claim TEXT NOT NULL,
+  PRIMARY KEY (namespace, band, claim)
+);
+"""
+
+
+# Band keys that mean the same thing in every process
+def band_names(signature):
+  return [f"{band}:" + ",".join(map(str, rows)) for band, rows in band_keys(signature)]
+
+
+# Verdict cache kept in SQLite so every server worker shares the same entries
+class SharedVerdictCache:
+  def __init__(self, path, ttl=VERDICT_CACHE_TTL, max_size=VERDICT_CACHE_SIZE, threshold=VERDICT_SIMILARITY):
+    self.path = path
+    self.ttl = ttl
+    self.max_size = max_size
+    self.threshold = threshold
+    self.exact_hits = 0
+    self.similar_hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    # Verdicts from before entries kept their key facts and audio key are dropped, the cache refills
+    columns = {row[1] for row in self.db.execute("PRAGMA table_info(verdicts)")}
+    if columns and "facts" not in columns:
+      self.db.executescript("DROP TABLE IF EXISTS verdicts; DROP TABLE IF EXISTS verdict_bands;")
+    self.db.executescript(SHARED_SCHEMA)
+
+  def entry(self, namespace, row):
+    claim, signature, text, audio_key, expires = row
+    return {
+      "key": (namespace, claim),
+      "signature": tuple(json.loads(signature)),
+      "text": text,
+      "audio_key": audio_key,
+      "expires": expires
+    }
+
+  def get(self, namespace, claim):
+    normalized = normalize_claim(claim)
+    facts = key_facts(claim)
+    now = time.time()
+
+    # Exact match on the normalized claim first
+    with self.lock:
+      row = self.db.execute(
+        "SELECT claim, signature, text, audio_key, expires FROM verdicts WHERE namespace = ? AND claim = ? AND facts = ? AND expires > ?",
+        (namespace, normalized, facts, now)
+      ).fetchone()
+      if row is not None:
+        self.touch(namespace, normalized, now)
+        self.exact_hits += 1
+        return self.entry(namespace, row)
+
+    signature = minhash(normalized)
+    bands = band_names(signature)
+
+    # Then near-duplicates sharing at least one LSH band
+    with self.lock:
+      rows = self.db.execute(
+        "SELECT DISTINCT v.claim, v.signature, v.text, v.audio_key, v.expires FROM verdict_bands b "
+        "JOIN verdicts v ON v.namespace = b.namespace AND v.claim = b.claim "
+        f"WHERE b.namespace = ? AND b.band IN ({','.join('?' * len(bands))}) AND v.facts = ? AND v.expires > ?",
+        (namespace, *bands, facts, now)
+      ).fetchall()
+
+      best, best_score = None, 0.0
+      for row in rows:
+        candidate = self.entry(namespace, row)
+        score = similarity(signature, candidate["signature"])
+        if score > best_score:
+          best, best_score = candidate, score
+
+      if best is not None and best_score >= self.threshold:
+        self.touch(namespace, best["key"][1], now)
+        self.similar_hits += 1
+        return best
+
+      self.misses += 1
+      return None
+
+  # Caller must hold the lock
+  def touch(self, namespace, claim, now):
+    self.db.execute("UPDATE verdicts SET accessed = ? WHERE namespace = ? AND claim = ?", (now, namespace, claim))
+
+  def put(self, namespace, claim, text, audio_key):
+    normalized = normalize_claim(claim)
+    signature = minhash(normalized)
+    now = time.time()
+
+    with self.lock:
+      self.db.execute("BEGIN IMMEDIATE")
+      try:
+        self.db.execute("DELETE FROM verdict_bands WHERE namespace = ? AND claim = ?", (namespace, normalized))
+        self.db.execute(
+          "INSERT OR REPLACE INTO verdicts (namespace, claim, signature, facts, text, audio_key, expires, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+          (namespace, normalized, json.dumps(signature), key_facts(claim), text, audio_key, now + self.ttl, now)
+        )
+        self.db.executemany(
+          "INSERT OR IGNORE INTO verdict_bands (namespace, band, claim) VALUES (?, ?, ?)",
+          [(namespace, band, normalized) for band in band_names(signature)]
+        )
+        self.evict(now)
+        self.db.execute("COMMIT")
+      except BaseException:
+        self.db.execute("ROLLBACK")
+        raise
+
+  # Caller must hold the lock, inside a transaction
+  def evict(self, now):
+    removed = self.db.execute("DELETE FROM verdicts WHERE expires <= ?", (now,)).rowcount
+    count = self.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+    if count > self.max_size:
+      removed += self.db.execute(
+        "DELETE FROM verdicts WHERE rowid IN (SELECT rowid FROM verdicts ORDER BY accessed LIMIT ?)",
+        (count - self.max_size,)
+      ).rowcount
+
+    if removed:
+      self.db.execute(
+        "DELETE FROM verdict_bands WHERE NOT EXISTS "
+        "(SELECT 1 FROM verdicts v WHERE v.namespace = verdict_bands.namespace AND v.claim = verdict_bands.claim)"
+      )
+
+  def stats(self):
+    with self.lock:
+      entries = self.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+      lookups = self.exact_hits + self.similar_hits + self.misses
+      return {
+        "entries": entries,
+        "exact_hits": self.exact_hits,
+        "similar_hits": self.similar_hits,
+        "misses": self.misses,
+        "hit_ratio": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0
+      }